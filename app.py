@@ -2,31 +2,153 @@
 Python app to interface with Closetly MySQL database
 """
 import sys  # to print error messages to sys.stderr
+import argparse # command-line options
+import csv # for importing outfits
+import decimal # exact prices
+import json
 import mysql.connector
 # To get error codes from the connector, useful for user-friendly
 # error-handling
 import mysql.connector.errorcode as errorcode
-import pandas as pd # cleans up output + adds some extra python functionality
+import functools
+import threading
+from pool import ConnectionPool, RoutingPool
+from backends import MySQLBackend, SQLiteBackend
+from cache import InventoryCache
+import wears # buffered wear logging
+import statements # every SQL statement the app runs
+# database account (user, password) for each role
+from statements import DB_ACCOUNTS
+from metrics import METRICS # query and command latencies
+import search
+from tables import print_table
 
 # Debugging flag to print errors when debugging that shouldn't be visible
 # to an actual client. Set to False when done testing.
 DEBUG = False # MAKE FALSE WHEN SUBMITTING  
 
+# Number of rows fetched and printed at a time by the listing commands,
+# can be changed with --page-size
+PAGE_SIZE = 50
+
+# Listings that can be exported with --export, besides store:<name>
+EXPORTS = {
+    'clothes': 'show_all_clothes',
+    'collab': 'show_collaborative_clothes',
+}
+
+# Number of outfit pieces written per multi-row INSERT
+OUTFIT_BATCH_SIZE = 1000
+
+# Inventory cache settings
+INVENTORY_CACHE_SIZE = 256 # query results
+INVENTORY_CACHE_TTL = 60 # seconds
+
+# Most matching items find_available returns per piece looked up
+AVAILABLE_PER_PIECE = 20
+
+# Outfit suggestion settings, see recommend.py
+SUGGESTIONS = 10 # items suggested at a time
+RECOMMEND_REFRESH = 10 # seconds before picking up new clothes and outfits
+RECOMMEND_REBUILD = 600 # seconds before loading every item again
+
+# Wears are written to the database once this many have been recorded
+# or the oldest has waited this many seconds, see wears.py
+WEAR_FLUSH_EVENTS = 100
+WEAR_FLUSH_SECONDS = 30
+# File wears are also appended to until they are written, so they are
+# not lost if the app stops first; set with --wear-journal
+WEAR_JOURNAL = None
+
+# Statements slower than this are logged with their EXPLAIN output, can
+# be changed with --slow-query-ms (None turns the log off)
+SLOW_QUERY_MS = None
+# File the query and command metrics are written to on exit and on
+# SIGUSR1, set with --metrics (.json for JSON, Prometheus text otherwise)
+METRICS_PATH = None
+
+# Database servers as (host, port). Find the port in MAMP or MySQL
+# Workbench GUI or with SHOW VARIABLES WHERE variable_name LIKE 'port';
+# Can be changed with --primary and --replica. Reads go to the replicas
+# if there are any, see pool.RoutingPool.
+PRIMARY = ('localhost', 3306)
+REPLICAS = []
+# How long a read waits for a replica to apply the session's last write
+# before going to the primary (with GTIDs), or how long reads stay on
+# the primary after a write (without), in seconds
+REPLICA_WAIT = 0.05
+REPLICA_STICKY_SECONDS = 5
+
+# Database the app runs on: a MySQL server (at PRIMARY and REPLICAS), or
+# a SQLite file given with --sqlite, see backends.py
+BACKEND = MySQLBackend()
+
+# Connection pool settings, per database account
+POOL_MIN_SIZE = 1
+POOL_MAX_SIZE = 5
+POOL_IDLE_TIMEOUT = 300 # seconds
+
+
+def connect(user, password, host=PRIMARY[0], port=PRIMARY[1],
+            autocommit=False, **options):
+    """
+    Opens a new connection for the given database account on BACKEND, to
+    the primary unless another server is given. Used by the connection
+    pool; the rest of the app should call get_conn.
+    """
+    return BACKEND.connect(user, password, host=host, port=port,
+                           autocommit=autocommit, **options)
+
+def make_pool(primary=PRIMARY, replicas=REPLICAS):
+    """
+    Returns a connection pool for the given primary (host, port), routing
+    reads to the given replicas if there are any (see pool.RoutingPool).
+    """
+    def pool_for(host, port, **options):
+        return ConnectionPool(
+            functools.partial(connect, host=host, port=port, **options),
+            min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE,
+            idle_timeout=POOL_IDLE_TIMEOUT)
+    if not replicas:
+        return pool_for(*primary)
+    # the primary reports each commit's GTID, to know when a replica has
+    # applied the session's writes; replica connections only read, and
+    # autocommit keeps them from holding one snapshot (and so missing new
+    # writes) for good
+    return RoutingPool(pool_for(*primary, track_gtids=True),
+                       [pool_for(host, port, autocommit=True)
+                        for host, port in replicas],
+                       replica_wait=REPLICA_WAIT,
+                       sticky_seconds=REPLICA_STICKY_SECONDS)
+
+def host_port(value):
+    """
+    Parses HOST[:PORT] for --primary and --replica.
+    """
+    host, _, port = value.partition(':')
+    return host, int(port or 3306)
+
+POOL = make_pool()
+
+# Cached store inventory query results, see store_rows
+INVENTORY_CACHE = InventoryCache(max_entries=INVENTORY_CACHE_SIZE,
+                                 ttl=INVENTORY_CACHE_TTL)
+
+# Wears waiting to be written, see record_wears
+WEARS = wears.WearBuffer(max_events=WEAR_FLUSH_EVENTS,
+                         max_seconds=WEAR_FLUSH_SECONDS)
+
+# Outfit suggestion model (a recommend.CachedModel), created the first
+# time suggestions are asked for, see suggest_items
+RECOMMENDER = None
+
 def get_conn(user, password):
     """"
-    Returns a connected MySQL connector instance, if connection is successful.
-    If unsuccessful, exits.
+    Returns a connected MySQL connector instance from the connection pool,
+    if connection is successful. If unsuccessful, exits.
     """
     try:
-        conn = mysql.connector.connect(
-          host='localhost',
-          user=user,
-          # Find port in MAMP or MySQL Workbench GUI or with
-          # SHOW VARIABLES WHERE variable_name LIKE 'port';
-          port='3306',
-          password=password,
-          database='closetly'
-        )
+        conn = POOL.acquire(user, password)
         if DEBUG:
             print('Successfully connected.')
         return conn
@@ -45,44 +167,62 @@ def get_conn(user, password):
             sys.stderr('An error occurred, please contact the administrator.')
         sys.exit(1)
 
+def warm_pool():
+    """
+    Opens a connection for every role's database account in the
+    background, so that changing connections after login does not have to
+    wait on a new handshake.
+    """
+    def warm_all():
+        for user, password in DB_ACCOUNTS.values():
+            try:
+                POOL.warm(user, password)
+            except mysql.connector.Error as err:
+                if DEBUG:
+                    print('Could not warm pool for ' + user + ':', err)
+    threading.Thread(target=warm_all, daemon=True).start()
+
 # ----------------------------------------------------------------------
 # Functions for Logging Users In
 # ----------------------------------------------------------------------
-def check_username(username):
+class Session:
     """
-    Checks if a username already exists in the app. 
-    Returns True if it already exists, False if it is a new username.
+    Who is logged in: their username, role (as stored in permissions) and
+    user ID, looked up once at login and reused from then on, and the
+    session token they logged in with or were given, if any (see
+    sessions.py).
     """
-    # access user_info to obtain the set of all usernames available
-    sql = "SELECT COUNT(*) FROM (SELECT username FROM user_info" +\
-          " WHERE username='" + username + "') as matches;"
-    cursor = conn.cursor(buffered=True)
-    cursor.execute(sql)
-    # check if the given username exists in the username table
-    # return true if it does exist and false if not
-    a=cursor.fetchone()[0]
-    return bool(a)
-    # return bool(cursor.fetchone()[0])
+    def __init__(self, username=None, role=None, user_id=None, token=None):
+        self.username = username
+        self.role = role
+        self.user_id = user_id
+        self.token = token
 
-def authenticate_login(username, password):
+# The logged in user, set by login
+session = Session()
+
+@METRICS.timed
+def lookup_login(username, password):
     """
-    Authenticates login by matching the username and password with the
-    encrypted passwords. 
+    Looks up everything needed to log a user in with a single query.
+    Returns (exists, authenticated, Session), where the Session is only
+    filled in if the password is right.
     """
-    sql = 'SELECT authenticate (%s, %s);'
-    cursor = conn.cursor()
-    cursor.execute(sql, (username, password))
-    return bool(cursor.fetchone()[0])
+    exists, authenticated, role, user_id = statements.fetchone(
+        conn, 'login', (password, username, username))
+    if not authenticated:
+        return bool(exists), False, Session()
+    return True, True, Session(username, role, user_id)
 
+@METRICS.timed
 def add_user(name, username, password):
     """
     Calls SQL procedures to add a new user to the database as well
     as binding passwords to the username. 
     """
-    cursor = conn.cursor()
-    cursor.callproc('sp_add_user', args=(username, password))
+    statements.execute(conn, 'add_user', (username, password))
     conn.commit()
-    cursor.callproc('add_to_user', args=(name, username))
+    statements.execute(conn, 'add_to_user', (name, username))
     conn.commit()
     return username
 
@@ -106,99 +246,139 @@ def get_account_type():
 
 def change_connection(account_type):
     """
-    Given the account type (personal, stylist, store owner, admin) of a user,
+    Given the account type (personal, stylist, storeowner, appadmin) of a user,
     changes the connection so that the right privileges are granted. 
     """
-    # changes connection based on permission level
-    conn.close()
-    if account_type == 'storeowner':
-        return get_conn('storeowner', 'storeownerpw')
-    elif account_type == 'stylist':
-        return get_conn('stylist', 'stylistpw')
-    elif account_type == 'personal':
-        return get_conn('personal', 'personalpw')
-    elif account_type == 'admin':
-        return get_conn('appadmin', 'adminpw')
-    else: 
-        # give general 'appclient' privileges
-        return get_conn('personal', 'personalpw')
-
-def get_permission(username):
-    """
-    Gets the user type (personal, stylist, store owner, or admin) of the
-    given user based on the username.  
-    """
-    sql = "SELECT role FROM permissions WHERE username='"+username+"';"
-    cursor = conn.cursor()
-    cursor.execute(sql)
-    # check if the given username exists in the username table
-    # return true if it does exist and false if not
-    return cursor.fetchone()[0]
+    # changes connection based on permission level, handing the current
+    # connection back to the pool instead of closing it
+    POOL.release(conn)
+    # give general 'appclient' privileges if the account type is unknown
+    user, password = DB_ACCOUNTS.get(account_type, DB_ACCOUNTS['personal'])
+    return get_conn(user, password)
 
 def login():
     """
     Login function for the Closetly app. 
-    Takes user input for the username, and prompts for the password to log
-    the user in or prompts for additional information to create a new 
-    account. 
+    Takes user input for the username and password to log the user in,
+    or prompts for additional information to create a new account.
+    Checking the password, finding the user's role and user ID all take
+    a single query, and the result is kept in session.
     Updates the connection based on what user type has logged in. 
     """
-    # conn = get_conn('appadmin', 'adminpw')
+    global conn, session
     username = input("Enter username: ")
-    valid_username = check_username(username)
-    global conn
-    if valid_username == True:
-        # initiate password authentication & continue 
-        password = input("Enter password: ")
-        if authenticate_login(username, password): # authenticated 
-            # change connection type 
-            perma = get_permission(username)
-            print(perma)
-            conn = change_connection(perma)
-            return username
+    password = input("Enter password: ")
+    exists, authenticated, identity = lookup_login(username, password)
+    if authenticated:
+        session = identity
+        print(session.role)
+        # change connection type 
+        conn = change_connection(session.role)
+        return username
+    if exists:
         print("Incorrect login")
         quit_ui()
+    # prompt to create new account
+    create_new_acc = input("There is no account with this username. " +
+                           "Would you like to create one? [Y/N]\n")
+    if create_new_acc.upper() == 'Y':
+        if len(username) > 20:
+            print('Username is too long. Must be 20 characters or less.')
+            return login()
+        if len(password) > 20:
+            print('Password is too long. Must be 20 characters or less.')
+            return login()
+        name = input('What is your name (first and last)?\n')
+        # handle different account types
+        account_type = get_account_type()
+        # add account type and password to user information, then log in
+        # as the new user
+        statements.execute(conn, 'add_permission', (username, account_type))
+        conn.commit()
+        add_user(name, username, password)
+        session = lookup_login(username, password)[2]
+        # change connection to the correct user 
+        conn = change_connection(account_type)
+        return username
+    elif create_new_acc.upper() == 'N':
+        print('Have a nice day!')
+        quit_ui()
     else:
-        # prompt to create new account
-        create_new_acc = input("Would you like to create an account? [Y/N]\n")
-        if create_new_acc.upper() == 'Y':
-            name = input('What is your name (first and last)?\n')
-
-            if len(username) > 20:
-                username = input('Username is too long. \
-                                  Must be 20 characters or less.\n')
-                return login()
-
-            # handle different account types
-            account_type = get_account_type()
-            # add account type to user information
-            cursor = conn.cursor()
-            cursor.callproc('user_add_permission', \
-                            args=(username, account_type))
-            conn.commit()
-            # change connection to the correct user 
-            conn = change_connection(account_type)
-
-            new_password = input("What would you like your password to be?\n")
-            while len(new_password) > 20:
-                new_password = input('Password is too long. Must be 20 \
-                                      characters or less:\n')
-            add_user(name, username, new_password)
-            return username
-            
-        elif create_new_acc.upper() == 'N':
-            print('Have a nice day!')
-            quit_ui()
-        else:
-            print('Sorry, this is not a valid response :( Please try again.')
-            login()
-        # if yes: add to user_info and login 
-        # if no: quit
+        print('Sorry, this is not a valid response :( Please try again.')
+        return login()
 
 # ----------------------------------------------------------------------
 # Functions for Command-Line Options/Query Execution
 # ----------------------------------------------------------------------
 
+def store_rows(store_name, name, params):
+    """
+    Returns (column names, rows) of a query over the given store's
+    inventory, reading through the inventory cache. params must be the
+    statement's full parameters.
+    """
+    result = INVENTORY_CACHE.get(store_name, (name, params))
+    if result is None:
+        columns, rows = statements.query(conn, name, params)
+        result = (columns, tuple(rows))
+        INVENTORY_CACHE.put(store_name, (name, params), result)
+    return result
+
+def store_changed(store_name):
+    """
+    Commits a write to the given store's inventory and drops its cached
+    query results.
+    """
+    conn.commit()
+    INVENTORY_CACHE.invalidate(store_name)
+
+def pages(name, params, store_name=None):
+    """
+    Yields (column names, rows) for every page of one of the paginated
+    listing statements. Pages are fetched with keyset pagination on
+    clothing_id, so later pages cost as much as the first one. Each page
+    asks for one row more than it shows, to know whether there is another
+    page without running the query again. Pages of a single store's
+    inventory go through the inventory cache.
+    """
+    last_id = 0
+    while True:
+        page_params = params + (last_id, PAGE_SIZE + 1)
+        if store_name is not None:
+            columns, rows = store_rows(store_name, name, page_params)
+        else:
+            # the LIMIT keeps this to one page and the extra row
+            columns, rows = statements.query(conn, name, page_params)
+        more = len(rows) > PAGE_SIZE
+        rows = rows[:PAGE_SIZE]
+        if rows:
+            yield columns, rows
+        if not more:
+            break
+        last_id = rows[-1][columns.index('clothing_id')]
+
+def print_pages(name, params, store_name=None):
+    """
+    Prints the rows of one of the paginated listing statements a page at a
+    time, so the first rows show up right away and only one page is ever
+    held in memory.
+    """
+    shown = 0
+    for columns, rows in pages(name, params, store_name):
+        print_table(rows, columns, start=shown)
+        shown += len(rows)
+    if shown == 0:
+        print('(no rows)')
+
+def print_query(name, params=()):
+    """
+    Runs one of the statements and prints its result as a table.
+    """
+    columns, rows = statements.query(conn, name, params)
+    print_table(rows, columns)
+
+
+@METRICS.timed
 def show_all_clothes():
     """
     Shows a list of all the clothing in the database. Includes all clothes
@@ -206,32 +386,17 @@ def show_all_clothes():
     """
     print('This is all the clothing items in the personal, collaborative, ' + \
           'and store closets:\n')
-    sql = 'SELECT * FROM clothes;'
-    cursor = conn.cursor()
-    cursor.execute(sql)
-    rows = cursor.fetchall()
-    df = pd.DataFrame(rows, columns=['clothing_id','clothing_type','size',\
-                                     'gender','color','brand','description',\
-                                     'image_url','aesthetic','store_name'])
-    print(df)
+    print_pages('show_all_clothes', ())
 
+@METRICS.timed
 def show_personal_clothes(username):
     """
     Shows a list of all the clothing in the user's personal closet.
     """
+    # so that num_wears includes the wears logged so far
+    flush_wears()
     print('This is all the clothing items in your personal closet:\n')
-    sql = """SELECT clothing_id, clothing_type, size, gender, color, brand,
-           description, image_url, aesthetic, is_clean, shared, num_wears
-           FROM clothes NATURAL JOIN personal_closet NATURAL JOIN user
-           WHERE username = '""" + username + "';"
-    cursor = conn.cursor()
-    cursor.execute(sql)
-    rows = cursor.fetchall()
-    df = pd.DataFrame(rows, columns=['clothing_id','clothing_type','size',\
-                                     'gender','color','brand','description',\
-                                     'image_url','aesthetic','is_clean',\
-                                     'shared', 'num_wears'])
-    print(df)
+    print_query('show_personal_clothes', (username,))
 
 def borrow_from_collab_closet(user_id):
     """
@@ -241,35 +406,148 @@ def borrow_from_collab_closet(user_id):
     """
     clothing_id = input("What is the clothing ID of the item you " + \
                         "would like to borrow?\n")
-    sql = 'SELECT borrow_item(%s, %s);'
-    cursor = conn.cursor(buffered=True)
-    cursor.execute(sql, (user_id, clothing_id))
-    res = cursor.fetchone()[0]
+    res = statements.fetchone(conn, 'borrow_item', (user_id, clothing_id))[0]
+    conn.commit()
     if res == 1:
         print('Item successfully borrowed!')
+        return
+    print('Sorry, you cannot borrow this item right now :(')
+    ans = input('Would you like to join the waitlist for it? ' + \
+                'Enter y/n: ').lower()
+    if ans and ans[0] == 'y':
+        join_waitlist(user_id, clothing_id)
+
+def join_waitlist(user_id, clothing_id):
+    """
+    Puts a user on the waitlist for a collaborative closet item, so that
+    it is lent to them as soon as it is returned, in the order they
+    joined. If it has become available in the meantime, it is borrowed
+    right away.
+    """
+    res = statements.fetchone(conn, 'join_waitlist',
+                              (user_id, clothing_id))[0]
+    conn.commit()
+    if res == 0:
+        print('The item was just returned, so you borrowed it!')
+    elif res > 0:
+        print('You are number ' + str(res) + ' on the waitlist. The ' + \
+              'item will be lent to you when it is your turn.')
     else:
-        print('Sorry, you cannot borrow this item :(')
+        print('Sorry, you cannot wait for this item: it is not in the ' + \
+              'collaborative closet, it is yours, or you already have it.')
+
+def return_to_collab_closet(user_id):
+    """
+    Lets a user return an item they borrowed from the collaborative
+    closet. It goes to the next user on its waitlist, if there is one.
+    """
+    clothing_id = input('What is the clothing ID of the item you ' + \
+                        'would like to return?\n')
+    res = statements.fetchone(conn, 'return_item', (user_id, clothing_id))[0]
+    conn.commit()
+    if res == 0:
+        print('Item returned, thank you!')
+    elif res > 0:
+        print('Item returned and lent to the next user on its waitlist, ' + \
+              'thank you!')
+    else:
+        print('You are not borrowing this item.')
+
+@METRICS.timed
+def show_borrowed_and_waitlist(user_id):
+    """
+    Shows the collaborative closet items a user is borrowing and the ones
+    they are waiting for, with their place on each waitlist.
+    """
+    print('These are the clothing items you are borrowing:\n')
+    print_query('show_borrowed', (user_id,))
+    print('\nThese are the clothing items you are waiting for:\n')
+    print_query('show_waitlist', (user_id,))
+
+@METRICS.timed
+def leave_waitlist(user_id, clothing_id):
+    """
+    Takes a user off the waitlist for an item. Returns whether they were
+    on it.
+    """
+    left = statements.execute(conn, 'leave_waitlist',
+                              (user_id, clothing_id)).rowcount == 1
+    conn.commit()
+    return left
+
+def manage_waitlist(user_id):
+    """
+    Shows what a user is borrowing and waiting for, and lets them leave a
+    waitlist.
+    """
+    show_borrowed_and_waitlist(user_id)
+    clothing_id = input('Enter the clothing ID of an item to stop ' + \
+                        'waiting for it, or nothing to go back: ').strip()
+    if clothing_id:
+        print('You left the waitlist.' if leave_waitlist(user_id, clothing_id)
+              else 'You are not waiting for this item.')
+
+@METRICS.timed
+def record_wears(user_id, clothing_ids, times=1):
+    """
+    Records that a user wore the given items from their closet, times
+    times each. Wears are buffered (see wears.py) and written once a
+    flush is due.
+    """
+    due = False
+    for clothing_id in clothing_ids:
+        due = WEARS.record(user_id, clothing_id, times) or due
+    if due:
+        flush_wears()
 
+@METRICS.timed
+def flush_wears():
+    """
+    Writes the buffered wears, on the personal account whatever the
+    user's role, since it is the one that can update closets. Returns the
+    number of closet items updated.
+    """
+    if not WEARS.pending:
+        return 0
+    wear_conn = get_conn(*DB_ACCOUNTS['personal'])
+    try:
+        return wears.flush(wear_conn, WEARS)
+    finally:
+        POOL.release(wear_conn)
+
+def log_wears(user_id):
+    """
+    Asks which clothes a user wore and records them.
+    """
+    if user_id is None:
+        print('Your account has no closet to log wears in.')
+        return
+    try:
+        clothing_ids = list(map(int, input('What are the clothing IDs of ' +
+                                           'the items you wore? Separate ' +
+                                           'them with spaces (e.g. 1 2 4)\n'
+                                           ).split()))
+    except ValueError:
+        print('Clothing IDs must be numbers.')
+        return
+    try:
+        record_wears(user_id, clothing_ids)
+    except mysql.connector.Error as err:
+        # the wears stay buffered and are written with the next ones
+        if DEBUG:
+            print(err)
+    print('Logged ' + str(len(clothing_ids)) + ' worn items.')
+
+@METRICS.timed
 def show_collaborative_clothes():
     """
     Shows a list of all the clothing in the collaborative closet.
     """
     print('This is all the clothing items you can borrow from the' + \
           ' colaborative closet:\n')
-    sql = """SELECT user_id, clothing_id, clothing_type, size, gender, color, \
-             brand, description, image_url, aesthetic, curr_condition, \
-             is_available, current_borrower
-             FROM collab_closet NATURAL JOIN clothes;"""
-    cursor = conn.cursor()
-    cursor.execute(sql)
-    rows = cursor.fetchall()
-    df = pd.DataFrame(rows, columns=['user_id','clothing_id','clothing_type',\
-                                     'size','gender','color','brand',\
-                                     'description','image_url','aesthetic',\
-                                     'curr_condition','is_available',\
-                                     'current_borrower'])
-    print(df)
+    print_pages('show_collaborative_clothes', ())
 
+@METRICS.timed
 def show_user_in_collab(user_id):
     """
     Shows all the clothing a specific user is loaning in the collaborative
@@ -277,38 +555,51 @@ def show_user_in_collab(user_id):
     """
     print('This is all the clothing items ' + user_id\
            + ' has in the colaborative' + ' closet:\n')
-    sql = """SELECT clothing_id, clothing_type, size, gender, color,
-           brand, description, image_url, aesthetic, curr_condition,
-           is_available, current_borrower
-           FROM collab_closet NATURAL JOIN clothes 
-           WHERE user_id = '""" + user_id + "';"
-    cursor = conn.cursor()
-    cursor.execute(sql)
-    rows = cursor.fetchall()
-    df = pd.DataFrame(rows, columns=['clothing_id','clothing_type','size',\
-                                     'gender','color','brand','description',\
-                                     'image_url','aesthetic','curr_condition',\
-                                     'is_available','curr_borrower'])
-    print(df)
+    print_query('show_user_in_collab', (user_id,))
 
+@METRICS.timed
 def show_store_inventory(store_name):
     """
     Shows a list of all the clothing in the given store's inventory.
     """
     print('This is all the clothing items currently being sold at '\
            + store_name + ':\n')
-    sql = """SELECT clothing_id, price, discount, clothing_type, size, 
-           gender, color, brand, description, image_url, aesthetic 
-           FROM store_closet NATURAL JOIN clothes
-           WHERE store_name = '""" + store_name + "';"
-    cursor = conn.cursor()
-    cursor.execute(sql)
-    rows = cursor.fetchall()
-    df = pd.DataFrame(rows, columns=['clothing_id','price', 'discount',\
-                                     'clothing_type','size','gender','color',\
-                                     'brand','description','image_url',\
-                                     'aesthetic'])
-    print(df)
+    print_pages('show_store_inventory', (store_name,), store_name=store_name)
+
+@METRICS.timed
+def search_store(filters, limit=50):
+    """
+    Runs a faceted search (see search.py) and prints the first limit
+    matches along with how many matches there are for each value of each
+    facet. Searches within one store read through the inventory cache.
+    """
+    name, _, params, _ = search.plan(filters)
+    store_name = filters.get('store_name')
+    if isinstance(store_name, str) and store_name:
+        key = (name, params, limit)
+        result = INVENTORY_CACHE.get(store_name, key)
+        if result is None:
+            result = search.search(conn, filters, limit)
+            INVENTORY_CACHE.put(store_name, key, result)
+    else:
+        result = search.search(conn, filters, limit)
+    rows, counts, total = result
+    print_table(rows, search.COLUMNS)
+    print('Showing ' + str(len(rows)) + ' of ' + str(total) + ' matches.')
+    for facet, values in counts.items():
+        if len(values) > 1:
+            print('  ' + facet + ': ' + ', '.join(
+                str(value) + ' (' + str(count) + ')'
+                for value, count in values.most_common(10)))
+
+@METRICS.timed
+def keyword_search(keywords, limit=50):
+    """
+    Shows the items for sale or in the collaborative closet whose
+    description, brand, or aesthetic best match the given keywords, most
+    relevant first.
+    """
+    print_query('keyword_search', (keywords, keywords, limit))
 
 def filter_store_by_price(store_name, min_price, max_price):
     """
@@ -316,20 +607,9 @@ def filter_store_by_price(store_name, min_price, max_price):
     in a given store.
     """
     print('This is all the clothing items currently being sold at '\
-           + store_name + 'for under $' + max_price + ':\n')
-    sql = """SELECT clothing_id, price, discount, clothing_type, size,
-           gender, color, brand, description, image_url, aesthetic 
-           FROM store_closet NATURAL JOIN clothes
-           WHERE store_name='""" + store_name + "' AND price <= '" + max_price +\
-           "' AND price >= '" + min_price + "' ORDER BY price;"
-    cursor = conn.cursor()
-    cursor.execute(sql)
-    rows = cursor.fetchall()
-    df = pd.DataFrame(rows, columns=['clothing_id','price', 'discount',\
-                                     'clothing_type','size','gender','color',\
-                                     'brand','description','image_url',\
-                                     'aesthetic'])
-    print(df)
+           + store_name + ' for under $' + max_price + ':\n')
+    search_store({'store_name': store_name, 'min_price': min_price,
+                  'max_price': max_price})
 
 def filter_store_by_type(store_name, clothing_type):
     """
@@ -337,19 +617,8 @@ def filter_store_by_type(store_name, clothing_type):
     in a given store.
     """
     print('This is all the clothing items of the type (' + clothing_type + \
-          ') currently being sold at' + store_name + ':\n')
-    sql = """SELECT clothing_id, price, discount, clothing_type, size,
-           gender, color, brand, description, image_url, aesthetic 
-           FROM store_closet NATURAL JOIN clothes
-           WHERE clothing_type = '""" + clothing_type + "';"
-    cursor = conn.cursor()
-    cursor.execute(sql)
-    rows = cursor.fetchall()
-    df = pd.DataFrame(rows, columns=['clothing_id','price', 'discount',\
-                                     'clothing_type','size','gender','color',\
-                                     'brand','description','image_url',\
-                                     'aesthetic'])
-    print(df)
+          ') currently being sold at ' + store_name + ':\n')
+    search_store({'store_name': store_name, 'clothing_type': clothing_type})
 
 def filter_store_by_discount(store_name, min_discount, max_discount):
     """
@@ -358,94 +627,296 @@ def filter_store_by_discount(store_name, min_discount, max_discount):
     """
     print('This is all the clothing items currently being sold in the' +\
           ' designated discount range at ' + store_name + ':\n')
-    sql = """SELECT clothing_id, price, discount, clothing_type, size,
-           gender, color, brand, description, image_url, aesthetic 
-           FROM store_closet NATURAL JOIN clothes
-           WHERE discount >= '""" + min_discount + "' AND discount <= '"\
-           + max_discount + "' ORDER BY discount;"
-    cursor = conn.cursor()
-    cursor.execute(sql)
-    rows = cursor.fetchall()
-    df = pd.DataFrame(rows, columns=['clothing_id','price', 'discount',\
-                                     'clothing_type','size','gender','color',\
-                                     'brand','description','image_url',\
-                                     'aesthetic'])
-    print(df)
-
-def check_outfit_id(id):
-    """
-    Checks if the outfit id already exists in the database. 
-    Returns True if it does exist, False if it does not. 
-    """
-    # access styled_outfits to obtain the set of all usernames available
-    sql = "SELECT COUNT(*) FROM (SELECT DISTINCT outfit_id FROM"\
-           + " styled_outfits WHERE outfit_id='"\
-           + id + "') as matches;"
-    cursor = conn.cursor(buffered=True)
-    cursor.execute(sql)
-    # check if the given outfit id exists in the styled_outfits table
-    # return true if it does exist and false if not
-    a=cursor.fetchone()[0]
-    return bool(a)
+    search_store({'store_name': store_name, 'min_discount': min_discount,
+                  'max_discount': max_discount})
+
+def filter_store_by_facets(store_name):
+    """
+    Prompts for any combination of facets and shows the clothing in a
+    given store that matches all of them.
+    """
+    print('Leave any of these blank to not filter on it.')
+    filters = {'store_name': store_name}
+    for facet in ['clothing_type', 'size', 'gender', 'color', 'brand',
+                  'aesthetic']:
+        filters[facet] = input(facet.replace('_', ' ').capitalize() + ': ')
+    filters['min_price'] = input('Minimum price (in USD): $')
+    filters['max_price'] = input('Maximum price (in USD): $')
+    filters['min_discount'] = input('Minimum discount (%): ')
+    filters['max_discount'] = input('Maximum discount (%): ')
+    search_store(filters)
+
+def filter_store(store_name):
+    """
+    Asks how to filter a store's inventory and shows the matching items.
+    """
+    filter = input('Would you like to filter by price (p), clothing '\
+                    + 'type (t), discount (d), or several at once (f)? ')
+    if filter == 'p':
+        min_price = input('Minimum price (in USD): $')
+        max_price = input('Maximum price (in USD): $')
+        filter_store_by_price(store_name, min_price, max_price)
+    elif filter == 't':
+        clothing_type = input('Clothing type: ')
+        filter_store_by_type(store_name, clothing_type)
+    elif filter == 'd':
+        min_discount = input('Minimum discount (%): ')
+        max_discount = input('Maximum disocunt (%): ')
+        filter_store_by_discount(store_name, min_discount, max_discount)
+    elif filter == 'f':
+        filter_store_by_facets(store_name)
+
+@METRICS.timed
+def write_outfits(outfits):
+    """
+    Saves outfits to styled_outfits in a single transaction and returns
+    the outfit ID assigned to each one. outfits is a list of
+    (clothing_ids, description, vibe) tuples. Outfit IDs are handed out by
+    the database, one after the other starting past the largest existing
+    ID, and all pieces are written with multi-row INSERTs. If any piece
+    cannot be saved, nothing is saved. Raises ValueError if an outfit has
+    no pieces, since it would have no rows to keep its ID.
+    """
+    if any(not clothing_ids for clothing_ids, _, _ in outfits):
+        raise ValueError('An outfit needs at least one piece.')
+    try:
+        # locks the end of the outfit_id index until we commit, so two
+        # users saving outfits at once cannot be given the same ID
+        next_id = statements.fetchone(conn, 'next_outfit_id')[0]
+        outfit_ids = []
+        rows = []
+        for clothing_ids, description, vibe in outfits:
+            outfit_ids.append(next_id)
+            rows.extend((next_id, clothing_id, description, vibe)
+                        for clothing_id in clothing_ids)
+            next_id += 1
+        for i in range(0, len(rows), OUTFIT_BATCH_SIZE):
+            statements.executemany(conn, 'add_outfit_items',
+                                   rows[i:i + OUTFIT_BATCH_SIZE])
+        conn.commit()
+    except mysql.connector.Error:
+        conn.rollback()
+        raise
+    return outfit_ids
+
+@METRICS.timed
+def show_outfits(first_id, last_id):
+    """
+    Shows every piece of the outfits with IDs in the given range.
+    """
+    print_query('show_outfits', (first_id, last_id))
+
+@METRICS.timed
+def import_outfits(path):
+    """
+    Imports every outfit in a CSV file shaped like styled_outfits.csv
+    (outfit_id, clothing_id, outfit_desc, vibe) in one transaction. The
+    outfit IDs in the file only group pieces together; each outfit is
+    given a new ID by the database. Returns the new outfit IDs.
+    """
+    outfits = {}
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            outfit = outfits.setdefault(row['outfit_id'],
+                                        ([], row['outfit_desc'], row['vibe']))
+            outfit[0].append(int(row['clothing_id']))
+    return write_outfits(list(outfits.values()))
+
+@METRICS.timed
+def export(listing, path):
+    """
+    Writes every row of a listing (clothes, collab, or store:<store name>)
+    to a CSV, JSON, or Parquet file, picked by the file's extension. This
+    is the only part of the app that needs pandas, so it is only imported
+    here. Returns the number of rows written.
+    """
+    import pandas as pd
+    if listing.startswith('store:'):
+        name, params = 'show_store_inventory', (listing[len('store:'):],)
+    else:
+        name, params = EXPORTS[listing], ()
+    frames = [pd.DataFrame(rows, columns=columns)
+              for columns, rows in pages(name, params)]
+    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    if path.endswith('.json'):
+        df.to_json(path, orient='records', lines=True)
+    elif path.endswith('.parquet'):
+        df.to_parquet(path, index=False)
+    else:
+        df.to_csv(path, index=False)
+    return len(df)
+
+@METRICS.timed
+def find_available(criteria, per_piece=AVAILABLE_PER_PIECE):
+    """
+    Looks up items for many pieces at once in a single query. criteria is
+    a list of (clothing_type, size, color), where size and color may be
+    None to match any. Returns a list with, for each criterion, rows of
+    (clothing_id, location, user_id, store_name, available) for up to
+    per_piece matching items, where location is personal, collab or
+    store.
+    """
+    found = [[] for _ in criteria]
+    rows = statements.fetchall(conn, 'find_available',
+                               (json.dumps([list(c) for c in criteria]),
+                                per_piece))
+    for row in rows:
+        found[row[0] - 1].append(tuple(row[1:]))
+    return found
+
+def check_availability():
+    """
+    Asks for the pieces of a planned outfit and prints where matching
+    items can be found.
+    """
+    pieces = input('Pieces to look for, separated by semicolons, each as ' +
+                   'type, size, color (leave size or color blank for any; ' +
+                   'e.g. Jeans, 28, Blue; Top, , Black):\n').split(';')
+    criteria = []
+    for piece in pieces:
+        fields = [field.strip() or None for field in piece.split(',')]
+        if fields[0]:
+            criteria.append((fields + [None, None])[:3])
+    for criterion, rows in zip(criteria, find_available(criteria)):
+        print(', '.join(field or 'any' for field in criterion) + ':')
+        print_table(rows, ['clothing_id', 'location', 'user_id',
+                           'store_name', 'available'])
+
+@METRICS.timed
+def suggest_items(clothing_ids, k=SUGGESTIONS):
+    """
+    Prints the k items that go best with an outfit made of the given
+    clothing IDs, from the user's personal closet, the collaborative
+    closet and every store (see recommend.py). The model reads every
+    closet, so it is loaded on the admin account whatever the user's
+    role. recommend.py needs numpy, so like pandas in export it is only
+    imported when first used.
+    """
+    global RECOMMENDER
+    import recommend
+    if RECOMMENDER is None:
+        RECOMMENDER = recommend.CachedModel(refresh_after=RECOMMEND_REFRESH,
+                                            rebuild_after=RECOMMEND_REBUILD)
+    model_conn = get_conn(*DB_ACCOUNTS['appadmin'])
+    try:
+        model = RECOMMENDER.get(model_conn)
+    finally:
+        POOL.release(model_conn)
+    print_table(model.suggest(clothing_ids, session.user_id, k),
+                recommend.COLUMNS)
 
 def create_outfit():
     """
     Lets any user create an outfit using clothes from their own personal
-    closet, the collaborative closet, and/or every store.
+    closet, the collaborative closet, and/or every store. Items that go
+    with the pieces picked so far can be suggested along the way.
     """
     clothing_ids = list(map(int, input("Let's style an outfit! What are " +
                                        "the clothing ID's of the pieces " +
                                        "you would like it to consist of? " +
                                        "Separate them with spaces (e.g. 1 2 4)"
                                        + "\n").split()))
-    while True:
-      outfit_id = input('Assign an outfit ID (integer) to this outfit: ')
-      if not check_outfit_id(outfit_id):
-          break
+    while input('Would you like suggestions for pieces to add? ' +
+                '[Y/N]\n').upper() == 'Y':
+        suggest_items(clothing_ids)
+        clothing_ids += map(int, input('Clothing IDs to add, separated by ' +
+                                       'spaces (leave blank for none): '
+                                       ).split())
     description = input('How would you describe this outfit? '\
                          + '(250 characters or less)\n')
     vibe = input('What is the "vibe" of this outfit? ' +
                  '(i.e.: business casual, going out, etc.)\n')
-    for clothing_id in clothing_ids:
-        sql = "INSERT INTO styled_outfits (outfit_id, clothing_id, outfit_desc,\
-               vibe) VALUES ('" + str(outfit_id) + "', '" + str(clothing_id) + \
-               "', '" + description + "', '" + vibe + "');"
-        cursor = conn.cursor()
-        cursor.execute(sql)
-    new_sql = 'SELECT * FROM styled_outfits'
-    cursor.execute(new_sql)
-    rows = cursor.fetchall()
-    df = pd.DataFrame(rows, columns=['outfit_id', 'clothing_id',\
-                                     'outfit_des', 'vibe'])
-    print(df)
-
-def change_sale(username, clothing_id, new_discount):
-    """
-    Change the discount and thus price of a specific clothing item 
+    if not clothing_ids:
+        print('An outfit needs at least one piece.')
+        return
+    try:
+        outfit_id = write_outfits([(clothing_ids, description, vibe)])[0]
+    except mysql.connector.Error as err:
+        if DEBUG:
+            print(err)
+        print('Sorry, this outfit could not be saved :( Please check ' +
+              'the clothing IDs and try again.')
+        return
+    print('Your outfit was saved with outfit ID ' + str(outfit_id) + ':')
+    show_outfits(outfit_id, outfit_id)
+    show_outfit_total(outfit_id)
+
+def ask_amount(prompt, high=None):
+    """
+    Asks for a price or percentage until the answer is a number between 0
+    and high (if given), and returns it as a Decimal.
+    """
+    while True:
+        try:
+            amount = decimal.Decimal(input(prompt).strip())
+        except decimal.InvalidOperation:
+            print('Please enter a number.')
+            continue
+        if amount.is_finite() and amount >= 0 and \
+                (high is None or amount <= high):
+            return amount
+        print('Please enter a number from 0' +
+              ('' if high is None else ' to ' + str(high)) + '.')
+
+def original_price(price, discount):
+    """
+    Returns the price of an item before the given percent discount.
+    """
+    price = decimal.Decimal(price)
+    discount = decimal.Decimal(discount)
+    if discount >= 100:
+        return price
+    return round(price * 100 / (100 - discount), 2)
+
+@METRICS.timed
+def markdown(store_name, discount, clothing_type=None, brand=None,
+             clothing_ids=None):
+    """
+    Sets the percent discount of many items in a store's inventory at once
+    and reprices them from their original prices, in a single UPDATE.
+    Marks down the given clothing IDs if any are given, otherwise every
+    item matching the (optional) clothing type and brand. Returns the
+    number of items whose price or discount changed.
+    """
+    if not 0 <= float(discount) <= 100:
+        raise ValueError('Discount must be between 0 and 100%.')
+    if clothing_ids is not None:
+        cursor = statements.execute(conn, 'markdown_items',
+                                    (discount, discount, store_name,
+                                     json.dumps(list(map(int, clothing_ids)))))
+    else:
+        cursor = statements.execute(conn, 'markdown',
+                                    (discount, discount, store_name,
+                                     clothing_type, clothing_type,
+                                     brand, brand))
+    store_changed(store_name)
+    return cursor.rowcount
+
+def change_sale(username, clothing_ids, new_discount):
+    """
+    Change the discount and thus price of specific clothing items
     in the store inventory.
     """
     # Different stores could be selling the same clothing item for
-    # different prices, so must check that you're obtaining the 
-    # price for the item from right store:
-    get_price_discount = "SELECT price, discount FROM store_closet \
-                          WHERE clothing_id = '" + clothing_id \
-                          + "' AND store_name = '" + username + "';"
-    cursor = conn.cursor(buffered=True)
-    cursor.execute(get_price_discount)
-    row = cursor.fetchone()
-    old_price = row[0]
-    old_discount = row[1]
-    get_orig_price = "SELECT find_original_price(%s, %s);"
-    cursor = conn.cursor(buffered=True)
-    cursor.execute(get_orig_price, (old_price, old_discount))
-    orig_price = cursor.fetchone()[0]
-    new_price = float(orig_price) * (float(new_discount) / 100)
-    sql = "UPDATE store_closet SET price = '" + str(round(new_price, 2)) \
-          + "', discount = '" + new_discount \
-          + "' WHERE clothing_id = '" + clothing_id \
-          + "' AND store_name = '" + username + "';"
-    cursor.execute(sql)
-                   
+    # different prices, so markdown only touches the given store's items
+    count = markdown(username, new_discount, clothing_ids=clothing_ids)
+    print(str(count) + ' item(s) repriced.')
+
+@METRICS.timed
+def show_store_stats(store_name):
+    """
+    Shows how many items a store is selling and their average price and
+    discount.
+    """
+    print_query('store_stats', (store_name,))
+
+@METRICS.timed
+def show_outfit_total(outfit_id):
+    """
+    Shows the total price of the pieces of an outfit that are sold in
+    stores.
+    """
+    print_query('outfit_total', (outfit_id,))
 
 # ----------------------------------------------------------------------
 # Command-Line Functionality
@@ -455,7 +926,7 @@ def show_options(username):
     Redirects the program to show the options based on what type of
     user is using the program (store owner, stylist, or personal user).
     """
-    permission = get_permission(username)
+    permission = session.role
     if permission == 'storeowner':
         show_storeowner_options(username)
     elif permission == 'stylist':
@@ -502,8 +973,14 @@ def show_personal_options(username):
     print('  (a) show personal clothes')
     print('  (b) show collaborative clothes')
     print('  (c) borrow from collaborative closet')
+    print('  (r) return an item to the collaborative closet')
+    print('  (l) show borrowed items and waitlists')
     print('  (d) style an outfit')
     print('  (e) show store inventories')
+    print('  (k) search clothes by keyword')
+    print('  (o) show the total price of an outfit')
+    print('  (v) find where pieces for an outfit are available')
+    print('  (w) log clothes you wore')
     print('  (q) quit')
 
     while True: 
@@ -516,31 +993,25 @@ def show_personal_options(username):
                              'available ' + 'clothes you would like to see: ')
             show_user_in_collab(user_id)
         elif action == 'c':
-            sql = "SELECT user_id FROM user WHERE username='" + username + "';"
-            cursor = conn.cursor(buffered=True)
-            cursor.execute(sql)
-            res = cursor.fetchone()[0]
-            user_id = int(res)
-            print(user_id)
-            borrow_from_collab_closet(user_id)
+            borrow_from_collab_closet(session.user_id)
+        elif action == 'r':
+            return_to_collab_closet(session.user_id)
+        elif action == 'l':
+            manage_waitlist(session.user_id)
         elif action == 'd':
             create_outfit()
         elif action == 'e':
             store_name = input('Enter a store name: ')
             show_store_inventory(store_name)
-            filter = input('Would you like to filter by price (p), clothing '\
-                            + 'type (t), or discount (d)? ')
-            if filter == 'p':
-                min_price = input('Minimum price (in USD): $')
-                max_price = input('Maximum price (in USD): $')
-                filter_store_by_price(store_name, min_price, max_price)
-            elif filter == 't':
-                clothing_type = input('Clothing type: ')
-                filter_store_by_type(store_name, clothing_type)
-            elif filter == 'd':
-                min_discount = input('Minimum discount (%): ')
-                max_discount = input('Maximum disocunt (%): ')
-                filter_store_by_discount(store_name, min_discount, max_discount)
+            filter_store(store_name)
+        elif action == 'k':
+            keyword_search(input('Keywords: '))
+        elif action == 'o':
+            show_outfit_total(input('Outfit ID: '))
+        elif action == 'v':
+            check_availability()
+        elif action == 'w':
+            log_wears(session.user_id)
         else:
             quit_ui()
 
@@ -557,7 +1028,9 @@ def show_storeowner_options(username):
     print('  (b) add item to inventory')
     print('  (c) remove item from inventory')
     print('  (s) sell clothing item to user')
-    print('  (e) change discount on item')
+    print('  (e) change discount on items')
+    print('  (m) mark down a whole category')
+    print('  (t) show store statistics')
     print('  (q) quit')
 
     while True:
@@ -565,44 +1038,47 @@ def show_storeowner_options(username):
         if action == 'a':
             # store owner's username is just the store name
             show_store_inventory(username)
-            filter = input('Would you like to filter by price (p), '\
-                            + 'clothing type (t), or discount (d)? ')
-            if filter == 'p':
-                min_price = input('Minimum price (in USD): $')
-                max_price = input('Maximum price (in USD): $')
-                filter_store_by_price(username, min_price, max_price)
-            elif filter == 't':
-                clothing_type = input('Clothing type: ')
-                filter_store_by_type(username, clothing_type)
-            elif filter == 'd':
-                min_discount = input('Minimum discount (%): ')
-                max_discount = input('Maximum disocunt (%): ')
-                filter_store_by_discount(username, min_discount, max_discount)
+            filter_store(username)
         elif action == 'b':
             clothing_id = input('Clothing ID: ')
-            price = input('Price of item: $')
-            discount = input('Discount (%): ')
-            sql = "INSERT INTO store_closet VALUES ('" + username + "', "\
-                  + str(clothing_id) + ", " + str(price) + ", "\
-                  + str(discount) + ");"
-            cursor = conn.cursor(buffered=True)
-            cursor.execute(sql)
+            price = ask_amount('Price of item: $')
+            discount = ask_amount('Discount (%): ', 100)
+            statements.execute(conn, 'add_store_item',
+                               (username, clothing_id, price, discount,
+                                original_price(price, discount)))
+            store_changed(username)
         elif action == 'c':
             clothing_id = input('Clothing ID of item you want to remove: ')
-            sql = "DELETE FROM store_closet WHERE clothing_id = '" +\
-                  clothing_id + "' AND store_name = '" + username +"';"
-            cursor = conn.cursor(buffered=True)
-            cursor.execute(sql)
+            statements.execute(conn, 'remove_store_item',
+                               (clothing_id, username))
+            store_changed(username)
         elif action == 's':
             clothing_id = input('Clothing ID of item being sold: ')
             user_id = input('User ID of user the item is being sold to: ')
-            sql = 'CALL sell_to_user(%s, %s);'
-            cursor = conn.cursor(buffered=True)
-            cursor.execute(sql, (clothing_id, user_id))
+            # only this store's copy of the item is sold, so only its
+            # cached inventory changes
+            statements.execute(conn, 'sell_to_user',
+                               (clothing_id, user_id, username))
+            store_changed(username)
         elif action == 'e':
-            clothing_id = input('Clothing ID of item: ')
-            new_discount = input('Desired discount (%): ')
-            change_sale(username, clothing_id, new_discount)
+            try:
+                clothing_ids = list(map(int, input(
+                    'Clothing ID(s) of items, separated by spaces: ').split()))
+            except ValueError:
+                print('Clothing IDs must be numbers.')
+                continue
+            new_discount = ask_amount('Desired discount (%): ', 100)
+            change_sale(username, clothing_ids, new_discount)
+        elif action == 'm':
+            new_discount = ask_amount('Desired discount (%): ', 100)
+            clothing_type = input('Clothing type (leave blank for any): ')
+            brand = input('Brand (leave blank for any): ')
+            count = markdown(username, new_discount,
+                             clothing_type=clothing_type or None,
+                             brand=brand or None)
+            print(str(count) + ' item(s) marked down.')
+        elif action == 't':
+            show_store_stats(username)
         else:
             quit_ui()
 
@@ -614,6 +1090,9 @@ def show_stylist_options(username):
     print('  (a) show collaborative clothes')
     print('  (b) show store inventories')
     print('  (c) style an outfit for anyone')
+    print('  (k) search clothes by keyword')
+    print('  (o) show the total price of an outfit')
+    print('  (v) find where pieces for an outfit are available')
     print('  (q) quit')
 
     while True: 
@@ -626,21 +1105,15 @@ def show_stylist_options(username):
         elif action == 'b':
             store_name = input('Enter a store name: ')
             show_store_inventory(store_name)
-            filter = input('Would you like to filter by price (p), clothing '\
-                            + 'type (t), or discount (d)? ')
-            if filter == 'p':
-                min_price = input('Minimum price (in USD): $')
-                max_price = input('Maximum price (in USD): $')
-                filter_store_by_price(store_name, min_price, max_price)
-            elif filter == 't':
-                clothing_type = input('Clothing type: ')
-                filter_store_by_type(store_name, clothing_type)
-            elif filter == 'd':
-                min_discount = input('Minimum discount (%): ')
-                max_discount = input('Maximum disocunt (%): ')
-                filter_store_by_discount(store_name, min_discount, max_discount)
+            filter_store(store_name)
         elif action == 'c':
             create_outfit()
+        elif action == 'k':
+            keyword_search(input('Keywords: '))
+        elif action == 'o':
+            show_outfit_total(input('Outfit ID: '))
+        elif action == 'v':
+            check_availability()
         else:
             quit_ui()
 
@@ -667,7 +1140,22 @@ def quit_ui():
     Quits the program, printing a good bye message to the user.
     """
     print('Good bye!')
-    conn.close()
+    POOL.release(conn)
+    try:
+        flush_wears()
+    except mysql.connector.Error as err:
+        if DEBUG:
+            print('Could not write wears:', err)
+    WEARS.close()
+    if DEBUG:
+        print('Connection pool:', POOL.stats())
+        print('Inventory cache:', INVENTORY_CACHE.stats())
+        print('Wears:', WEARS.stats())
+        if RECOMMENDER:
+            print('Suggestion model:', RECOMMENDER.stats())
+    if METRICS_PATH:
+        METRICS.dump(METRICS_PATH)
+    POOL.close_all()
     exit()
 
 def main():
@@ -678,5 +1166,77 @@ def main():
     show_options(username)
 
 if __name__ == '__main__':
-    conn = get_conn('appadmin', 'adminpw')
+    parser = argparse.ArgumentParser(description='Closetly command-line app')
+    parser.add_argument('--page-size', type=int, default=PAGE_SIZE,
+                        help='rows to fetch and print at a time when ' +
+                             'listing clothes (default: %(default)s)')
+    parser.add_argument('--import-outfits', metavar='CSV',
+                        help='import the outfits in a CSV file shaped ' +
+                             'like styled_outfits.csv and exit')
+    parser.add_argument('--export', nargs=2, metavar=('LISTING', 'FILE'),
+                        help='write every row of a listing (clothes, ' +
+                             'collab, or store:<store name>) to a .csv, ' +
+                             '.json, or .parquet file and exit')
+    parser.add_argument('--slow-query-ms', type=float, default=SLOW_QUERY_MS,
+                        help='log queries slower than this with their ' +
+                             'EXPLAIN output to stderr')
+    parser.add_argument('--primary', metavar='HOST[:PORT]', type=host_port,
+                        default=PRIMARY,
+                        help='database server to write to (default: ' +
+                             'localhost:3306)')
+    parser.add_argument('--replica', metavar='HOST[:PORT]', type=host_port,
+                        action='append', default=[],
+                        help='read replica of the primary to send reads ' +
+                             'to; can be given more than once')
+    parser.add_argument('--sqlite', metavar='FILE',
+                        help='run on a SQLite database file instead of ' +
+                             'MySQL, creating it from the CSV files in ' +
+                             'the current directory if it does not exist')
+    parser.add_argument('--metrics', metavar='FILE',
+                        help='write query and command latencies to FILE ' +
+                             '(JSON if it ends in .json, Prometheus text ' +
+                             'otherwise) on exit and on SIGUSR1')
+    parser.add_argument('--wear-journal', metavar='FILE',
+                        default=WEAR_JOURNAL,
+                        help='also append logged wears to FILE until they ' +
+                             'are written, and write any left in it')
+    args = parser.parse_args()
+    if args.page_size < 1:
+        parser.error('--page-size must be at least 1')
+    PAGE_SIZE = args.page_size
+    METRICS.slow_query_ms = args.slow_query_ms
+    METRICS_PATH = args.metrics
+    if args.sqlite:
+        if args.replica:
+            parser.error('--replica cannot be used with --sqlite')
+        BACKEND = SQLiteBackend(args.sqlite)
+        if not BACKEND.exists():
+            BACKEND.create('.')
+    elif args.primary != PRIMARY or args.replica:
+        POOL = make_pool(args.primary, args.replica)
+    if METRICS_PATH:
+        METRICS.dump_on_signal(METRICS_PATH)
+    if args.wear_journal:
+        WEARS = wears.WearBuffer(max_events=WEAR_FLUSH_EVENTS,
+                                 max_seconds=WEAR_FLUSH_SECONDS,
+                                 journal=args.wear_journal)
+    conn = get_conn(*DB_ACCOUNTS['appadmin'])
+    if args.export:
+        try:
+            count = export(*args.export)
+        except KeyError:
+            parser.error('LISTING must be clothes, collab, or ' +
+                         'store:<store name>')
+        print('Exported ' + str(count) + ' rows to ' + args.export[1] + '.')
+        quit_ui()
+    if args.import_outfits:
+        try:
+            outfit_ids = import_outfits(args.import_outfits)
+        except ValueError as err:
+            sys.exit('Could not import outfits: ' + str(err))
+        print('Imported ' + str(len(outfit_ids)) + ' outfits.')
+        if outfit_ids:
+            show_outfits(outfit_ids[0], outfit_ids[-1])
+        quit_ui()
+    warm_pool()
     main()
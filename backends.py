@@ -0,0 +1,733 @@
+"""
+Storage backends for the Closetly app. Every statement in statements.py
+runs on connections opened by one of these:
+
+    MySQLBackend    a MySQL server (the default)
+    SQLiteBackend   a SQLite database file opened inside the app, for
+                    demos, tests and single-machine setups that should not
+                    need a server: python3 app.py --sqlite closetly.db
+
+SQLiteBackend connections behave like the connector's as far as the rest
+of the app can tell: statements use %s placeholders, cursor(prepared=True)
+works, transactions are committed and rolled back the same way, and
+errors are raised as mysql.connector errors. The schema is
+setup-sqlite.sql. Statements whose MySQL text SQLite cannot run
+(JSON_TABLE, LATERAL joins, FULLTEXT search, stored routines, the summary
+tables of setup-rollups.sql) have a SQLite version in SQLITE_STATEMENTS;
+the stored procedures and functions are Python functions there instead.
+"""
+import collections
+import contextlib
+import csv
+import decimal
+import functools
+import hashlib
+import itertools
+import os
+import random
+import re
+import sqlite3
+import sys
+import time
+
+import mysql.connector
+from mysql.connector.constants import ClientFlag
+
+import statements
+
+SCHEMA = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      'setup-sqlite.sql')
+
+# Rows per executemany when loading CSV files
+LOAD_ROWS = 10000
+
+# The example users and roles added by setup-passwords.sql and
+# setup-permissions.sql
+SEED_USERS = [('emilypan', 'swimmerpenguin123'),
+              ('bridgetyang', 'beyonce777'),
+              ('ektapatel', 'futurederma02')]
+SEED_PERMISSIONS = [('emilypan', 'appadmin'), ('bridgetyang', 'appadmin'),
+                    ('ektapatel', 'personal')]
+
+
+class MySQLBackend:
+    """
+    A MySQL server. Each database account (see statements.DB_ACCOUNTS)
+    logs in as its own MySQL user, so what it may do is enforced by the
+    grants in grant-permissions.sql.
+    """
+    name = 'mysql'
+
+    def __init__(self, database='closetly'):
+        self.database = database
+
+    def connect(self, user, password, host='localhost', port=3306,
+                autocommit=False, track_gtids=False):
+        """
+        Opens a connection. With track_gtids, the server sends back the
+        GTID of every commit, for pool.commit_gtid.
+        """
+        if not track_gtids:
+            return mysql.connector.connect(host=host, user=user, port=port,
+                                           password=password,
+                                           database=self.database,
+                                           autocommit=autocommit)
+        return mysql.connector.connect(
+            host=host, user=user, port=port, password=password,
+            database=self.database, autocommit=autocommit, use_pure=True,
+            client_flags=[ClientFlag.SESSION_TRACK],
+            init_command='SET SESSION session_track_gtids = OWN_GTID')
+
+
+class SQLiteBackend:
+    """
+    A SQLite database at path, or one kept in memory for as long as the
+    backend exists if path is ':memory:'. Connections use WAL mode, so
+    reads never wait on the writer; writes are serialized by SQLite, one
+    transaction at a time, waiting up to busy_timeout seconds for the one
+    before. There are no database accounts: user, password, host and
+    port are ignored, so the app's menus are the only check on what each
+    role may do.
+    """
+    name = 'sqlite'
+
+    def __init__(self, path, busy_timeout=10.0):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.memory = path == ':memory:'
+        # connections to the same in-memory database share it by name, and
+        # one is kept open so that it is not dropped between connections
+        self.target = 'file:closetly-{}?mode=memory&cache=shared'.format(
+            id(self)) if self.memory else path
+        self.keepalive = self.connect() if self.memory else None
+
+    def exists(self):
+        """
+        Returns whether the database has been created.
+        """
+        if self.memory or os.path.exists(self.path):
+            conn = self.connect()
+            try:
+                return conn.raw.execute(
+                    "SELECT COUNT(*) FROM sqlite_master "
+                    "WHERE type = 'table' AND name = 'clothes'"
+                ).fetchone()[0] == 1
+            finally:
+                conn.close()
+        return False
+
+    def connect(self, user=None, password=None, host=None, port=None,
+                autocommit=False):
+        raw = sqlite3.connect(self.target, uri=self.memory,
+                              timeout=self.busy_timeout,
+                              isolation_level=None, check_same_thread=False,
+                              detect_types=sqlite3.PARSE_DECLTYPES)
+        raw.execute('PRAGMA foreign_keys = ON')
+        if not self.memory:
+            raw.execute('PRAGMA journal_mode = WAL')
+            # with WAL, commits only need to reach the log, not be synced
+            raw.execute('PRAGMA synchronous = NORMAL')
+        add_functions(raw)
+        return SQLiteConnection(raw, autocommit)
+
+    def create(self, data_dir=None, report=sys.stderr):
+        """
+        Creates the tables (dropping any that exist), loads the CSV files
+        in data_dir if one is given (see load), and adds the example users
+        and their roles, like running the setup scripts in the README does
+        for MySQL.
+        """
+        conn = self.connect()
+        try:
+            with open(SCHEMA) as f:
+                conn.raw.executescript(f.read())
+            if data_dir is not None:
+                load(conn, data_dir, report)
+            for username, password in SEED_USERS:
+                statements.execute(conn, 'add_user', (username, password))
+            # like setup-permissions.sql
+            conn.raw.execute('DELETE FROM user WHERE username IS NULL')
+            for username, role in SEED_PERMISSIONS:
+                statements.execute(conn, 'add_permission', (username, role))
+            conn.commit()
+        finally:
+            conn.close()
+
+
+# ----------------------------------------------------------------------
+# Connections
+# ----------------------------------------------------------------------
+# NUMERIC and DECIMAL columns are read as Decimal, as MySQL's are, and
+# Decimal parameters are passed as text for the columns to convert
+sqlite3.register_converter('NUMERIC', lambda value: decimal.Decimal(
+    value.decode()))
+sqlite3.register_converter('DECIMAL', lambda value: decimal.Decimal(
+    value.decode()))
+sqlite3.register_adapter(decimal.Decimal, str)
+
+
+@contextlib.contextmanager
+def mysql_errors():
+    """
+    Raises sqlite3 errors as the mysql.connector errors the app catches.
+    """
+    try:
+        yield
+    except sqlite3.IntegrityError as err:
+        raise mysql.connector.errors.IntegrityError(msg=str(err)) from err
+    except sqlite3.OperationalError as err:
+        raise mysql.connector.errors.OperationalError(msg=str(err)) from err
+    except sqlite3.ProgrammingError as err:
+        raise mysql.connector.errors.ProgrammingError(msg=str(err)) from err
+    except sqlite3.Error as err:
+        raise mysql.connector.errors.DatabaseError(msg=str(err)) from err
+
+
+class SQLiteConnection:
+    """
+    A sqlite3 connection with the parts of the connector's interface the
+    app uses. sqlite3 is left in autocommit mode; route starts a
+    transaction before the first statement that writes, with BEGIN
+    IMMEDIATE so that it holds the write lock from the start (as SELECT
+    ... FOR UPDATE does in MySQL) and so cannot fail halfway through on
+    another writer.
+    """
+    unread_result = False
+
+    def __init__(self, raw, autocommit=False):
+        self.raw = raw
+        self.autocommit = autocommit
+        self.statements = SQLITE_REGISTRY
+        self.closed = False
+
+    @property
+    def in_transaction(self):
+        return self.raw.in_transaction
+
+    def route(self, read):
+        """
+        Called by statements.execute before each statement, see
+        pool.RoutedConnection.
+        """
+        if not read and not self.autocommit and not self.raw.in_transaction:
+            with mysql_errors():
+                self.raw.execute('BEGIN IMMEDIATE')
+        return self
+
+    def cursor(self, prepared=False, **kwargs):
+        return SQLiteCursor(self)
+
+    def commit(self):
+        with mysql_errors():
+            self.raw.commit()
+
+    def rollback(self):
+        with mysql_errors():
+            self.raw.rollback()
+
+    def ping(self, reconnect=False):
+        with mysql_errors():
+            self.raw.execute('SELECT 1')
+
+    def is_connected(self):
+        return not self.closed
+
+    def close(self):
+        self.closed = True
+        self.raw.close()
+
+
+@functools.lru_cache(maxsize=None)
+def sqlite_sql(sql):
+    """
+    Returns a MySQL statement with its placeholders and EXPLAIN spelled
+    the way SQLite expects.
+    """
+    if sql.startswith('EXPLAIN '):
+        sql = 'EXPLAIN QUERY PLAN ' + sql[len('EXPLAIN '):]
+    return sql.replace('%s', '?')
+
+
+class SQLiteCursor:
+    """
+    A cursor on a SQLiteConnection. A statement is either SQL, or a
+    routine standing in for a stored procedure or function: routines are
+    called as routine(conn, params) and return (rows, rowcount), with rows
+    None for a procedure that returns nothing.
+    """
+    def __init__(self, conn):
+        self.conn = conn
+        self.cursor = conn.raw.cursor()
+        self.rows = None
+        self.description = None
+        self.rowcount = -1
+
+    @property
+    def with_rows(self):
+        return self.description is not None
+
+    def execute(self, operation, params=()):
+        with mysql_errors():
+            if callable(operation):
+                rows, self.rowcount = operation(self.conn, tuple(params))
+                self.rows = None if rows is None else list(rows)
+                self.description = None if rows is None else \
+                    [('result', None, None, None, None, None, None)]
+            else:
+                self.rows = None
+                self.cursor.execute(sqlite_sql(operation), params)
+                self.description = self.cursor.description
+                self.rowcount = self.cursor.rowcount
+
+    def executemany(self, operation, seq_params):
+        with mysql_errors():
+            self.rows = None
+            self.cursor.executemany(sqlite_sql(operation), seq_params)
+            self.description = None
+            self.rowcount = self.cursor.rowcount
+
+    def fetchone(self):
+        if self.rows is not None:
+            return self.rows.pop(0) if self.rows else None
+        with mysql_errors():
+            return self.cursor.fetchone()
+
+    def fetchmany(self, size=1):
+        if self.rows is not None:
+            rows, self.rows = self.rows[:size], self.rows[size:]
+            return rows
+        with mysql_errors():
+            return self.cursor.fetchmany(size)
+
+    def fetchall(self):
+        if self.rows is not None:
+            rows, self.rows = self.rows, []
+            return rows
+        with mysql_errors():
+            return self.cursor.fetchall()
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def close(self):
+        self.cursor.close()
+
+
+# ----------------------------------------------------------------------
+# SQL functions
+# ----------------------------------------------------------------------
+def sha2(value, bits):
+    """
+    MySQL's SHA2: the hex digest of value, or NULL.
+    """
+    if value is None or bits not in (0, 224, 256, 384, 512):
+        return None
+    return hashlib.new('sha' + str(bits or 256),
+                       str(value).encode()).hexdigest()
+
+
+def concat(*values):
+    """
+    MySQL's CONCAT, which is NULL if any of its arguments is.
+    """
+    if any(value is None for value in values):
+        return None
+    return ''.join(str(value) for value in values)
+
+
+def find_original_price(price, discount):
+    """
+    find_original_price in setup-routines.sql.
+    """
+    if price is None or discount is None:
+        return None
+    if discount >= 100:
+        return price
+    return round(price * 100 / (100 - discount), 2)
+
+
+def authenticate(raw, username, password):
+    """
+    authenticate in setup-passwords.sql: 1 if the user exists and the
+    password is theirs, 0 otherwise.
+    """
+    row = raw.execute('SELECT salt, password_hash FROM user_info '
+                      'WHERE username = ?', (username,)).fetchone()
+    return int(row is not None and
+               sha2(concat(row[0], password), 256) == row[1])
+
+
+def fts_query(keywords):
+    """
+    Turns keywords into an FTS5 query matching any of them, the way
+    MATCH ... AGAINST in natural language mode does. Words shorter than
+    three characters are left out, as InnoDB leaves them out of FULLTEXT
+    indexes.
+    """
+    words = [word for word in re.findall(r'\w+', keywords or '')
+             if len(word) >= 3]
+    return ' OR '.join('"' + word + '"' for word in words) or '""'
+
+
+def add_functions(raw):
+    raw.create_function('SHA2', 2, sha2, deterministic=True)
+    raw.create_function('CONCAT', -1, concat, deterministic=True)
+    raw.create_function('find_original_price', 2, find_original_price,
+                        deterministic=True)
+    raw.create_function('authenticate', 2,
+                        functools.partial(authenticate, raw))
+    raw.create_function('fts_query', 1, fts_query, deterministic=True)
+
+
+# ----------------------------------------------------------------------
+# Stored routines
+# ----------------------------------------------------------------------
+def make_salt(num_chars):
+    """
+    make_salt in setup-passwords.sql: ASCII 32 (space) through 126.
+    """
+    return ''.join(chr(32 + random.randrange(95))
+                   for _ in range(min(20, num_chars)))
+
+
+def sp_add_user(conn, params):
+    username, password = params
+    salt = make_salt(8)
+    cursor = conn.raw.execute(
+        'INSERT INTO user_info (username, salt, password_hash) '
+        'VALUES (?, ?, ?)', (username, salt, sha2(salt + password, 256)))
+    return None, cursor.rowcount
+
+
+def add_to_user(conn, params):
+    cursor = conn.raw.execute('INSERT INTO user (name, username) '
+                              'VALUES (?, ?)', params)
+    return None, cursor.rowcount
+
+
+def user_add_permission(conn, params):
+    cursor = conn.raw.execute('INSERT INTO permissions (username, role) '
+                              'VALUES (?, ?)', params)
+    return None, cursor.rowcount
+
+
+def borrow_item(conn, params):
+    """
+    borrow_item in setup-routines.sql: one conditional UPDATE, so of
+    several users borrowing the same item only the first gets 1 back.
+    """
+    cursor = conn.raw.execute(
+        """UPDATE collab_closet
+           SET is_available = 0, current_borrower = ?1
+           WHERE clothing_id = ?2 AND is_available = 1
+             AND user_id <> ?1""", params)
+    return [(int(cursor.rowcount == 1),)], 1
+
+
+def join_waitlist(conn, params):
+    """
+    join_waitlist in setup-waitlist.sql: borrows the item if it is
+    available, or else queues the user for it and returns their place.
+    """
+    waiter_id, clothing_id = params
+    row = conn.raw.execute(
+        """SELECT user_id, current_borrower, is_available
+           FROM collab_closet WHERE clothing_id = ?""",
+        (clothing_id,)).fetchone()
+    if row is None or row[0] == waiter_id or row[1] == waiter_id:
+        return [(-1,)], 1
+    if row[2] == 1:
+        conn.raw.execute(
+            """UPDATE collab_closet SET is_available = 0, current_borrower = ?
+               WHERE clothing_id = ?""", (waiter_id, clothing_id))
+        return [(0,)], 1
+    conn.raw.execute(
+        """INSERT OR IGNORE INTO borrow_waitlist (clothing_id, user_id)
+           VALUES (?, ?)""", (clothing_id, waiter_id))
+    place = conn.raw.execute(
+        """SELECT COUNT(*) FROM borrow_waitlist AS w
+           JOIN borrow_waitlist AS me
+             ON me.clothing_id = w.clothing_id AND me.user_id = ?2
+           WHERE w.clothing_id = ?1
+             AND (w.enqueued_at < me.enqueued_at
+                  OR (w.enqueued_at = me.enqueued_at
+                      AND w.user_id <= me.user_id))""",
+        (clothing_id, waiter_id)).fetchone()[0]
+    return [(place,)], 1
+
+
+def return_item(conn, params):
+    """
+    return_item in setup-waitlist.sql: lends the item to the first user
+    waiting for it and returns their user_id, or makes it available and
+    returns 0.
+    """
+    borrower_id, clothing_id = params
+    row = conn.raw.execute(
+        """SELECT current_borrower FROM collab_closet
+           WHERE clothing_id = ? AND is_available = 0""",
+        (clothing_id,)).fetchone()
+    if row is None or row[0] != borrower_id:
+        return [(-1,)], 1
+    row = conn.raw.execute(
+        """SELECT user_id FROM borrow_waitlist WHERE clothing_id = ?
+           ORDER BY enqueued_at, user_id LIMIT 1""",
+        (clothing_id,)).fetchone()
+    if row is None:
+        conn.raw.execute(
+            """UPDATE collab_closet SET is_available = 1,
+               current_borrower = NULL WHERE clothing_id = ?""",
+            (clothing_id,))
+        return [(0,)], 1
+    conn.raw.execute(
+        'DELETE FROM borrow_waitlist WHERE clothing_id = ? AND user_id = ?',
+        (clothing_id, row[0]))
+    conn.raw.execute(
+        'UPDATE collab_closet SET current_borrower = ? WHERE clothing_id = ?',
+        (row[0], clothing_id))
+    return [(row[0],)], 1
+
+
+def sell_to_user(conn, params):
+    clothing_id, buyer_id, store_name = params
+    cursor = conn.raw.execute(
+        'DELETE FROM store_closet WHERE store_name = ? AND clothing_id = ?',
+        (store_name, clothing_id))
+    if cursor.rowcount != 1:
+        return None, 0
+    cursor = conn.raw.execute(
+        'INSERT INTO personal_closet VALUES (?, ?, 1, 0, 0)',
+        (buyer_id, clothing_id))
+    return None, cursor.rowcount
+
+
+# ----------------------------------------------------------------------
+# Statements
+# ----------------------------------------------------------------------
+# SQLite versions of the statements in statements.STATEMENTS that SQLite
+# cannot run as written, with the same parameters and result columns.
+# ?N placeholders refer to the Nth parameter.
+SQLITE_STATEMENTS = {
+    'add_user': sp_add_user,
+    'add_to_user': add_to_user,
+    'add_permission': user_add_permission,
+    'borrow_item': borrow_item,
+    'join_waitlist': join_waitlist,
+    'return_item': return_item,
+    'sell_to_user': sell_to_user,
+    'record_wears': """UPDATE personal_closet
+           SET num_wears = COALESCE(num_wears, 0) + w.value ->> 2
+           FROM json_each(?) AS w
+           WHERE personal_closet.user_id = w.value ->> 0
+             AND personal_closet.clothing_id = w.value ->> 1""",
+    'wear_out': """UPDATE collab_closet SET curr_condition = 'used'
+           WHERE (user_id, clothing_id) IN (
+                   SELECT w.value ->> 0, w.value ->> 1 FROM json_each(?) AS w)
+             AND (curr_condition = 'new' OR curr_condition IS NULL)
+             AND EXISTS (SELECT * FROM personal_closet AS p
+                         WHERE p.user_id = collab_closet.user_id
+                           AND p.clothing_id = collab_closet.clothing_id
+                           AND p.num_wears > 50)""",
+    'find_available': """WITH want AS (
+               SELECT w.key + 1 AS criterion, w.value ->> 0 AS clothing_type,
+                      w.value ->> 1 AS size, w.value ->> 2 AS color
+               FROM json_each(?1) AS w),
+           m AS (
+               SELECT criterion, clothing_id FROM (
+                   SELECT want.criterion, c.clothing_id,
+                          ROW_NUMBER() OVER (PARTITION BY want.criterion
+                                             ORDER BY c.clothing_id) AS n
+                   FROM want JOIN clothes AS c
+                     ON c.clothing_type = want.clothing_type
+                    AND (want.size IS NULL OR c.size = want.size)
+                    AND (want.color IS NULL OR c.color = want.color))
+               WHERE n <= ?2)
+           SELECT * FROM (
+               SELECT m.criterion, m.clothing_id, 'personal' AS location,
+                      p.user_id, NULL AS store_name, p.is_clean AS available
+               FROM m JOIN personal_closet AS p
+                 ON p.clothing_id = m.clothing_id
+               UNION ALL
+               SELECT m.criterion, m.clothing_id, 'collab', cc.user_id, NULL,
+                      cc.is_available
+               FROM m JOIN collab_closet AS cc
+                 ON cc.clothing_id = m.clothing_id
+               UNION ALL
+               SELECT m.criterion, m.clothing_id, 'store', NULL,
+                      s.store_name, 1
+               FROM m JOIN store_closet AS s ON s.clothing_id = m.clothing_id)
+           ORDER BY criterion, clothing_id, location""",
+    # the keywords are given twice for MySQL, the first copy is unused
+    'keyword_search': """SELECT c.clothing_id, c.clothing_type, c.size,
+           c.color, c.brand, c.description, c.aesthetic, s.store_name,
+           s.price, cc.is_available, -bm25(clothes_text) AS relevance
+           FROM clothes_text
+           JOIN clothes AS c ON c.clothing_id = clothes_text.rowid
+           LEFT JOIN store_closet AS s ON s.clothing_id = c.clothing_id
+           LEFT JOIN collab_closet AS cc ON cc.clothing_id = c.clothing_id
+           WHERE clothes_text MATCH fts_query(?2)
+             AND (s.clothing_id IS NOT NULL OR cc.clothing_id IS NOT NULL)
+           ORDER BY relevance DESC, c.clothing_id LIMIT ?3""",
+    'markdown': """UPDATE store_closet
+           SET discount = ?, price = ROUND(original_price * (100 - ?) / 100, 2)
+           WHERE store_name = ?
+             AND clothing_id IN (
+                 SELECT c.clothing_id FROM clothes AS c
+                 WHERE (? IS NULL OR c.clothing_type = ?)
+                   AND (? IS NULL OR c.brand = ?))""",
+    'markdown_items': """UPDATE store_closet
+           SET discount = ?, price = ROUND(original_price * (100 - ?) / 100, 2)
+           WHERE store_name = ?
+             AND clothing_id IN (SELECT value FROM json_each(?))""",
+    # computed when asked for rather than kept in summary tables
+    'store_stats': """SELECT store_name, COUNT(*) AS num_items,
+           ROUND(AVG(price), 2) AS avg_price,
+           ROUND(AVG(discount), 1) AS avg_discount
+           FROM store_closet WHERE store_name = ?
+           GROUP BY store_name""",
+    'outfit_total': """SELECT o.outfit_id,
+           COUNT(DISTINCT o.clothing_id) AS num_pieces,
+           COUNT(DISTINCT s.clothing_id) AS num_priced,
+           ROUND(COALESCE(SUM(s.price), 0), 2) AS total_price
+           FROM styled_outfits AS o
+           LEFT JOIN store_closet AS s ON s.clothing_id = o.clothing_id
+           WHERE o.outfit_id = ?
+           GROUP BY o.outfit_id""",
+    'start_session': """INSERT INTO sessions (token_hash, username, role,
+           user_id, expires_at)
+           VALUES (?, ?, ?, ?, datetime('now', ? || ' seconds'))""",
+    'check_session': """SELECT username, role, user_id FROM sessions
+           WHERE token_hash = ? AND expires_at > datetime('now')""",
+    'prune_sessions': """DELETE FROM sessions
+           WHERE expires_at <= datetime('now')""",
+    # the write lock taken by BEGIN IMMEDIATE does what FOR UPDATE does
+    'next_outfit_id': """SELECT COALESCE(MAX(outfit_id), 0) + 1
+           FROM styled_outfits""",
+}
+
+# What statements.execute looks statements up in on a SQLite connection:
+# the versions above, then the shared ones (including those registered
+# at run time)
+SQLITE_REGISTRY = collections.ChainMap(SQLITE_STATEMENTS,
+                                       statements.STATEMENTS)
+
+
+# ----------------------------------------------------------------------
+# Loading CSV files
+# ----------------------------------------------------------------------
+def not_minus_one(value):
+    return None if value == -1 else value
+
+
+def original_price(row):
+    store_name, clothing_id, price, discount = row
+    return row + [find_original_price(price, discount)]
+
+
+# (file, table, columns, converter per column, row fixup) in load order,
+# doing what load-data.sql does for MySQL. Files that are not there are
+# skipped.
+LOAD = [
+    ('user.csv', 'user', ['user_id', 'name', 'username'], [int, str, str],
+     None),
+    ('user_info.csv', 'user_info', ['username', 'salt', 'password_hash'],
+     [str] * 3, None),
+    ('permissions.csv', 'permissions', ['username', 'role'], [str] * 2,
+     None),
+    ('clothes.csv', 'clothes',
+     ['clothing_id', 'clothing_type', 'size', 'gender', 'color', 'brand',
+      'description', 'image_url', 'aesthetic', 'store_name'],
+     [int] + [str] * 9, None),
+    ('personal_closet.csv', 'personal_closet',
+     ['user_id', 'clothing_id', 'is_clean', 'shared', 'num_wears'],
+     [int, int, int, int, int],
+     lambda row: row[:4] + [not_minus_one(row[4])]),
+    ('store_closet.csv', 'store_closet',
+     ['store_name', 'clothing_id', 'price', 'discount', 'original_price'],
+     [str, int, decimal.Decimal, decimal.Decimal], original_price),
+    ('collab_closet.csv', 'collab_closet',
+     ['user_id', 'clothing_id', 'curr_condition', 'is_available',
+      'current_borrower'],
+     [int, int, str, int, int],
+     lambda row: row[:4] + [not_minus_one(row[4])]),
+    ('styled_outfits.csv', 'styled_outfits',
+     ['outfit_id', 'clothing_id', 'outfit_desc', 'vibe'],
+     [int, int, str, str], None),
+]
+
+
+def read_csv(path, converters, fixup):
+    """
+    Yields the rows of a CSV file after its header, converted the way
+    LOAD DATA reads them: NULL (unquoted) and \\N are NULL.
+    """
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        for fields in reader:
+            row = [None if value in ('NULL', '\\N') else convert(value)
+                   for convert, value in zip(converters, fields)]
+            yield fixup(row) if fixup is not None else row
+
+
+def load(conn, data_dir, report=sys.stderr):
+    """
+    Loads the CSV files in data_dir (as written by generate_data.py, or the
+    ones in this repository) into an empty database. Indexes and triggers
+    are dropped while loading and created again after, the full-text
+    index is built once at the end, and everything is loaded in one
+    transaction. Returns {table: (rows, seconds)}.
+    """
+    raw = conn.raw
+    loaded = {}
+    names = [table for file, table, *_ in LOAD
+             if os.path.exists(os.path.join(data_dir, file))]
+    derived = raw.execute(
+        "SELECT type, name, sql FROM sqlite_master "
+        "WHERE type IN ('index', 'trigger') AND sql IS NOT NULL "
+        "AND tbl_name IN ({})".format(', '.join('?' * len(names))),
+        names).fetchall()
+    # foreign keys can only be turned off outside a transaction
+    raw.execute('PRAGMA foreign_keys = OFF')
+    try:
+        raw.execute('BEGIN IMMEDIATE')
+        for kind, name, _ in derived:
+            raw.execute('DROP {} {}'.format(kind.upper(), name))
+        for file, table, columns, converters, fixup in LOAD:
+            path = os.path.join(data_dir, file)
+            if not os.path.exists(path):
+                continue
+            start = time.perf_counter()
+            sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+                table, ', '.join(columns), ', '.join('?' * len(columns)))
+            rows = read_csv(path, converters, fixup)
+            count = 0
+            while True:
+                chunk = list(itertools.islice(rows, LOAD_ROWS))
+                if not chunk:
+                    break
+                raw.executemany(sql, chunk)
+                count += len(chunk)
+            seconds = time.perf_counter() - start
+            loaded[table] = (count, seconds)
+            if report is not None:
+                print('{:<16} {:>10} rows {:>8.1f} s {:>10.0f} rows/s'.format(
+                    table, count, seconds, count / seconds if seconds else 0),
+                    file=report)
+        start = time.perf_counter()
+        for _, _, sql in derived:
+            raw.execute(sql)
+        raw.execute("INSERT INTO clothes_text (clothes_text) "
+                    "VALUES ('rebuild')")
+        raw.execute('COMMIT')
+        raw.execute('ANALYZE')
+        if report is not None:
+            print('{:<16} {:>10} {:>13.1f} s'.format(
+                'indexes', '', time.perf_counter() - start), file=report)
+    except sqlite3.Error:
+        if raw.in_transaction:
+            raw.execute('ROLLBACK')
+        raise
+    finally:
+        raw.execute('PRAGMA foreign_keys = ON')
+    return loaded
@@ -0,0 +1,632 @@
+"""
+Non-interactive batch mode for the Closetly app. Reads operations from a
+file (or stdin), runs them one after the other over a single session
+without prompting, and writes one JSON object per operation to stdout
+with its result and how long it took.
+
+    $ python3 batch.py ops.txt > results.jsonl
+    $ printf 'login user=ektapatel password=pw\\nshow-closet\\n' | \\
+          python3 batch.py
+
+Each line is an operation name followed by key=value arguments, quoted
+like a shell command line (desc="going out look"). Blank lines and lines
+starting with # are skipped. Lists are separated by commas (ids=1,2,4).
+The pieces to look up with available are separated by semicolons, each
+as type,size,color with size or color left empty to match any
+(pieces="Jeans,28,Blue;Top,,Black").
+Operations:
+
+    login user= password=
+    login token=
+    signup name= user= password= [role=personal]
+    start-session [seconds=]
+    logout
+    show-all [after=0] [limit=]
+    show-closet
+    show-collab [after=0] [limit=]
+    show-user-collab user_id=
+    show-inventory [store=] [after=0] [limit=]
+    search [store=] [type=] [size=] [gender=] [color=] [brand=]
+           [aesthetic=] [min_price=] [max_price=] [min_discount=]
+           [max_discount=] [limit=50]
+    keyword q= [limit=50]
+    available pieces= [limit=20]
+    borrow id=
+    wait id=
+    unwait id=
+    return id=
+    show-borrowed
+    show-waitlist
+    wear ids= [times=1]
+    style-outfit ids= [desc=] [vibe=]
+    show-outfits first= [last=]
+    outfit-total id=
+    store-stats [store=]
+    add-item id= price= [discount=0]
+    remove-item id=
+    sell id= user_id= [store=]
+    markdown discount= [type=] [brand=] [ids=]
+
+Every operation but login and signup needs a logged in user whose role
+is allowed to do it from the interactive menus. start-session returns a
+session token (see sessions.py) that later runs can log in with instead
+of the password, until it expires or logout ends it. Store owners' store
+defaults to their own. Wears are buffered like in the app (see wears.py)
+and written when a flush is due, before show-closet, and at the end.
+"""
+import argparse
+import decimal
+import json
+import shlex
+import sqlite3
+import sys
+import time
+
+import mysql.connector
+
+import app
+import search
+import sessions
+import statements
+from metrics import METRICS
+
+# Column names of the statements whose rows are returned, in order
+COLUMNS = {
+    'show_all_clothes': ['clothing_id', 'clothing_type', 'size', 'gender',
+                         'color', 'brand', 'description', 'image_url',
+                         'aesthetic', 'store_name'],
+    'show_personal_clothes': ['clothing_id', 'clothing_type', 'size',
+                              'gender', 'color', 'brand', 'description',
+                              'image_url', 'aesthetic', 'is_clean',
+                              'shared', 'num_wears'],
+    'show_collaborative_clothes': ['user_id', 'clothing_id', 'clothing_type',
+                                   'size', 'gender', 'color', 'brand',
+                                   'description', 'image_url', 'aesthetic',
+                                   'curr_condition', 'is_available',
+                                   'current_borrower'],
+    'show_user_in_collab': ['clothing_id', 'clothing_type', 'size', 'gender',
+                            'color', 'brand', 'description', 'image_url',
+                            'aesthetic', 'curr_condition', 'is_available',
+                            'current_borrower'],
+    'show_store_inventory': ['clothing_id', 'price', 'discount',
+                             'clothing_type', 'size', 'gender', 'color',
+                             'brand', 'description', 'image_url',
+                             'aesthetic'],
+    'keyword_search': ['clothing_id', 'clothing_type', 'size', 'color',
+                       'brand', 'description', 'aesthetic', 'store_name',
+                       'price', 'is_available', 'relevance'],
+    'show_outfits': ['outfit_id', 'clothing_id', 'outfit_desc', 'vibe'],
+    'show_borrowed': ['clothing_id', 'user_id', 'clothing_type', 'size',
+                      'gender', 'color', 'brand', 'description',
+                      'curr_condition'],
+    'show_waitlist': ['clothing_id', 'clothing_type', 'size', 'color',
+                      'brand', 'place', 'enqueued_at'],
+    'find_available': ['clothing_id', 'location', 'user_id', 'store_name',
+                       'available'],
+}
+
+# Roles that can run each operation once logged in, matching what the
+# interactive menus offer each kind of user. Admins can run everything.
+SHOPPERS = ('personal', 'stylist')
+ROLES = {
+    'start-session': ('personal', 'storeowner', 'stylist'),
+    'logout': ('personal', 'storeowner', 'stylist'),
+    'show-all': ('personal', 'storeowner', 'stylist'),
+    'show-closet': ('personal',),
+    'show-collab': SHOPPERS,
+    'show-user-collab': SHOPPERS,
+    'show-inventory': ('personal', 'storeowner', 'stylist'),
+    'search': ('personal', 'storeowner', 'stylist'),
+    'keyword': SHOPPERS,
+    'available': SHOPPERS,
+    'borrow': ('personal',),
+    'wait': ('personal',),
+    'unwait': ('personal',),
+    'return': ('personal',),
+    'show-borrowed': ('personal',),
+    'show-waitlist': ('personal',),
+    'wear': ('personal',),
+    'style-outfit': SHOPPERS,
+    'show-outfits': SHOPPERS,
+    'outfit-total': SHOPPERS,
+    'store-stats': ('personal', 'storeowner', 'stylist'),
+    'add-item': ('storeowner',),
+    'remove-item': ('storeowner',),
+    'sell': ('storeowner',),
+    'markdown': ('storeowner',),
+}
+
+# search arguments -> search.py filter names
+SEARCH_FILTERS = {'store': 'store_name', 'type': 'clothing_type'}
+RANGE_FILTERS = [bound + name for name in search.RANGES
+                 for bound in ('min_', 'max_')]
+
+
+class BatchError(Exception):
+    """
+    An operation that cannot be run as written (unknown operation, missing
+    argument, not logged in, ...).
+    """
+
+
+def parse(line):
+    """
+    Splits an operation line into (operation, {argument: value}).
+    """
+    words = shlex.split(line)
+    args = {}
+    for word in words[1:]:
+        key, sep, value = word.partition('=')
+        if not sep:
+            raise BatchError('expected key=value, got ' + repr(word))
+        args[key] = value
+    return words[0], args
+
+
+def require(args, key):
+    if key not in args:
+        raise BatchError('missing argument ' + key + '=')
+    return args[key]
+
+
+def ids(value):
+    return [int(i) for i in value.split(',') if i]
+
+
+def amount(args, key, default=None, low=0, high=None):
+    """
+    Returns a price or percentage argument as a Decimal, checking that it
+    is a number between low and high.
+    """
+    value = args.get(key, default)
+    if value is None:
+        raise BatchError('missing argument ' + key + '=')
+    try:
+        number = decimal.Decimal(value)
+    except decimal.InvalidOperation:
+        raise BatchError(key + ' must be a number')
+    if not number.is_finite() or number < low or \
+            (high is not None and number > high):
+        raise BatchError(key + ' must be at least ' + str(low) +
+                         ('' if high is None else ' and at most ' +
+                          str(high)))
+    return number
+
+
+def records(name, rows):
+    """
+    Turns rows of the named statement into dictionaries.
+    """
+    return [dict(zip(COLUMNS[name], row)) for row in rows]
+
+
+def page(name, params, args):
+    """
+    Returns one keyset page of a listing statement as dictionaries, along
+    with the clothing_id to pass as after= for the next page.
+    """
+    limit = int(args.get('limit', app.PAGE_SIZE))
+    # one row more than the page, to know whether there is another one
+    params = params + (int(args.get('after', 0)), limit + 1)
+    if name == 'show_store_inventory':
+        columns, rows = app.store_rows(params[0], name, params)
+    else:
+        rows = statements.fetchall(app.conn, name, params)
+    more = len(rows) > limit
+    rows = records(name, rows[:limit])
+    after = rows[-1]['clothing_id'] if more else None
+    return {'rows': rows, 'next_after': after}
+
+
+def store_of(session, args):
+    if session.role == 'storeowner':
+        # store owners' usernames are their store names
+        return args.get('store', session.username)
+    return require(args, 'store')
+
+
+# ----------------------------------------------------------------------
+# Operations
+# ----------------------------------------------------------------------
+def op_login(session, args):
+    session.__init__()
+    # role accounts cannot read user_info or sessions, so log in from the
+    # admin one
+    app.conn = app.change_connection('appadmin')
+    if 'token' in args:
+        found = sessions.check(app.conn, args['token'])
+        if found is None:
+            raise BatchError('unknown or expired session token')
+        session.__init__(*found, token=args['token'])
+    else:
+        identity = app.lookup_login(require(args, 'user'),
+                                    require(args, 'password'))[2]
+        if identity.username is None:
+            raise BatchError('incorrect login')
+        session.__init__(identity.username, identity.role, identity.user_id)
+    app.conn = app.change_connection(session.role)
+    return {'username': session.username, 'role': session.role,
+            'user_id': session.user_id}
+
+
+def op_start_session(session, args):
+    # only after logging in with the password, so that a token cannot be
+    # used to keep getting new ones
+    if session.token is not None:
+        raise BatchError('already in a session')
+    seconds = int(args.get('seconds', sessions.SESSION_SECONDS))
+    if not 1 <= seconds <= sessions.SESSION_SECONDS:
+        raise BatchError('seconds must be between 1 and ' +
+                         str(sessions.SESSION_SECONDS))
+    app.conn = app.change_connection('appadmin')
+    try:
+        session.token = sessions.start(app.conn, session.username,
+                                       session.role, session.user_id,
+                                       seconds)
+    finally:
+        app.conn = app.change_connection(session.role)
+    return {'token': session.token, 'expires_in': seconds}
+
+
+def op_logout(session, args):
+    app.conn = app.change_connection('appadmin')
+    ended = session.token is not None and sessions.end(app.conn,
+                                                       session.token)
+    session.__init__()
+    return {'ended_session': ended}
+
+
+def op_signup(session, args):
+    username = require(args, 'user')
+    role = args.get('role', 'personal')
+    if role not in ('personal', 'storeowner', 'stylist'):
+        raise BatchError('role must be personal, storeowner or stylist')
+    if len(username) > 20:
+        raise BatchError('username must be 20 characters or less')
+    app.conn = app.change_connection('appadmin')
+    if app.lookup_login(username, '')[0]:
+        raise BatchError('username already exists')
+    statements.execute(app.conn, 'add_permission', (username, role))
+    app.conn.commit()
+    app.add_user(require(args, 'name'), username, require(args, 'password'))
+    return op_login(session, {'user': username,
+                              'password': args['password']})
+
+
+def op_show_all(session, args):
+    return page('show_all_clothes', (), args)
+
+
+def op_show_closet(session, args):
+    app.flush_wears()
+    rows = statements.fetchall(app.conn, 'show_personal_clothes',
+                               (session.username,))
+    return {'rows': records('show_personal_clothes', rows)}
+
+
+def op_show_collab(session, args):
+    return page('show_collaborative_clothes', (), args)
+
+
+def op_show_user_collab(session, args):
+    rows = statements.fetchall(app.conn, 'show_user_in_collab',
+                               (int(require(args, 'user_id')),))
+    return {'rows': records('show_user_in_collab', rows)}
+
+
+def op_show_inventory(session, args):
+    return page('show_store_inventory', (store_of(session, args),), args)
+
+
+def op_search(session, args):
+    filters = {}
+    for key, value in args.items():
+        if key == 'limit':
+            continue
+        name = SEARCH_FILTERS.get(key, key)
+        if name not in search.FACETS and name not in RANGE_FILTERS:
+            raise BatchError('unknown search filter ' + key + '=')
+        filters[name] = value
+    if session.role == 'storeowner':
+        filters['store_name'] = store_of(session, args)
+    rows, counts, total = search.search(app.conn, filters,
+                                        int(args.get('limit', 50)))
+    return {'rows': [dict(zip(search.COLUMNS, row)) for row in rows],
+            'total': total,
+            'counts': {facet: dict(values) for facet, values in
+                       counts.items()}}
+
+
+def op_keyword(session, args):
+    keywords = require(args, 'q')
+    rows = statements.fetchall(app.conn, 'keyword_search',
+                               (keywords, keywords,
+                                int(args.get('limit', 50))))
+    return {'rows': records('keyword_search', rows)}
+
+
+def op_available(session, args):
+    criteria = []
+    for piece in require(args, 'pieces').split(';'):
+        fields = [field.strip() or None for field in piece.split(',')]
+        if fields[0]:
+            criteria.append((fields + [None, None])[:3])
+    found = app.find_available(criteria, int(args.get('limit',
+                                                      app.AVAILABLE_PER_PIECE)))
+    return {'pieces': [{'clothing_type': criterion[0], 'size': criterion[1],
+                        'color': criterion[2],
+                        'rows': records('find_available', rows)}
+                       for criterion, rows in zip(criteria, found)]}
+
+
+def op_borrow(session, args):
+    res = statements.fetchone(app.conn, 'borrow_item',
+                              (session.user_id, int(require(args, 'id'))))
+    app.conn.commit()
+    return {'borrowed': res[0] == 1}
+
+
+def op_wait(session, args):
+    res = statements.fetchone(app.conn, 'join_waitlist',
+                              (session.user_id, int(require(args, 'id'))))
+    app.conn.commit()
+    if res[0] < 0:
+        raise BatchError('cannot wait for item ' + args['id'])
+    # place is None if the item was free and got borrowed right away
+    return {'borrowed': res[0] == 0, 'place': res[0] or None}
+
+
+def op_unwait(session, args):
+    left = statements.execute(app.conn, 'leave_waitlist',
+                              (session.user_id,
+                               int(require(args, 'id')))).rowcount
+    app.conn.commit()
+    return {'left': left == 1}
+
+
+def op_return(session, args):
+    res = statements.fetchone(app.conn, 'return_item',
+                              (session.user_id, int(require(args, 'id'))))
+    app.conn.commit()
+    if res[0] < 0:
+        raise BatchError('not borrowing item ' + args['id'])
+    return {'lent_to': res[0] or None}
+
+
+def op_show_borrowed(session, args):
+    rows = statements.fetchall(app.conn, 'show_borrowed', (session.user_id,))
+    return {'rows': records('show_borrowed', rows)}
+
+
+def op_show_waitlist(session, args):
+    rows = statements.fetchall(app.conn, 'show_waitlist', (session.user_id,))
+    return {'rows': records('show_waitlist', rows)}
+
+
+def op_wear(session, args):
+    if session.user_id is None:
+        # e.g. the example accounts, whose user rows setup removes
+        raise BatchError('user ' + session.username + ' has no closet')
+    clothing_ids = ids(require(args, 'ids'))
+    app.record_wears(session.user_id, clothing_ids,
+                     int(args.get('times', 1)))
+    return {'recorded': len(clothing_ids)}
+
+
+def op_style_outfit(session, args):
+    outfit_id = app.write_outfits([(ids(require(args, 'ids')),
+                                    args.get('desc', ''),
+                                    args.get('vibe', ''))])[0]
+    return {'outfit_id': outfit_id}
+
+
+def op_show_outfits(session, args):
+    first = int(require(args, 'first'))
+    rows = statements.fetchall(app.conn, 'show_outfits',
+                               (first, int(args.get('last', first))))
+    return {'rows': records('show_outfits', rows)}
+
+
+def op_outfit_total(session, args):
+    columns, rows = statements.query(app.conn, 'outfit_total',
+                                     (int(require(args, 'id')),))
+    return dict(zip(columns, rows[0])) if rows else None
+
+
+def op_store_stats(session, args):
+    columns, rows = statements.query(app.conn, 'store_stats',
+                                     (store_of(session, args),))
+    return dict(zip(columns, rows[0])) if rows else None
+
+
+def op_add_item(session, args):
+    price = amount(args, 'price')
+    discount = amount(args, 'discount', '0', high=100)
+    statements.execute(app.conn, 'add_store_item',
+                       (session.username, int(require(args, 'id')), price,
+                        discount, app.original_price(price, discount)))
+    app.store_changed(session.username)
+    return {}
+
+
+def op_remove_item(session, args):
+    cursor = statements.execute(app.conn, 'remove_store_item',
+                                (int(require(args, 'id')), session.username))
+    app.store_changed(session.username)
+    return {'removed': cursor.rowcount}
+
+
+def op_sell(session, args):
+    store_name = store_of(session, args)
+    statements.execute(app.conn, 'sell_to_user',
+                       (int(require(args, 'id')),
+                        int(require(args, 'user_id')), store_name))
+    app.store_changed(store_name)
+    return {}
+
+
+def op_markdown(session, args):
+    discount = amount(args, 'discount', high=100)
+    if 'ids' in args:
+        count = app.markdown(session.username, discount,
+                             clothing_ids=ids(args['ids']))
+    else:
+        count = app.markdown(session.username, discount,
+                             clothing_type=args.get('type') or None,
+                             brand=args.get('brand') or None)
+    return {'repriced': count}
+
+
+OPERATIONS = {
+    'login': op_login,
+    'signup': op_signup,
+    'start-session': op_start_session,
+    'logout': op_logout,
+    'show-all': op_show_all,
+    'show-closet': op_show_closet,
+    'show-collab': op_show_collab,
+    'show-user-collab': op_show_user_collab,
+    'show-inventory': op_show_inventory,
+    'search': op_search,
+    'keyword': op_keyword,
+    'available': op_available,
+    'borrow': op_borrow,
+    'wait': op_wait,
+    'unwait': op_unwait,
+    'return': op_return,
+    'show-borrowed': op_show_borrowed,
+    'show-waitlist': op_show_waitlist,
+    'wear': op_wear,
+    'style-outfit': op_style_outfit,
+    'show-outfits': op_show_outfits,
+    'outfit-total': op_outfit_total,
+    'store-stats': op_store_stats,
+    'add-item': op_add_item,
+    'remove-item': op_remove_item,
+    'sell': op_sell,
+    'markdown': op_markdown,
+}
+
+
+def run_operation(session, op, args):
+    """
+    Checks that the session may run an operation and runs it, returning
+    its result.
+    """
+    if op not in OPERATIONS:
+        raise BatchError('unknown operation ' + op)
+    if op in ROLES:
+        if session.username is None:
+            raise BatchError('not logged in')
+        if session.role != 'appadmin' and session.role not in ROLES[op]:
+            raise BatchError(session.role + ' users cannot ' + op)
+    with METRICS.command(op):
+        return OPERATIONS[op](session, args)
+
+
+def to_json(value):
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode()
+    return str(value)
+
+
+def run(lines, out=sys.stdout, stop_on_error=False):
+    """
+    Runs every operation in lines, writing a JSON result per operation to
+    out. Returns the number of operations that failed.
+    """
+    session = app.Session()
+    failures = 0
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        result = {'line': number}
+        start = time.perf_counter()
+        try:
+            op, args = parse(line)
+            result['op'] = op
+            result['result'] = run_operation(session, op, args)
+            result['ok'] = True
+        except (BatchError, ValueError, mysql.connector.Error,
+                sqlite3.Error) as err:
+            # the SQLite backend raises most of its errors as connector
+            # errors, but not all of them
+            if isinstance(err, (mysql.connector.Error, sqlite3.Error)):
+                app.conn.rollback()
+            result['ok'] = False
+            result['error'] = str(err)
+            failures += 1
+        result['ms'] = round((time.perf_counter() - start) * 1000, 3)
+        out.write(json.dumps(result, default=to_json) + '\n')
+        out.flush()
+        if failures and stop_on_error:
+            break
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run Closetly operations ' +
+                                     'from a file without prompting')
+    parser.add_argument('file', nargs='?', default='-',
+                        help='file of operations, one per line ' +
+                             '(default: stdin)')
+    parser.add_argument('--stop-on-error', action='store_true',
+                        help='stop at the first operation that fails')
+    parser.add_argument('--primary', metavar='HOST[:PORT]',
+                        type=app.host_port, default=app.PRIMARY,
+                        help='database server to write to')
+    parser.add_argument('--replica', metavar='HOST[:PORT]',
+                        type=app.host_port, action='append', default=[],
+                        help='read replica to send reads to; can be ' +
+                             'given more than once')
+    parser.add_argument('--sqlite', metavar='FILE',
+                        help='run on a SQLite database file instead of ' +
+                             'MySQL, creating it from the CSV files in ' +
+                             'the current directory if it does not exist')
+    parser.add_argument('--slow-query-ms', type=float,
+                        help='log queries slower than this with their ' +
+                             'EXPLAIN output to stderr')
+    parser.add_argument('--metrics', metavar='FILE',
+                        help='write query and operation latencies to FILE ' +
+                             '(JSON if it ends in .json, Prometheus text ' +
+                             'otherwise) when done')
+    parser.add_argument('--wear-journal', metavar='FILE',
+                        help='also append wears to FILE until they are ' +
+                             'written, and write any left in it')
+    args = parser.parse_args()
+    METRICS.slow_query_ms = args.slow_query_ms
+    if args.wear_journal:
+        app.WEARS = app.wears.WearBuffer(max_events=app.WEAR_FLUSH_EVENTS,
+                                         max_seconds=app.WEAR_FLUSH_SECONDS,
+                                         journal=args.wear_journal)
+    if args.sqlite:
+        if args.replica:
+            parser.error('--replica cannot be used with --sqlite')
+        app.BACKEND = app.SQLiteBackend(args.sqlite)
+        if not app.BACKEND.exists():
+            app.BACKEND.create('.')
+    elif args.primary != app.PRIMARY or args.replica:
+        app.POOL = app.make_pool(args.primary, args.replica)
+    app.conn = app.get_conn(*statements.DB_ACCOUNTS['appadmin'])
+    app.warm_pool()
+    try:
+        if args.file == '-':
+            failures = run(sys.stdin, stop_on_error=args.stop_on_error)
+        else:
+            with open(args.file) as f:
+                failures = run(f, stop_on_error=args.stop_on_error)
+    finally:
+        app.POOL.release(app.conn)
+        app.flush_wears()
+        app.WEARS.close()
+        app.POOL.close_all()
+        if args.metrics:
+            METRICS.dump(args.metrics)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
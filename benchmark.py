@@ -0,0 +1,1723 @@
+"""
+Benchmark suite for the Closetly database. Seeds a scratch database with
+synthetic closets at several sizes, then times every statement app.py
+runs (see statements.py) and every query in queries.sql. Latency
+percentiles and EXPLAIN plans are written to JSON so that index and
+schema changes can be compared across runs. The borrow command checks
+that concurrent borrowers never get the same collaborative closet item
+and reports borrows/sec as the number of client processes grows. The
+waitlist command simulates users waiting for popular items and counts
+the statements needed per borrow with retry polling and with waitlists.
+
+Needs a local MySQL server and an account that can create databases,
+e.g.
+
+    $ python3 benchmark.py queries --user root --password rootpw
+    $ python3 benchmark.py compare before.json after.json
+    $ python3 benchmark.py borrow --clients 1 4 16 64 --items 100
+    $ python3 benchmark.py waitlist --items 10 --users 100
+    $ python3 benchmark.py login --clients 1 4 16
+    $ python3 benchmark.py startup
+    $ python3 benchmark.py replicas --port 3306 --replica-port 3307
+    $ python3 benchmark.py recommend --scales 100000 1000000
+    $ python3 benchmark.py wears --duration 10
+    $ python3 benchmark.py backends --scale 100000
+    $ python3 benchmark.py warehouse --changes 1000
+
+The scratch database (closetly_bench by default) is dropped and
+recreated for every scale.
+"""
+import argparse
+import datetime
+import json
+import math
+import multiprocessing
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+import mysql.connector
+
+import backends
+import bulk_load
+import generate_data
+import search
+import sessions
+import statements
+import wears
+
+# Statements app.py always runs, before any searches get registered
+REGISTRY = list(statements.STATEMENTS)
+
+# Scripts run (in order) to create the schema and routines in the scratch
+# database. load-data.sql is replaced by seed() below.
+SETUP_SCRIPTS = ['setup-closetly.sql', 'setup-passwords.sql',
+                 'setup-routines.sql', 'setup-permissions.sql',
+                 'setup-rollups.sql', 'setup-export.sql',
+                 'setup-sessions.sql', 'setup-waitlist.sql']
+
+# ----------------------------------------------------------------------
+# Setting up the scratch database
+# ----------------------------------------------------------------------
+def read_script(path):
+    """
+    Returns the statements in a .sql file, split the way the mysql
+    client's source command would split them (including DELIMITER
+    changes), with comments removed.
+    """
+    with open(path) as f:
+        text = re.sub(r'/\*.*?\*/', '', f.read(), flags=re.S)
+    delimiter = ';'
+    found = []
+    statement = []
+    for line in text.splitlines():
+        stripped = line.strip()
+        if stripped.upper().startswith('DELIMITER'):
+            delimiter = stripped.split()[1]
+            continue
+        if not stripped or stripped.startswith('--'):
+            continue
+        statement.append(line)
+        if stripped.endswith(delimiter):
+            sql = '\n'.join(statement).rstrip()[:-len(delimiter)].strip()
+            if sql:
+                found.append(sql)
+            statement = []
+    return found
+
+
+def run_script(conn, path):
+    """
+    Runs every statement in a .sql file and commits.
+    """
+    cursor = conn.cursor()
+    for sql in read_script(path):
+        cursor.execute(sql)
+        if cursor.with_rows:
+            cursor.fetchall()
+    conn.commit()
+
+
+def create_database(conn, database):
+    """
+    Drops and recreates the scratch database with the app's schema and
+    routines.
+    """
+    cursor = conn.cursor()
+    cursor.execute('DROP DATABASE IF EXISTS `' + database + '`')
+    cursor.execute('CREATE DATABASE `' + database + '`')
+    conn.database = database
+    for path in SETUP_SCRIPTS:
+        run_script(conn, path)
+
+
+def seed(conn, scale, seed):
+    """
+    Fills the scratch database with generated data (see generate_data.py)
+    using the bulk loader, and returns the data set's Layout.
+    """
+    with tempfile.TemporaryDirectory() as data_dir:
+        layout = generate_data.generate(data_dir, scale, seed)
+        bulk_load.load(conn, data_dir)
+    return layout
+
+
+# ----------------------------------------------------------------------
+# Parameters for each statement in statements.py
+# ----------------------------------------------------------------------
+def make_samplers(layout, rng):
+    """
+    Returns a function per statement in statements.py that picks random,
+    realistic parameters for it from the given layout. Statements that
+    write are rolled back after every run, so their parameters only need
+    to be valid against the seeded data.
+    """
+    def user_id():
+        # only personal users have closets
+        return rng.randint(1, layout.num_users)
+
+    def username():
+        return layout.username(user_id())
+
+    def personal_id():
+        return rng.randint(1, layout.num_personal)
+
+    def collab_id():
+        return 3 * rng.randint(1, layout.num_personal // 3)
+
+    def store_item():
+        clothing_id = rng.randint(layout.num_personal + 1, layout.scale)
+        return layout.store(clothing_id), clothing_id
+
+    def store():
+        return store_item()[0]
+
+    def sale():
+        store_name, clothing_id = store_item()
+        return clothing_id, user_id(), store_name
+
+    def new_username():
+        return 'bench' + str(rng.randrange(10 ** 9))
+
+    def outfit_id():
+        return rng.randint(1, layout.num_outfits)
+
+    def page_start():
+        return rng.randint(0, layout.scale)
+
+    def piece():
+        # what a planned outfit piece looks like: a type, usually a size
+        # and color
+        clothing_type = rng.choice(list(generate_data.TYPES))
+        return [clothing_type,
+                rng.choice(generate_data.TYPES[clothing_type][1])
+                if rng.random() < 0.7 else None,
+                rng.choice(generate_data.COLORS)
+                if rng.random() < 0.7 else None]
+
+    def worn():
+        # a batch of wears as wears.py writes them
+        clothing_ids = rng.sample(range(1, layout.num_personal + 1),
+                                  min(100, layout.num_personal))
+        return json.dumps(sorted([layout.owner(clothing_id), clothing_id,
+                                  rng.randint(1, 3)]
+                                 for clothing_id in clothing_ids))
+
+    def keywords():
+        # a couple of words like the ones generate_data.py describes
+        # clothes with
+        return rng.choice(generate_data.ADJECTIVES) + ' ' + \
+            rng.choice(generate_data.AESTHETICS + generate_data.STORES)
+
+    def token_hash():
+        # of a session that was never started, so lookups find nothing
+        return rng.randbytes(32)
+
+    return {
+        'login': lambda: (generate_data.PASSWORD,) + (username(),) * 2,
+        'start_session': lambda: (token_hash(), username(), 'personal',
+                                  user_id(), 3600),
+        'check_session': lambda: (token_hash(),),
+        'end_session': lambda: (token_hash(),),
+        'prune_sessions': lambda: (),
+        'add_user': lambda: (new_username(), generate_data.PASSWORD),
+        'add_to_user': lambda: ('Bench User', new_username()),
+        'add_permission': lambda: (new_username(), 'personal'),
+        'show_all_clothes': lambda: (page_start(), 50),
+        'show_personal_clothes': lambda: (username(),),
+        'show_collaborative_clothes': lambda: (page_start(), 50),
+        'show_user_in_collab': lambda: (user_id(),),
+        'borrow_item': lambda: (user_id(), collab_id()),
+        'join_waitlist': lambda: (user_id(), collab_id()),
+        'leave_waitlist': lambda: (user_id(), collab_id()),
+        'return_item': lambda: (user_id(), collab_id()),
+        'show_borrowed': lambda: (user_id(),),
+        'show_waitlist': lambda: (user_id(),),
+        'record_wears': lambda: (worn(),),
+        'wear_out': lambda: (worn(),),
+        'keyword_search': lambda: (keywords(),) * 2 + (50,),
+        'find_available': lambda: (json.dumps(
+            [piece() for _ in range(rng.randint(1, 4))]), 20),
+        'show_store_inventory': lambda: (store(), page_start(), 50),
+        'add_store_item': lambda: (store(), personal_id(), 40, 20, 50),
+        'remove_store_item': lambda: tuple(reversed(store_item())),
+        'sell_to_user': sale,
+        'markdown': lambda: (20, 20, store()) +
+                            (rng.choice(list(generate_data.TYPES)),) * 2 +
+                            (None, None),
+        'markdown_items': lambda: (20, 20, store(), json.dumps(
+            [store_item()[1] for _ in range(10)])),
+        'next_outfit_id': lambda: (),
+        'add_outfit_items': lambda: (layout.num_outfits + 1, personal_id(),
+                                     'bench outfit', 'casual'),
+        'store_stats': lambda: (store(),),
+        'outfit_total': lambda: (outfit_id(),),
+        'show_outfits': lambda: (outfit_id(),) * 2,
+        # what refreshing the suggestion model reads after the last 1000
+        # clothes and 100 outfits were added
+        'recommend_clothes': lambda: (max(0, layout.scale - 1000),),
+        'recommend_outfits': lambda: (max(0, layout.num_outfits - 100),),
+    }
+
+
+def search_cases(layout, rng):
+    """
+    Returns a function per typical combination of search filters (see
+    search.py) that picks random values for them.
+    """
+    samplers = make_samplers(layout, rng)
+    store = lambda: samplers['show_store_inventory']()[0]
+    clothing_type = lambda: rng.choice(list(generate_data.TYPES))
+    size = lambda: rng.choice(generate_data.TYPES[clothing_type()][1])
+    return {
+        'search(store)': lambda: {'store_name': store()},
+        'search(store, price)': lambda: {'store_name': store(),
+                                         'min_price': 20, 'max_price': 100},
+        'search(store, discount)': lambda: {'store_name': store(),
+                                            'min_discount': 20,
+                                            'max_discount': 50},
+        'search(type, size, color)': lambda: {
+            'clothing_type': clothing_type(), 'size': size(),
+            'color': rng.choice(generate_data.COLORS)},
+        'search(brand, type, price)': lambda: {
+            'brand': rng.choice(generate_data.STORES),
+            'clothing_type': clothing_type(), 'max_price': 80},
+        'search(store, gender, aesthetic, discount)': lambda: {
+            'store_name': store(), 'gender': 'W',
+            'aesthetic': rng.choice(generate_data.AESTHETICS),
+            'min_discount': 10},
+    }
+
+
+# ----------------------------------------------------------------------
+# Timing
+# ----------------------------------------------------------------------
+def percentile(samples, pct):
+    """
+    Returns the given percentile of samples (nearest-rank method).
+    """
+    ordered = sorted(samples)
+    index = max(0, math.ceil(pct / 100 * len(ordered)) - 1)
+    return ordered[index]
+
+
+def summarize(latencies, rows):
+    """
+    Summarizes a list of latencies (in seconds) in milliseconds.
+    """
+    return {'iterations': len(latencies),
+            'rows': rows,
+            'mean_ms': 1000 * sum(latencies) / len(latencies),
+            'p50_ms': 1000 * percentile(latencies, 50),
+            'p95_ms': 1000 * percentile(latencies, 95),
+            'p99_ms': 1000 * percentile(latencies, 99),
+            'max_ms': 1000 * max(latencies)}
+
+
+def explain(conn, sql, params=None):
+    """
+    Returns the JSON query plan for a statement, or None for statements
+    that cannot be explained (CALL).
+    """
+    if sql.lstrip().upper().startswith('CALL'):
+        return None
+    cursor = conn.cursor()
+    cursor.execute('EXPLAIN FORMAT=JSON ' + sql, params)
+    plan = json.loads(cursor.fetchone()[0])
+    conn.rollback()
+    return plan
+
+
+def time_registry(conn, name, sampler, iterations):
+    """
+    Times a statement from statements.py the way the app runs it (as a
+    prepared statement), rolling back after every run.
+    """
+    latencies = []
+    rows = 0
+    for _ in range(iterations):
+        params = sampler()
+        start = time.perf_counter()
+        rows += len(statements.fetchall(conn, name, params))
+        latencies.append(time.perf_counter() - start)
+        conn.rollback()
+    result = summarize(latencies, rows)
+    result['sql'] = statements.STATEMENTS[name]
+    result['explain'] = explain(conn, statements.STATEMENTS[name], sampler())
+    return result
+
+
+def time_sql(conn, sql, iterations):
+    """
+    Times a plain SQL statement, rolling back after every run.
+    """
+    cursor = conn.cursor()
+    latencies = []
+    rows = 0
+    for _ in range(iterations):
+        start = time.perf_counter()
+        cursor.execute(sql)
+        if cursor.with_rows:
+            rows += len(cursor.fetchall())
+        latencies.append(time.perf_counter() - start)
+        conn.rollback()
+    result = summarize(latencies, rows)
+    result['sql'] = sql
+    result['explain'] = explain(conn, sql)
+    return result
+
+
+def benchmark_scale(conn, database, scale, iterations, rng):
+    """
+    Creates and seeds the scratch database at the given scale and times
+    every statement. Returns the results for this scale.
+    """
+    print('Seeding', scale, 'clothes...', file=sys.stderr)
+    start = time.perf_counter()
+    create_database(conn, database)
+    layout = seed(conn, scale, rng.randrange(2 ** 32))
+    run = {'scale': scale, 'seed_seconds': time.perf_counter() - start,
+           'queries': {}}
+    samplers = make_samplers(layout, rng)
+    cases = [(name, name, samplers.get(name)) for name in REGISTRY]
+    for label, make_filters in search_cases(layout, rng).items():
+        name, counts_name, _, _ = search.plan(make_filters())
+        cases.append((label, name,
+                      lambda make_filters=make_filters: search.row_params(
+                          search.plan(make_filters())[2], 50)))
+        cases.append((label + ' counts', counts_name,
+                      lambda make_filters=make_filters:
+                          search.plan(make_filters())[3]))
+    for label, name, sampler in cases:
+        print('  timing', label, file=sys.stderr)
+        try:
+            if sampler is None:
+                raise KeyError('no parameter sampler for ' + name)
+            run['queries'][label] = time_registry(conn, name, sampler,
+                                                  iterations)
+        except (mysql.connector.Error, KeyError) as err:
+            conn.rollback()
+            run['queries'][label] = {'error': str(err),
+                                     'sql': statements.STATEMENTS[name]}
+    for i, sql in enumerate(read_script('queries.sql'), 1):
+        name = 'queries.sql#' + str(i)
+        print('  timing', name, file=sys.stderr)
+        try:
+            run['queries'][name] = time_sql(conn, sql, iterations)
+        except mysql.connector.Error as err:
+            conn.rollback()
+            run['queries'][name] = {'error': str(err), 'sql': sql}
+    return run
+
+
+def git_commit():
+    """
+    Returns the commit the benchmark is being run from, if any.
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'],
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def connect(args):
+    return mysql.connector.connect(host=args.host, port=args.port,
+                                   user=args.user, password=args.password,
+                                   allow_local_infile=True)
+
+
+def run_queries(args):
+    """
+    Runs the query benchmark at every requested scale and writes the
+    results to a JSON file.
+    """
+    if args.database == 'closetly':
+        sys.exit('Refusing to drop the closetly database, pick another ' +
+                 'one with --database.')
+    conn = connect(args)
+    cursor = conn.cursor()
+    cursor.execute('SELECT VERSION()')
+    results = {'started_at': datetime.datetime.now().isoformat(),
+               'git_commit': git_commit(),
+               'server_version': cursor.fetchone()[0],
+               'iterations': args.iterations,
+               'runs': []}
+    rng = random.Random(args.seed)
+    for scale in args.scales:
+        results['runs'].append(benchmark_scale(conn, args.database, scale,
+                                               args.iterations, rng))
+    conn.close()
+    output = args.output or ('bench-' +
+                             datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+                             + '.json')
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2, default=str)
+    print('Wrote', output)
+
+
+# ----------------------------------------------------------------------
+# Concurrent borrowing
+# ----------------------------------------------------------------------
+def borrow_worker(conn_args, items, num_users, seed, start_at, stop_at,
+                  results):
+    """
+    Runs in its own process: borrows random items as random users from
+    start_at until stop_at, committing after every attempt, and puts
+    (attempts, [(clothing_id, borrower) borrowed], latencies) on results.
+    """
+    conn = mysql.connector.connect(**conn_args)
+    rng = random.Random(seed)
+    attempts = 0
+    borrowed = []
+    latencies = []
+    while time.time() < start_at:
+        time.sleep(0.001)
+    while time.time() < stop_at:
+        clothing_id = rng.choice(items)
+        user_id = rng.randint(1, num_users)
+        start = time.perf_counter()
+        res = statements.fetchone(conn, 'borrow_item',
+                                  (user_id, clothing_id))[0]
+        conn.commit()
+        latencies.append(time.perf_counter() - start)
+        attempts += 1
+        if res == 1:
+            borrowed.append((clothing_id, user_id))
+    conn.close()
+    results.put((attempts, borrowed, latencies))
+
+
+def borrow_round(conn, conn_args, layout, items, clients, duration, rng):
+    """
+    Makes every item available, then has clients processes borrow them
+    at once for duration seconds. Checks that no item was borrowed twice
+    and that the table agrees with what the clients were told, and
+    returns the round's results.
+    """
+    cursor = conn.cursor()
+    ids = json.dumps(items)
+    in_items = ("clothing_id IN (SELECT id FROM JSON_TABLE(%s, '$[*]' " +
+                "COLUMNS (id INTEGER PATH '$')) AS ids)")
+    cursor.execute('UPDATE collab_closet SET is_available = 1, ' +
+                   'current_borrower = NULL WHERE ' + in_items, (ids,))
+    conn.commit()
+    results = multiprocessing.Queue()
+    start_at = time.time() + 1 + clients * 0.05
+    workers = [multiprocessing.Process(
+        target=borrow_worker,
+        args=(conn_args, items, layout.num_users, rng.randrange(2 ** 32),
+              start_at, start_at + duration, results))
+        for _ in range(clients)]
+    for worker in workers:
+        worker.start()
+    attempts = 0
+    borrowed = []
+    latencies = []
+    for _ in workers:
+        worker_attempts, worker_borrowed, worker_latencies = results.get()
+        attempts += worker_attempts
+        borrowed.extend(worker_borrowed)
+        latencies.extend(worker_latencies)
+    for worker in workers:
+        worker.join()
+    cursor.execute('SELECT clothing_id, current_borrower FROM collab_closet ' +
+                   'WHERE is_available = 0 AND ' + in_items, (ids,))
+    in_table = dict(cursor.fetchall())
+    times_borrowed = {}
+    for clothing_id, _ in borrowed:
+        times_borrowed[clothing_id] = times_borrowed.get(clothing_id, 0) + 1
+    double_borrows = sum(1 for n in times_borrowed.values() if n > 1)
+    mismatches = sum(1 for clothing_id, user_id in borrowed
+                     if in_table.get(clothing_id) != user_id)
+    mismatches += len(set(in_table) - set(times_borrowed))
+    result = summarize(latencies, None) if latencies else {}
+    result.update({'clients': clients, 'attempts': attempts,
+                   'borrowed': len(borrowed),
+                   'attempts_per_sec': attempts / duration,
+                   'borrows_per_sec': len(borrowed) / duration,
+                   'double_borrows': double_borrows,
+                   'mismatches': mismatches})
+    return result
+
+
+def run_borrow(args):
+    """
+    Seeds the scratch database, then runs rounds of concurrent borrowing
+    with more and more client processes and reports throughput and
+    whether any item was ever borrowed by two clients.
+    """
+    if args.database == 'closetly':
+        sys.exit('Refusing to drop the closetly database, pick another ' +
+                 'one with --database.')
+    conn = connect(args)
+    rng = random.Random(args.seed)
+    print('Seeding', args.scale, 'clothes...', file=sys.stderr)
+    create_database(conn, args.database)
+    layout = seed(conn, args.scale, rng.randrange(2 ** 32))
+    shared = range(3, layout.num_personal + 1, 3)
+    items = rng.sample(shared, min(args.items, len(shared)))
+    conn_args = {'host': args.host, 'port': args.port, 'user': args.user,
+                 'password': args.password, 'database': args.database}
+    results = {'started_at': datetime.datetime.now().isoformat(),
+               'git_commit': git_commit(), 'scale': args.scale,
+               'items': len(items), 'duration': args.duration, 'rounds': []}
+    print('{:>8} {:>10} {:>10} {:>11} {:>9} {:>9} {:>8}'.format(
+        'clients', 'attempts/s', 'borrows/s', 'borrowed', 'p50 ms',
+        'p99 ms', 'doubles'))
+    failed = False
+    for clients in args.clients:
+        result = borrow_round(conn, conn_args, layout, items, clients,
+                              args.duration, rng)
+        results['rounds'].append(result)
+        print('{:>8} {:>10.0f} {:>10.0f} {:>11} {:>9.2f} {:>9.2f} {:>8}'
+              .format(clients, result['attempts_per_sec'],
+                      result['borrows_per_sec'], result['borrowed'],
+                      result.get('p50_ms', 0), result.get('p99_ms', 0),
+                      result['double_borrows']))
+        if result['double_borrows'] or result['mismatches']:
+            failed = True
+    conn.close()
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, default=str)
+    if failed:
+        sys.exit('Some items were borrowed twice or do not match the table.')
+
+
+# ----------------------------------------------------------------------
+# Waitlists
+# ----------------------------------------------------------------------
+def reset_items(conn, items):
+    """
+    Makes the given collaborative closet items available and empties
+    their waitlists.
+    """
+    in_items = 'clothing_id IN (' + ', '.join(['%s'] * len(items)) + ')'
+    cursor = conn.cursor()
+    cursor.execute('UPDATE collab_closet SET is_available = 1, ' +
+                   'current_borrower = NULL WHERE ' + in_items, items)
+    cursor.execute('DELETE FROM borrow_waitlist WHERE ' + in_items, items)
+    cursor.execute('SELECT clothing_id, user_id FROM collab_closet WHERE ' +
+                   in_items, items)
+    owners = dict(cursor.fetchall())
+    conn.commit()
+    return owners
+
+
+def waitlist_round(conn, items, users, method, ticks, hold, want, rng):
+    """
+    Simulates users borrowing a few popular items for the given number
+    of ticks, with the given method of getting an item that someone else
+    has: 'poll' tries borrow_item again every tick until it works, and
+    'waitlist' joins the item's waitlist once and is lent the item when
+    it is returned. Every tick, each user who wants nothing starts
+    wanting a random item with probability want, and each borrower
+    returns their item after hold ticks. Statements commit one at a time,
+    like the app's. Checks that the table agrees with who the simulation
+    thinks has each item and returns the round's results.
+    """
+    owners = reset_items(conn, items)
+    holder = {}           # clothing_id -> (user_id, tick borrowed)
+    wanting = {}          # user_id -> (clothing_id, tick it was wanted)
+    queued = set()        # users on a waitlist
+    waits = []
+    count = 0
+
+    def run(name, params):
+        nonlocal count
+        count += 1
+        res = statements.fetchone(conn, name, params)[0]
+        conn.commit()
+        return res
+
+    def got(user_id, clothing_id, tick):
+        wanted_at = wanting.pop(user_id)[1]
+        waits.append(tick - wanted_at)
+        holder[clothing_id] = (user_id, tick)
+        queued.discard(user_id)
+
+    start = time.perf_counter()
+    for tick in range(ticks):
+        for clothing_id, (user_id, since) in list(holder.items()):
+            if tick - since < hold:
+                continue
+            del holder[clothing_id]
+            next_id = run('return_item', (user_id, clothing_id))
+            if next_id > 0:
+                # lent in the same transaction, the waiter does nothing
+                got(next_id, clothing_id, tick)
+        order = list(users)
+        rng.shuffle(order)
+        for user_id in order:
+            if user_id not in wanting:
+                if rng.random() >= want or any(
+                        user_id == borrower for borrower, _ in
+                        holder.values()):
+                    continue
+                choices = [clothing_id for clothing_id in items
+                           if owners[clothing_id] != user_id]
+                if not choices:
+                    continue
+                wanting[user_id] = (rng.choice(choices), tick)
+            if user_id in queued:
+                continue
+            clothing_id = wanting[user_id][0]
+            if method == 'poll':
+                if run('borrow_item', (user_id, clothing_id)) == 1:
+                    got(user_id, clothing_id, tick)
+            else:
+                place = run('join_waitlist', (user_id, clothing_id))
+                if place == 0:
+                    got(user_id, clothing_id, tick)
+                elif place > 0:
+                    queued.add(user_id)
+    seconds = time.perf_counter() - start
+    cursor = conn.cursor()
+    cursor.execute('SELECT clothing_id, current_borrower FROM collab_closet ' +
+                   'WHERE is_available = 0 AND clothing_id IN (' +
+                   ', '.join(['%s'] * len(items)) + ')', items)
+    in_table = dict(cursor.fetchall())
+    conn.commit()
+    expected = {clothing_id: user_id
+                for clothing_id, (user_id, _) in holder.items()}
+    return {'method': method, 'statements': count, 'borrows': len(waits),
+            'statements_per_borrow': count / len(waits) if waits else None,
+            'mean_wait_ticks': sum(waits) / len(waits) if waits else None,
+            'p95_wait_ticks': percentile(waits, 95) if waits else None,
+            'seconds': seconds,
+            'mismatches': len(set(in_table.items()) ^
+                              set(expected.items()))}
+
+
+def run_waitlist(args):
+    """
+    Loads generated data into MySQL or a SQLite file, then runs the same
+    borrowing simulation with retry polling and with waitlists and
+    compares how many statements each needs per borrow.
+    """
+    if args.backend == 'mysql' and args.database == 'closetly':
+        sys.exit('Refusing to drop the closetly database, pick another ' +
+                 'one with --database.')
+    rng = random.Random(args.seed)
+    results = {'started_at': datetime.datetime.now().isoformat(),
+               'git_commit': git_commit(), 'backend': args.backend,
+               'scale': args.scale, 'items': args.items,
+               'users': args.users, 'ticks': args.ticks,
+               'hold': args.hold, 'want': args.want, 'rounds': []}
+    with tempfile.TemporaryDirectory() as data_dir:
+        print('Loading', args.scale, 'clothes...', file=sys.stderr)
+        layout = generate_data.generate(data_dir, args.scale,
+                                        rng.randrange(2 ** 32))
+        if args.backend == 'mysql':
+            conn = connect(args)
+            create_database(conn, args.database)
+            bulk_load.load(conn, data_dir)
+        else:
+            sqlite = backends.SQLiteBackend(os.path.join(data_dir,
+                                                         'closetly.db'))
+            sqlite.create(data_dir)
+            conn = sqlite.connect()
+        shared = range(3, layout.num_personal + 1, 3)
+        items = rng.sample(shared, min(args.items, len(shared)))
+        users = rng.sample(range(1, layout.num_users + 1),
+                           min(args.users, layout.num_users))
+        print('{:>9} {:>11} {:>8} {:>12} {:>10} {:>9} {:>9}'.format(
+            'method', 'statements', 'borrows', 'stmts/borrow', 'mean wait',
+            'p95 wait', 'seconds'))
+        failed = False
+        for method in ('poll', 'waitlist'):
+            result = waitlist_round(conn, items, users, method, args.ticks,
+                                    args.hold, args.want,
+                                    random.Random(args.seed))
+            results['rounds'].append(result)
+            print('{:>9} {:>11} {:>8} {:>12.1f} {:>10.1f} {:>9} {:>9.2f}'
+                  .format(method, result['statements'], result['borrows'],
+                          result['statements_per_borrow'] or 0,
+                          result['mean_wait_ticks'] or 0,
+                          result['p95_wait_ticks'] or 0,
+                          result['seconds']))
+            if result['mismatches']:
+                failed = True
+        conn.close()
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, default=str)
+    if failed:
+        sys.exit('The table does not match who the simulation lent ' +
+                 'items to.')
+
+
+# ----------------------------------------------------------------------
+# Login throughput
+# ----------------------------------------------------------------------
+# How the app logged users in before the login statement: whether the
+# username exists, the password check, the role, and the user ID
+# (looked up again later when borrowing), one round trip each
+SEPARATE_LOGIN = [
+    """SELECT COUNT(*) FROM (SELECT username FROM user_info
+       WHERE username = %s) AS matches""",
+    'SELECT authenticate(%s, %s)',
+    'SELECT role FROM permissions WHERE username = %s',
+    'SELECT user_id FROM user WHERE username = %s',
+]
+
+
+def login_worker(conn_args, method, layout, tokens, seed, start_at,
+                 stop_at, results):
+    """
+    Runs in its own process: logs random users in with the given method
+    ('separate', 'single', or 'token' to check one of the given session
+    tokens instead of a password) from start_at until stop_at, and puts
+    (logins, failures, latencies) on results.
+    """
+    conn = mysql.connector.connect(**conn_args)
+    cursors = [conn.cursor(prepared=True) for _ in SEPARATE_LOGIN]
+    rng = random.Random(seed)
+    logins = failures = 0
+    latencies = []
+    while time.time() < start_at:
+        time.sleep(0.001)
+    while time.time() < stop_at:
+        username = layout.username(rng.choice(layout.all_users()))
+        password = generate_data.PASSWORD
+        start = time.perf_counter()
+        if method == 'single':
+            _, ok, role, user_id = statements.fetchone(
+                conn, 'login', (password, username, username))
+        elif method == 'token':
+            ok = sessions.check(conn, rng.choice(tokens)) is not None
+        else:
+            params = [(username,), (username, password), (username,),
+                      (username,)]
+            rows = []
+            for cursor, sql, args in zip(cursors, SEPARATE_LOGIN, params):
+                cursor.execute(sql, args)
+                rows.append(cursor.fetchall())
+            ok = rows[0][0][0] and rows[1][0][0]
+        latencies.append(time.perf_counter() - start)
+        logins += 1
+        if not ok:
+            failures += 1
+    conn.close()
+    results.put((logins, failures, latencies))
+
+
+def run_login(args):
+    """
+    Seeds the scratch database, then measures logins/sec with the old
+    one-query-per-step login and the single login statement, and session
+    token checks/sec (see sessions.py), with more and more client
+    processes.
+    """
+    if args.database == 'closetly':
+        sys.exit('Refusing to drop the closetly database, pick another ' +
+                 'one with --database.')
+    conn = connect(args)
+    rng = random.Random(args.seed)
+    print('Seeding', args.scale, 'clothes...', file=sys.stderr)
+    create_database(conn, args.database)
+    layout = seed(conn, args.scale, rng.randrange(2 ** 32))
+    # a session for every user, as if each had logged in once
+    tokens = []
+    for user_id in layout.all_users():
+        username = layout.username(user_id)
+        _, _, role, found_id = statements.fetchone(
+            conn, 'login', (generate_data.PASSWORD, username, username))
+        tokens.append(sessions.start(conn, username, role, found_id))
+    conn.close()
+    conn_args = {'host': args.host, 'port': args.port, 'user': args.user,
+                 'password': args.password, 'database': args.database}
+    results = {'started_at': datetime.datetime.now().isoformat(),
+               'git_commit': git_commit(), 'scale': args.scale,
+               'duration': args.duration, 'rounds': []}
+    print('{:>9} {:>8} {:>10} {:>9} {:>9} {:>9}'.format(
+        'method', 'clients', 'logins/s', 'p50 ms', 'p99 ms', 'failures'))
+    for clients in args.clients:
+        for method in ('separate', 'single', 'token'):
+            queue = multiprocessing.Queue()
+            start_at = time.time() + 1 + clients * 0.05
+            workers = [multiprocessing.Process(
+                target=login_worker,
+                args=(conn_args, method, layout, tokens,
+                      rng.randrange(2 ** 32),
+                      start_at, start_at + args.duration, queue))
+                for _ in range(clients)]
+            for worker in workers:
+                worker.start()
+            logins = failures = 0
+            latencies = []
+            for _ in workers:
+                worker_logins, worker_failures, worker_latencies = queue.get()
+                logins += worker_logins
+                failures += worker_failures
+                latencies.extend(worker_latencies)
+            for worker in workers:
+                worker.join()
+            result = summarize(latencies, None) if latencies else {}
+            result.update({'method': method, 'clients': clients,
+                           'logins': logins, 'failures': failures,
+                           'logins_per_sec': logins / args.duration})
+            results['rounds'].append(result)
+            print('{:>9} {:>8} {:>10.0f} {:>9.2f} {:>9.2f} {:>9}'.format(
+                method, clients, result['logins_per_sec'],
+                result.get('p50_ms', 0), result.get('p99_ms', 0), failures))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, default=str)
+
+
+# ----------------------------------------------------------------------
+# Startup time and memory
+# ----------------------------------------------------------------------
+# Python snippets whose startup is measured: loading the app's modules,
+# and the heaviest third-party imports for reference
+STARTUP_SNIPPETS = {
+    'python': 'pass',
+    'import mysql.connector': 'import mysql.connector',
+    'import pandas': 'import pandas',
+    'import app': 'import app',
+}
+
+
+# Appended to every snippet to print its peak RSS in kilobytes. VmHWM is
+# the high-water mark of the process's own memory since exec; ru_maxrss
+# would also count the benchmark's memory the child started as a copy of.
+PRINT_PEAK_RSS = """
+import resource, sys
+try:
+    with open('/proc/self/status') as status:
+        print([line.split()[1] for line in status
+               if line.startswith('VmHWM')][0])
+except OSError:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss //
+          (1024 if sys.platform == 'darwin' else 1))
+"""
+
+
+def measure_startup(code, runs):
+    """
+    Runs a Python snippet in a fresh interpreter runs times and returns
+    its wall time percentiles and peak RSS.
+    """
+    latencies = []
+    peak_kb = 0
+    for _ in range(runs):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', code + PRINT_PEAK_RSS],
+                                capture_output=True, text=True, check=True)
+        latencies.append(time.perf_counter() - start)
+        peak_kb = max(peak_kb, int(output.stdout.split()[-1]))
+    result = summarize(latencies, None)
+    result['peak_rss_mb'] = peak_kb / 1024
+    return result
+
+
+def run_startup(args):
+    """
+    Measures how long it takes to start the app and how much memory it
+    needs before doing anything. Needs no database.
+    """
+    results = {'started_at': datetime.datetime.now().isoformat(),
+               'git_commit': git_commit(), 'runs': args.runs,
+               'snippets': {}}
+    print('{:<24} {:>9} {:>9} {:>9}'.format('snippet', 'p50 ms', 'p95 ms',
+                                            'peak MB'))
+    for name, code in STARTUP_SNIPPETS.items():
+        result = measure_startup(code, args.runs)
+        results['snippets'][name] = result
+        print('{:<24} {:>9.1f} {:>9.1f} {:>9.1f}'.format(
+            name, result['p50_ms'], result['p95_ms'], result['peak_rss_mb']))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+# ----------------------------------------------------------------------
+# Read replicas
+# ----------------------------------------------------------------------
+def wait_for_replica(primary, replica, timeout=600):
+    """
+    Waits until the replica has applied everything committed on the
+    primary so far. Returns False if it has not after timeout seconds.
+    """
+    cursor = primary.cursor()
+    cursor.execute('SELECT @@GLOBAL.gtid_executed')
+    gtids = cursor.fetchone()[0]
+    cursor = replica.cursor()
+    if gtids:
+        cursor.execute('SELECT WAIT_FOR_EXECUTED_GTID_SET(%s, %s)',
+                       (gtids, timeout))
+        return cursor.fetchone()[0] == 0
+    # without GTIDs, wait for the last table seeded to be there in full
+    count = 'SELECT COUNT(*) FROM styled_outfits'
+    primary_cursor = primary.cursor()
+    primary_cursor.execute(count)
+    expected = primary_cursor.fetchone()[0]
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            cursor.execute(count)
+            if cursor.fetchone()[0] == expected:
+                return True
+        except mysql.connector.Error:
+            pass
+        time.sleep(1)
+    return False
+
+
+def run_replicas(args):
+    """
+    Checks read/write splitting against a primary and a replica of it:
+    seeds the scratch database on the primary, then repeatedly marks an
+    item down and reads it straight back through a routed connection (see
+    pool.RoutingPool), which must always see the new discount. Also
+    reports how often the replica alone had not caught up yet, where the
+    routed reads went, and commit and read latencies. With GTIDs on, the
+    read right after each write should mostly be served by the replica
+    once it has applied that write's GTID: if none are, reads after
+    writes are all landing on the primary.
+    """
+    import pool
+
+    if args.database == 'closetly':
+        sys.exit('Refusing to drop the closetly database, pick another ' +
+                 'one with --database.')
+    conn = connect(args)
+    rng = random.Random(args.seed)
+    print('Seeding', args.scale, 'clothes...', file=sys.stderr)
+    create_database(conn, args.database)
+    layout = seed(conn, args.scale, rng.randrange(2 ** 32))
+    conn_args = {'user': args.user, 'password': args.password,
+                 'database': args.database}
+    replica = mysql.connector.connect(host=args.replica_host,
+                                      port=args.replica_port,
+                                      autocommit=True, **conn_args)
+    print('Waiting for the replica...', file=sys.stderr)
+    if not wait_for_replica(conn, replica):
+        sys.exit('The replica did not catch up with the seeded data.')
+    conn.close()
+
+    backend = backends.MySQLBackend(args.database)
+
+    def connector(host, port, **options):
+        return lambda user, password: backend.connect(
+            user, password, host=host, port=port, **options)
+
+    # the same connections as app.make_pool
+    routing = pool.RoutingPool(
+        pool.ConnectionPool(connector(args.host, args.port,
+                                      track_gtids=True)),
+        [pool.ConnectionPool(connector(args.replica_host, args.replica_port,
+                                       autocommit=True))],
+        replica_wait=args.replica_wait)
+    routed = routing.acquire(args.user, args.password)
+    stale_routed = stale_replica = replica_after_write = 0
+    commits, after_write, plain_reads = [], [], []
+    for i in range(args.iterations):
+        clothing_id = rng.randint(layout.num_personal + 1, layout.scale)
+        store_name = layout.store(clothing_id)
+        discount = rng.randrange(1, 90)
+        read = (store_name, clothing_id - 1, 1)
+        statements.execute(routed, 'markdown_items',
+                           (discount, discount, store_name,
+                            json.dumps([clothing_id])))
+        start = time.perf_counter()
+        routed.commit()
+        commits.append(time.perf_counter() - start)
+        # what a replica-only app would have read
+        row = statements.fetchone(replica, 'show_store_inventory', read)
+        stale_replica += row is None or float(row[2]) != discount
+        replica_reads = routed.replica_reads
+        start = time.perf_counter()
+        row = statements.fetchone(routed, 'show_store_inventory', read)
+        after_write.append(time.perf_counter() - start)
+        replica_after_write += routed.replica_reads - replica_reads
+        stale_routed += row is None or float(row[2]) != discount
+        start = time.perf_counter()
+        statements.fetchone(routed, 'show_store_inventory', read)
+        plain_reads.append(time.perf_counter() - start)
+    results = {'started_at': datetime.datetime.now().isoformat(),
+               'git_commit': git_commit(), 'scale': args.scale,
+               'iterations': args.iterations,
+               'stale_routed_reads': stale_routed,
+               'stale_replica_reads': stale_replica,
+               'replica_reads': routed.replica_reads,
+               'primary_reads': routed.primary_reads,
+               'replica_reads_after_write': replica_after_write,
+               'commit': summarize(commits, None),
+               'read_after_write': summarize(after_write, None),
+               'read': summarize(plain_reads, None)}
+    routing.release(routed)
+    routing.close_all()
+    replica.close()
+    print('{:>12} {:>14} {:>14} {:>14} {:>14} {:>14} {:>12} {:>12}'.format(
+        'iterations', 'stale routed', 'stale replica', 'replica reads',
+        'RYW on replica', 'commit p50 ms', 'RYW p50 ms', 'read p50 ms'))
+    print('{:>12} {:>14} {:>14} {:>14} {:>14} {:>14.2f} {:>12.2f} '
+          '{:>12.2f}'.format(
+              args.iterations, stale_routed, stale_replica,
+              routed.replica_reads, replica_after_write,
+              results['commit']['p50_ms'],
+              results['read_after_write']['p50_ms'],
+              results['read']['p50_ms']))
+    if not replica_after_write:
+        print('No read right after a write went to the replica: check '
+              'that GTIDs are on, or raise --replica-wait.',
+              file=sys.stderr)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if stale_routed:
+        sys.exit('FAILED: a routed read missed the session\'s own write.')
+
+
+# ----------------------------------------------------------------------
+# Wear logging
+# ----------------------------------------------------------------------
+def wear_counts(conn, clothing_ids):
+    """
+    Returns {clothing_id: num_wears} for the given personal items.
+    """
+    cursor = conn.cursor()
+    cursor.execute("""SELECT clothing_id, COALESCE(num_wears, 0)
+                      FROM personal_closet
+                      WHERE clothing_id IN (SELECT id FROM JSON_TABLE(%s,
+                          '$[*]' COLUMNS (id INTEGER PATH '$')) AS ids)""",
+                   (json.dumps(clothing_ids),))
+    counts = dict(cursor.fetchall())
+    conn.commit()
+    return counts
+
+
+def worn_out_left(conn, clothing_ids):
+    """
+    Returns how many of the given items are shared, worn more than 50
+    times, and still not marked as used.
+    """
+    cursor = conn.cursor()
+    cursor.execute("""SELECT COUNT(*)
+                      FROM collab_closet AS c
+                      JOIN personal_closet AS p
+                        ON p.user_id = c.user_id
+                       AND p.clothing_id = c.clothing_id
+                      WHERE p.num_wears > 50
+                        AND (c.curr_condition = 'new' OR
+                             c.curr_condition IS NULL)
+                        AND c.clothing_id IN (SELECT id FROM JSON_TABLE(%s,
+                            '$[*]' COLUMNS (id INTEGER PATH '$')) AS ids)""",
+                   (json.dumps(clothing_ids),))
+    count = cursor.fetchone()[0]
+    conn.commit()
+    return count
+
+
+def wear_round(conn, layout, items, method, duration, batch, rng):
+    """
+    Logs wears of random items for duration seconds with the given method:
+    'direct' updates and commits once per wear, 'buffered' and 'journal'
+    go through a wears.WearBuffer of batch wears (the latter also
+    appending to a journal file). Checks that every wear was counted
+    exactly once and returns the round's results.
+    """
+    before = wear_counts(conn, items)
+    cursor = conn.cursor(prepared=True)
+    expected = {}
+    events = 0
+    with tempfile.TemporaryDirectory() as journal_dir:
+        buffer = wears.WearBuffer(
+            max_events=batch, max_seconds=duration,
+            journal=os.path.join(journal_dir, 'wears.log')
+            if method == 'journal' else None)
+        start = time.perf_counter()
+        stop_at = start + duration
+        while time.perf_counter() < stop_at:
+            clothing_id = rng.choice(items)
+            user_id = layout.owner(clothing_id)
+            if method == 'direct':
+                cursor.execute("""UPDATE personal_closet
+                                  SET num_wears = COALESCE(num_wears, 0) + 1
+                                  WHERE user_id = %s AND clothing_id = %s""",
+                               (user_id, clothing_id))
+                conn.commit()
+            elif buffer.record(user_id, clothing_id):
+                wears.flush(conn, buffer)
+            expected[clothing_id] = expected.get(clothing_id, 0) + 1
+            events += 1
+        wears.flush(conn, buffer)
+        seconds = time.perf_counter() - start
+        buffer.close()
+    after = wear_counts(conn, items)
+    miscounted = sum(1 for clothing_id in items
+                     if after[clothing_id] - before[clothing_id] !=
+                     expected.get(clothing_id, 0))
+    touched = sorted(expected)
+    return {'method': method, 'events': events, 'seconds': seconds,
+            'events_per_sec': events / seconds,
+            'flushes': buffer.flushes, 'miscounted': miscounted,
+            # the direct method does not apply the 50 wear rule
+            'not_marked_used': worn_out_left(conn, touched)
+                               if method != 'direct' else None}
+
+
+def run_wears(args):
+    """
+    Seeds the scratch database, then compares how many wears/sec can be
+    logged with an UPDATE per wear and with wears.py's buffered, batched
+    UPDATEs, and checks that every wear is counted.
+    """
+    if args.database == 'closetly':
+        sys.exit('Refusing to drop the closetly database, pick another ' +
+                 'one with --database.')
+    conn = connect(args)
+    rng = random.Random(args.seed)
+    print('Seeding', args.scale, 'clothes...', file=sys.stderr)
+    create_database(conn, args.database)
+    layout = seed(conn, args.scale, rng.randrange(2 ** 32))
+    items = rng.sample(range(1, layout.num_personal + 1),
+                       min(args.items, layout.num_personal))
+    results = {'started_at': datetime.datetime.now().isoformat(),
+               'git_commit': git_commit(), 'scale': args.scale,
+               'items': len(items), 'duration': args.duration,
+               'batch': args.batch, 'rounds': []}
+    print('{:>9} {:>10} {:>10} {:>8} {:>11} {:>9}'.format(
+        'method', 'events', 'events/s', 'flushes', 'miscounted', 'not used'))
+    failed = False
+    for method in ('direct', 'buffered', 'journal'):
+        result = wear_round(conn, layout, items, method, args.duration,
+                            args.batch, rng)
+        results['rounds'].append(result)
+        print('{:>9} {:>10} {:>10.0f} {:>8} {:>11} {:>9}'.format(
+            method, result['events'], result['events_per_sec'],
+            result['flushes'], result['miscounted'],
+            '-' if result['not_marked_used'] is None
+            else result['not_marked_used']))
+        if result['miscounted'] or result['not_marked_used']:
+            failed = True
+    conn.close()
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, default=str)
+    if failed:
+        sys.exit('Some wears were not counted exactly once, or worn out ' +
+                 'items were not marked as used.')
+
+
+# ----------------------------------------------------------------------
+# Analytics export
+# ----------------------------------------------------------------------
+def exported_prices(directory, clothing_ids):
+    """
+    Returns {(store_name, clothing_id): (price, discount)} of the given
+    items as the export files have them.
+    """
+    import warehouse
+    data = warehouse.read_table(directory, 'store_closet').to_pylist()
+    return {(row['store_name'], row['clothing_id']):
+            (row['price'], row['discount'])
+            for row in data if row['clothing_id'] in clothing_ids}
+
+
+def store_prices(conn, clothing_ids):
+    """
+    Returns {(store_name, clothing_id): (price, discount)} of the given
+    items in store_closet.
+    """
+    cursor = conn.cursor()
+    cursor.execute("""SELECT store_name, clothing_id, price, discount
+                      FROM store_closet
+                      WHERE clothing_id IN (SELECT id FROM JSON_TABLE(%s,
+                          '$[*]' COLUMNS (id INTEGER PATH '$')) AS ids)""",
+                   (json.dumps(sorted(clothing_ids)),))
+    prices = {(store_name, clothing_id): (price, discount)
+              for store_name, clothing_id, price, discount
+              in cursor.fetchall()}
+    conn.commit()
+    return prices
+
+
+def run_warehouse(args):
+    """
+    Seeds the scratch database and exports it in full with warehouse.py,
+    then reprices and deletes random store items and runs incremental
+    exports. Checks that the first one writes exactly the changed rows,
+    that the files then agree with the table, and that the next one finds
+    nothing left to export.
+    """
+    # imported here because it registers its statements, which the
+    # queries command does not time
+    import warehouse
+    if args.database == 'closetly':
+        sys.exit('Refusing to drop the closetly database, pick another ' +
+                 'one with --database.')
+    # changes are exported as soon as they are committed
+    warehouse.SAFETY_LAG = 0
+    conn = connect(args)
+    rng = random.Random(args.seed)
+    print('Seeding', args.scale, 'clothes...', file=sys.stderr)
+    create_database(conn, args.database)
+    layout = seed(conn, args.scale, rng.randrange(2 ** 32))
+    store_items = range(layout.num_personal + 1, layout.scale + 1)
+    changed = rng.sample(store_items, min(args.changes, len(store_items)))
+    deleted = changed[:len(changed) // 10]
+    results = {'started_at': datetime.datetime.now().isoformat(),
+               'git_commit': git_commit(), 'scale': args.scale,
+               'changes': len(changed), 'format': args.format}
+    problems = []
+    with tempfile.TemporaryDirectory() as out:
+        start = time.perf_counter()
+        warehouse.export(conn, out, file_format=args.format)
+        results['full_seconds'] = time.perf_counter() - start
+        before = warehouse.load_state(out)['tables']['store_closet']
+
+        cursor = conn.cursor()
+        ids = json.dumps(changed)
+        cursor.execute("""UPDATE store_closet
+                          SET discount = 50,
+                              price = ROUND(original_price / 2, 2)
+                          WHERE clothing_id IN (SELECT id FROM JSON_TABLE(
+                              %s, '$[*]' COLUMNS (id INTEGER PATH '$'))
+                              AS ids)""", (ids,))
+        cursor.execute("""DELETE FROM store_closet
+                          WHERE clothing_id IN (SELECT id FROM JSON_TABLE(
+                              %s, '$[*]' COLUMNS (id INTEGER PATH '$'))
+                              AS ids)""", (json.dumps(deleted),))
+        conn.commit()
+
+        start = time.perf_counter()
+        written = warehouse.export(conn, out, tables=['store_closet'],
+                                   file_format=args.format)['store_closet']
+        results['incremental_seconds'] = time.perf_counter() - start
+        results['incremental_rows'] = written
+        after = warehouse.load_state(out)['tables']['store_closet']
+        if written != len(changed):
+            problems.append('the incremental export wrote {} rows for {} '
+                            'changes'.format(written, len(changed)))
+        if after['watermark'][0] <= before['watermark'][0]:
+            problems.append('the watermark did not move forward')
+        if exported_prices(out, set(changed)) != \
+                store_prices(conn, set(changed)):
+            problems.append('the exported rows do not match the table')
+        again = warehouse.export(conn, out, tables=['store_closet'],
+                                 file_format=args.format)['store_closet']
+        if again:
+            problems.append('the next export wrote {} rows again'.format(
+                again))
+    conn.close()
+    print('{:<24} {:>10.2f}'.format('full export (s)',
+                                    results['full_seconds']))
+    print('{:<24} {:>10.2f}'.format('incremental export (s)',
+                                    results['incremental_seconds']))
+    print('{:<24} {:>10}'.format('changed rows written',
+                                 results['incremental_rows']))
+    results['problems'] = problems
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, default=str)
+    if problems:
+        sys.exit('\n'.join(problems))
+
+
+# ----------------------------------------------------------------------
+# Storage backends
+# ----------------------------------------------------------------------
+def time_backend(conn, samples):
+    """
+    Times every statement in samples ({name: [params, ...]}) on one
+    backend's connection the way the app runs it, rolling back after every
+    run. Returns {name: summary}.
+    """
+    results = {}
+    for name, params_list in samples.items():
+        print('  timing', name, file=sys.stderr)
+        latencies = []
+        rows = 0
+        try:
+            for params in params_list:
+                start = time.perf_counter()
+                rows += len(statements.fetchall(conn, name, params))
+                latencies.append(time.perf_counter() - start)
+                conn.rollback()
+        except mysql.connector.Error as err:
+            conn.rollback()
+            results[name] = {'error': str(err)}
+            continue
+        results[name] = summarize(latencies, rows)
+    return results
+
+
+def run_backends(args):
+    """
+    Loads the same generated data into MySQL and into a SQLite file (see
+    backends.py), then times every statement the app runs on each with the
+    same parameters, and prints their latencies side by side.
+    """
+    if 'mysql' in args.backends and args.database == 'closetly':
+        sys.exit('Refusing to drop the closetly database, pick another ' +
+                 'one with --database.')
+    rng = random.Random(args.seed)
+    results = {'started_at': datetime.datetime.now().isoformat(),
+               'git_commit': git_commit(), 'scale': args.scale,
+               'iterations': args.iterations, 'backends': {}}
+    with tempfile.TemporaryDirectory() as data_dir:
+        print('Generating', args.scale, 'clothes...', file=sys.stderr)
+        layout = generate_data.generate(data_dir, args.scale,
+                                        rng.randrange(2 ** 32))
+        samplers = make_samplers(layout, rng)
+        samples = {name: [samplers[name]() for _ in range(args.iterations)]
+                   for name in REGISTRY}
+        for backend in args.backends:
+            print('Loading into', backend + '...', file=sys.stderr)
+            start = time.perf_counter()
+            if backend == 'mysql':
+                conn = connect(args)
+                create_database(conn, args.database)
+                bulk_load.load(conn, data_dir)
+            else:
+                sqlite = backends.SQLiteBackend(os.path.join(data_dir,
+                                                             'closetly.db'))
+                sqlite.create(data_dir)
+                conn = sqlite.connect()
+            load_seconds = time.perf_counter() - start
+            results['backends'][backend] = {
+                'load_seconds': load_seconds,
+                'queries': time_backend(conn, samples)}
+            conn.close()
+    print('{:<28}'.format('statement (p50/p95 ms)') +
+          ''.join(' {:>17}'.format(backend) for backend in args.backends))
+    for name in REGISTRY:
+        cells = []
+        for backend in args.backends:
+            result = results['backends'][backend]['queries'][name]
+            cells.append('error' if 'error' in result else
+                         '{:.3f}/{:.3f}'.format(result['p50_ms'],
+                                                result['p95_ms']))
+        print('{:<28}'.format(name) +
+              ''.join(' {:>17}'.format(cell) for cell in cells))
+    print('{:<28}'.format('load (s)') +
+          ''.join(' {:>17.1f}'.format(results['backends'][backend]
+                                      ['load_seconds'])
+                  for backend in args.backends))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, default=str)
+
+
+# ----------------------------------------------------------------------
+# Outfit suggestions
+# ----------------------------------------------------------------------
+def synthetic_clothes(layout, rng, first=1):
+    """
+    Yields the rows recommend.Model.add_clothes takes for the clothes
+    generate_data.py would write, from clothing ID first on, without a
+    database.
+    """
+    rows = generate_data.clothes_rows(layout, rng)
+    next(rows)
+    for row in rows:
+        clothing_id = row[0]
+        if clothing_id < first:
+            continue
+        personal = clothing_id <= layout.num_personal
+        yield (clothing_id, row[1], row[4], row[8], row[5], row[3],
+               layout.owner(clothing_id) if personal else None,
+               personal and layout.is_shared(clothing_id) and
+               rng.random() < 0.7,
+               not personal)
+
+
+def synthetic_outfits(layout, rng, first=1):
+    """
+    Yields (outfit_id, clothing_id) for the outfits generate_data.py would
+    write, from outfit ID first on.
+    """
+    rows = generate_data.styled_outfit_rows(layout, rng)
+    next(rows)
+    for outfit_id, clothing_id, _, _ in rows:
+        if outfit_id >= first:
+            yield outfit_id, clothing_id
+
+
+def run_recommend(args):
+    """
+    Times outfit suggestions on synthetic catalogs of several sizes:
+    building the model, suggesting items for random partial outfits, and
+    refreshing the model with newly added clothes and outfits. Needs no
+    database; the queries the model is loaded with are timed by the
+    queries command.
+    """
+    import numpy as np
+    import recommend
+
+    results = {'started_at': datetime.datetime.now().isoformat(),
+               'git_commit': git_commit(), 'k': args.k, 'runs': []}
+    print('{:>9} {:>9} {:>9} {:>9} {:>9} {:>9} {:>11}'.format(
+        'clothes', 'build s', 'p50 ms', 'p95 ms', 'p99 ms', 'empty ms',
+        'refresh ms'))
+    for scale in args.scales:
+        rng = random.Random(args.seed)
+        # generate the data set as it will be after the refresh, and load
+        # all but the last args.new clothes and outfits up front
+        layout = generate_data.Layout(scale + args.new)
+        before = generate_data.Layout(scale)
+        clothes = list(synthetic_clothes(layout, rng))
+        outfits = list(synthetic_outfits(layout, rng))
+        model = recommend.Model()
+        start = time.perf_counter()
+        model.add_clothes(clothes[:scale])
+        model.add_outfits(row for row in outfits
+                          if row[0] <= before.num_outfits)
+        model.index()
+        build = time.perf_counter() - start
+
+        def time_suggestions(sizes):
+            latencies = []
+            for _ in range(args.iterations):
+                picked = rng.sample(range(1, scale + 1), rng.choice(sizes))
+                user_id = rng.randint(1, layout.num_users)
+                start = time.perf_counter()
+                rows = model.suggest(picked, user_id, args.k)
+                latencies.append(time.perf_counter() - start)
+                assert not set(row[0] for row in rows) & set(picked)
+            return summarize(latencies, args.k)
+
+        suggest = time_suggestions([1, 2, 3])
+        empty = time_suggestions([0])
+        start = time.perf_counter()
+        model.add_clothes(clothes[scale:])
+        model.add_outfits(row for row in outfits
+                          if row[0] > before.num_outfits)
+        model.index()
+        refresh = time.perf_counter() - start
+        memory = sum(value.nbytes for value in vars(model).values()
+                     if isinstance(value, np.ndarray))
+        results['runs'].append({
+            'scale': scale, 'build_s': build, 'model_mb': memory / 2 ** 20,
+            'styles': len(model.style_codes), 'suggest': suggest,
+            'suggest_empty_outfit': empty, 'new_clothes': args.new,
+            'refresh_ms': 1000 * refresh})
+        print('{:>9} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f} '
+              '{:>11.1f}'.format(scale, build, suggest['p50_ms'],
+                                 suggest['p95_ms'], suggest['p99_ms'],
+                                 empty['p50_ms'], 1000 * refresh))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+def compare(args):
+    """
+    Prints the change in p50 and p95 latency of every query between two
+    result files, for every scale the two have in common.
+    """
+    with open(args.before) as f:
+        before = {run['scale']: run['queries'] for run in json.load(f)['runs']}
+    with open(args.after) as f:
+        after = {run['scale']: run['queries'] for run in json.load(f)['runs']}
+    for scale in sorted(set(before) & set(after)):
+        print('scale', scale)
+        print('  {:<32} {:>10} {:>10} {:>8} {:>10} {:>10} {:>8}'.format(
+            'query', 'p50 before', 'p50 after', 'change',
+            'p95 before', 'p95 after', 'change'))
+        for name in before[scale]:
+            old = before[scale][name]
+            new = after[scale].get(name, {})
+            if 'p50_ms' not in old or 'p50_ms' not in new:
+                continue
+            print('  {:<32} {:>10.3f} {:>10.3f} {:>7.0%} {:>10.3f} {:>10.3f} '
+                  '{:>7.0%}'.format(
+                      name, old['p50_ms'], new['p50_ms'],
+                      new['p50_ms'] / old['p50_ms'] - 1 if old['p50_ms'] else 0,
+                      old['p95_ms'], new['p95_ms'],
+                      new['p95_ms'] / old['p95_ms'] - 1 if old['p95_ms'] else 0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Closetly benchmarks')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    queries = commands.add_parser('queries', help='time every app query ' +
+                                  'against seeded data at several scales')
+    queries.add_argument('--host', default='localhost')
+    queries.add_argument('--port', type=int, default=3306)
+    queries.add_argument('--user', default='root')
+    queries.add_argument('--password', default='')
+    queries.add_argument('--database', default='closetly_bench',
+                         help='scratch database, dropped and recreated')
+    queries.add_argument('--scales', type=int, nargs='+',
+                         default=[10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7],
+                         help='numbers of clothes to seed')
+    queries.add_argument('--iterations', type=int, default=50)
+    queries.add_argument('--seed', type=int, default=121)
+    queries.add_argument('--output', help='JSON file to write results to')
+    queries.set_defaults(func=run_queries)
+
+    borrow = commands.add_parser('borrow', help='borrow the same items ' +
+                                 'from many processes at once and check ' +
+                                 'that none is borrowed twice')
+    borrow.add_argument('--host', default='localhost')
+    borrow.add_argument('--port', type=int, default=3306)
+    borrow.add_argument('--user', default='root')
+    borrow.add_argument('--password', default='')
+    borrow.add_argument('--database', default='closetly_bench',
+                        help='scratch database, dropped and recreated')
+    borrow.add_argument('--scale', type=int, default=10 ** 5,
+                        help='number of clothes to seed')
+    borrow.add_argument('--items', type=int, default=1000,
+                        help='number of items everyone competes for; ' +
+                             'fewer means more contention')
+    borrow.add_argument('--clients', type=int, nargs='+',
+                        default=[1, 2, 4, 8, 16, 32],
+                        help='client process counts to run rounds with')
+    borrow.add_argument('--duration', type=float, default=10,
+                        help='seconds per round')
+    borrow.add_argument('--seed', type=int, default=121)
+    borrow.add_argument('--output', help='JSON file to write results to')
+    borrow.set_defaults(func=run_borrow)
+
+    waitlist = commands.add_parser('waitlist', help='compare statements ' +
+                                   'per borrow of retry polling and ' +
+                                   'waitlists in a simulation')
+    waitlist.add_argument('--backend', default='mysql',
+                          choices=['mysql', 'sqlite'])
+    waitlist.add_argument('--host', default='localhost')
+    waitlist.add_argument('--port', type=int, default=3306)
+    waitlist.add_argument('--user', default='root')
+    waitlist.add_argument('--password', default='')
+    waitlist.add_argument('--database', default='closetly_bench',
+                          help='scratch MySQL database, dropped and ' +
+                               'recreated')
+    waitlist.add_argument('--scale', type=int, default=10 ** 4,
+                          help='number of clothes to seed')
+    waitlist.add_argument('--items', type=int, default=10,
+                          help='number of popular items everyone wants')
+    waitlist.add_argument('--users', type=int, default=100,
+                          help='number of users borrowing them')
+    waitlist.add_argument('--ticks', type=int, default=500)
+    waitlist.add_argument('--hold', type=int, default=20,
+                          help='ticks each borrower keeps an item')
+    waitlist.add_argument('--want', type=float, default=0.05,
+                          help='chance per tick that a user who wants ' +
+                               'nothing starts wanting an item')
+    waitlist.add_argument('--seed', type=int, default=121)
+    waitlist.add_argument('--output', help='JSON file to write results to')
+    waitlist.set_defaults(func=run_waitlist)
+
+    login = commands.add_parser('login', help='compare logins/sec of the ' +
+                                'single login statement with one query ' +
+                                'per step and with session tokens')
+    login.add_argument('--host', default='localhost')
+    login.add_argument('--port', type=int, default=3306)
+    login.add_argument('--user', default='root')
+    login.add_argument('--password', default='')
+    login.add_argument('--database', default='closetly_bench',
+                       help='scratch database, dropped and recreated')
+    login.add_argument('--scale', type=int, default=10 ** 5,
+                       help='number of clothes to seed')
+    login.add_argument('--clients', type=int, nargs='+', default=[1, 4, 16],
+                       help='client process counts to run rounds with')
+    login.add_argument('--duration', type=float, default=10,
+                       help='seconds per round')
+    login.add_argument('--seed', type=int, default=121)
+    login.add_argument('--output', help='JSON file to write results to')
+    login.set_defaults(func=run_login)
+
+    replicas = commands.add_parser('replicas', help='check that reads ' +
+                                   'routed to a replica see the ' +
+                                   'session\'s own writes')
+    replicas.add_argument('--host', default='localhost',
+                          help='primary host')
+    replicas.add_argument('--port', type=int, default=3306,
+                          help='primary port')
+    replicas.add_argument('--replica-host', default='localhost')
+    replicas.add_argument('--replica-port', type=int, default=3307)
+    replicas.add_argument('--user', default='root')
+    replicas.add_argument('--password', default='')
+    replicas.add_argument('--database', default='closetly_bench',
+                          help='scratch database, dropped and recreated ' +
+                               'on the primary')
+    replicas.add_argument('--scale', type=int, default=10 ** 4,
+                          help='number of clothes to seed')
+    replicas.add_argument('--iterations', type=int, default=500)
+    replicas.add_argument('--replica-wait', type=float, default=0.05,
+                          help='seconds a read waits for the replica ' +
+                               'before going to the primary')
+    replicas.add_argument('--seed', type=int, default=121)
+    replicas.add_argument('--output', help='JSON file to write results to')
+    replicas.set_defaults(func=run_replicas)
+
+    startup = commands.add_parser('startup', help='measure how long the ' +
+                                  'app takes to start and its memory use')
+    startup.add_argument('--runs', type=int, default=20)
+    startup.add_argument('--output', help='JSON file to write results to')
+    startup.set_defaults(func=run_startup)
+
+    suggest = commands.add_parser('recommend', help='time outfit ' +
+                                  'suggestions on synthetic catalogs')
+    suggest.add_argument('--scales', type=int, nargs='+',
+                         default=[10 ** 4, 10 ** 5, 10 ** 6],
+                         help='numbers of clothes in the catalog')
+    suggest.add_argument('--new', type=int, default=1000,
+                         help='clothes added before the refresh')
+    suggest.add_argument('--k', type=int, default=10,
+                         help='items suggested each time')
+    suggest.add_argument('--iterations', type=int, default=200)
+    suggest.add_argument('--seed', type=int, default=121)
+    suggest.add_argument('--output', help='JSON file to write results to')
+    suggest.set_defaults(func=run_recommend)
+
+    wear = commands.add_parser('wears', help='compare wears/sec logged ' +
+                               'one at a time and in buffered batches')
+    wear.add_argument('--host', default='localhost')
+    wear.add_argument('--port', type=int, default=3306)
+    wear.add_argument('--user', default='root')
+    wear.add_argument('--password', default='')
+    wear.add_argument('--database', default='closetly_bench',
+                      help='scratch database, dropped and recreated')
+    wear.add_argument('--scale', type=int, default=10 ** 5,
+                      help='number of clothes to seed')
+    wear.add_argument('--items', type=int, default=1000,
+                      help='number of items worn; fewer means more wears ' +
+                           'of the same item per batch')
+    wear.add_argument('--batch', type=int, default=1000,
+                      help='wears buffered before each flush')
+    wear.add_argument('--duration', type=float, default=10,
+                      help='seconds per method')
+    wear.add_argument('--seed', type=int, default=121)
+    wear.add_argument('--output', help='JSON file to write results to')
+    wear.set_defaults(func=run_wears)
+
+    export = commands.add_parser('warehouse', help='check and time full ' +
+                                 'and incremental analytics exports')
+    export.add_argument('--host', default='localhost')
+    export.add_argument('--port', type=int, default=3306)
+    export.add_argument('--user', default='root')
+    export.add_argument('--password', default='')
+    export.add_argument('--database', default='closetly_bench',
+                        help='scratch database, dropped and recreated')
+    export.add_argument('--scale', type=int, default=10 ** 5,
+                        help='number of clothes to seed')
+    export.add_argument('--changes', type=int, default=1000,
+                        help='store items changed between exports')
+    export.add_argument('--format', choices=['parquet', 'arrow'],
+                        default='parquet')
+    export.add_argument('--seed', type=int, default=121)
+    export.add_argument('--output', help='JSON file to write results to')
+    export.set_defaults(func=run_warehouse)
+
+    storage = commands.add_parser('backends', help='compare statement ' +
+                                  'latencies on MySQL and on the embedded ' +
+                                  'SQLite backend')
+    storage.add_argument('--backends', nargs='+', default=['mysql', 'sqlite'],
+                         choices=['mysql', 'sqlite'])
+    storage.add_argument('--host', default='localhost')
+    storage.add_argument('--port', type=int, default=3306)
+    storage.add_argument('--user', default='root')
+    storage.add_argument('--password', default='')
+    storage.add_argument('--database', default='closetly_bench',
+                         help='scratch MySQL database, dropped and recreated')
+    storage.add_argument('--scale', type=int, default=10 ** 5,
+                         help='number of clothes to seed')
+    storage.add_argument('--iterations', type=int, default=50)
+    storage.add_argument('--seed', type=int, default=121)
+    storage.add_argument('--output', help='JSON file to write results to')
+    storage.set_defaults(func=run_backends)
+
+    comparison = commands.add_parser('compare', help='compare two results ' +
+                                     'files')
+    comparison.add_argument('before')
+    comparison.add_argument('after')
+    comparison.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+"""
+Bulk loader for Closetly CSV files, either the ones in this repository or
+ones written by generate_data.py. Tables are loaded in dependency order
+with chunked LOAD DATA LOCAL INFILE, with foreign key and unique checks
+turned off and secondary indexes dropped while loading and rebuilt
+afterwards. Rows/sec is reported for every table. If the summary tables
+from setup-rollups.sql exist, they are rebuilt once at the end instead
+of by their triggers row by row, and if the export change log from
+setup-export.sql exists, the loaded tables are marked to be exported in
+full rather than logged row by row.
+
+    $ python3 bulk_load.py data/ --user root --password rootpw
+
+The server must allow LOAD DATA LOCAL (SET GLOBAL local_infile = 1).
+Fields must not contain line breaks, since files are split into chunks
+on line boundaries.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import mysql.connector
+import mysql.connector.errorcode as errorcode
+
+# Lines per LOAD DATA statement
+CHUNK_LINES = 500000
+
+# (file, table, column list and SET clause) in the order tables must be
+# loaded. Files that do not exist are skipped. The column lists match
+# load-data.sql.
+TABLES = [
+    ('user.csv', 'user', ''),
+    ('user_info.csv', 'user_info', ''),
+    ('permissions.csv', 'permissions', ''),
+    ('clothes.csv', 'clothes', ''),
+    ('personal_closet.csv', 'personal_closet',
+     '(user_id, clothing_id, is_clean, shared, num_wears) ' +
+     'SET num_wears = NULLIF(num_wears, -1)'),
+    ('store_closet.csv', 'store_closet',
+     '(store_name, clothing_id, price, discount) ' +
+     'SET original_price = IF(discount < 100, ' +
+     'ROUND(price * 100 / (100 - discount), 2), price)'),
+    ('collab_closet.csv', 'collab_closet',
+     '(user_id, clothing_id, curr_condition, is_available, ' +
+     'current_borrower) ' +
+     'SET current_borrower = NULLIF(current_borrower, -1)'),
+    ('styled_outfits.csv', 'styled_outfits', ''),
+]
+
+LOAD_SQL = """LOAD DATA LOCAL INFILE %s INTO TABLE `{table}`
+    FIELDS TERMINATED BY ',' ENCLOSED BY '"' LINES TERMINATED BY '\\r\\n'
+    {columns}"""
+
+
+def split_file(path, chunk_dir):
+    """
+    Splits a CSV file into files of at most CHUNK_LINES lines each,
+    leaving out the header line, and returns their paths.
+    """
+    chunks = []
+    out = None
+    with open(path, 'rb') as f:
+        f.readline()
+        for i, line in enumerate(f):
+            if i % CHUNK_LINES == 0:
+                if out:
+                    out.close()
+                chunks.append(os.path.join(chunk_dir, str(len(chunks)) +
+                                           '-' + os.path.basename(path)))
+                out = open(chunks[-1], 'wb')
+            out.write(line)
+    if out:
+        out.close()
+    return chunks
+
+
+def secondary_indexes(conn, table):
+    """
+    Returns (name, definition) for every secondary index on a table, where
+    definition can be used in ALTER TABLE ... ADD to recreate it.
+    """
+    cursor = conn.cursor()
+    cursor.execute("""SELECT index_name, non_unique, index_type,
+                      column_name, sub_part
+                      FROM information_schema.statistics
+                      WHERE table_schema = DATABASE() AND table_name = %s
+                        AND index_name <> 'PRIMARY'
+                      ORDER BY index_name, seq_in_index""", (table,))
+    columns = {}
+    kinds = {}
+    for name, non_unique, index_type, column, sub_part in cursor.fetchall():
+        part = '`' + column + '`'
+        if sub_part:
+            part += '(' + str(sub_part) + ')'
+        columns.setdefault(name, []).append(part)
+        if index_type == 'FULLTEXT':
+            kinds[name] = 'FULLTEXT INDEX'
+        elif not non_unique:
+            kinds[name] = 'UNIQUE INDEX'
+        else:
+            kinds[name] = 'INDEX'
+    return [(name, kinds[name] + ' `' + name + '` (' +
+             ', '.join(columns[name]) + ')') for name in columns]
+
+
+def drop_indexes(conn, table):
+    """
+    Drops the secondary indexes of a table so that rows can be loaded
+    without updating them row by row, and returns the definitions needed
+    to add them back. Indexes that back a foreign key cannot be dropped
+    and are left alone.
+    """
+    cursor = conn.cursor()
+    cursor.execute('SELECT engine FROM information_schema.tables ' +
+                   'WHERE table_schema = DATABASE() AND table_name = %s',
+                   (table,))
+    if cursor.fetchone()[0] == 'MyISAM':
+        # MyISAM can rebuild its own non-unique indexes after a load
+        cursor.execute('ALTER TABLE `' + table + '` DISABLE KEYS')
+        return ['ENABLE KEYS']
+    dropped = []
+    for name, definition in secondary_indexes(conn, table):
+        try:
+            cursor.execute('ALTER TABLE `' + table + '` DROP INDEX `' +
+                           name + '`')
+            dropped.append('ADD ' + definition)
+        except mysql.connector.Error as err:
+            if err.errno != errorcode.ER_DROP_INDEX_FK:
+                raise
+    return dropped
+
+
+def restore_indexes(conn, table, dropped):
+    """
+    Adds back the indexes removed by drop_indexes, building them all in a
+    single pass over the table. InnoDB can only build one FULLTEXT index
+    per statement, so those are added one at a time afterwards.
+    """
+    fulltext = [d for d in dropped if d.startswith('ADD FULLTEXT')]
+    others = [d for d in dropped if d not in fulltext]
+    cursor = conn.cursor()
+    if others:
+        cursor.execute('ALTER TABLE `' + table + '` ' + ', '.join(others))
+    for definition in fulltext:
+        cursor.execute('ALTER TABLE `' + table + '` ' + definition)
+
+
+def load_table(conn, path, table, columns):
+    """
+    Loads one CSV file into a table in chunks, committing after every
+    chunk, and returns the number of rows loaded.
+    """
+    cursor = conn.cursor()
+    sql = LOAD_SQL.format(table=table, columns=columns)
+    rows = 0
+    with tempfile.TemporaryDirectory() as chunk_dir:
+        for chunk in split_file(path, chunk_dir):
+            cursor.execute(sql, (chunk,))
+            rows += cursor.rowcount
+            conn.commit()
+    return rows
+
+
+def load(conn, data_dir, truncate=False, report=sys.stderr):
+    """
+    Loads every CSV file found in data_dir into its table, in dependency
+    order. Returns {table: (rows, seconds)}.
+    """
+    cursor = conn.cursor()
+    # the summary table triggers (setup-rollups.sql) are skipped while
+    # loading, and the summary tables rebuilt once at the end. So is the
+    # export change log (setup-export.sql); loaded tables are marked for a
+    # full export instead.
+    cursor.execute('SET foreign_key_checks = 0, unique_checks = 0, ' +
+                   '@skip_rollups = 1, @skip_change_log = 1')
+    results = {}
+    try:
+        for name, table, columns in TABLES:
+            path = os.path.join(data_dir, name)
+            if not os.path.exists(path):
+                continue
+            start = time.perf_counter()
+            if truncate:
+                cursor.execute('TRUNCATE TABLE `' + table + '`')
+            dropped = drop_indexes(conn, table)
+            rows = load_table(conn, path, table, columns)
+            restore_indexes(conn, table, dropped)
+            seconds = time.perf_counter() - start
+            results[table] = (rows, seconds)
+            print('{:<16} {:>10} rows {:>8.1f} s {:>10.0f} rows/s'.format(
+                table, rows, seconds, rows / seconds if seconds else 0),
+                file=report)
+        for table in results:
+            cursor.execute('ANALYZE TABLE `' + table + '`')
+            cursor.fetchall()
+        cursor.execute("""SELECT COUNT(*) FROM information_schema.routines
+                          WHERE routine_schema = DATABASE()
+                            AND routine_name = 'refresh_rollups'""")
+        if cursor.fetchone()[0]:
+            cursor.execute('CALL refresh_rollups()')
+            conn.commit()
+        cursor.execute("""SELECT COUNT(*) FROM information_schema.routines
+                          WHERE routine_schema = DATABASE()
+                            AND routine_name = 'log_reload'""")
+        if cursor.fetchone()[0]:
+            for table in results:
+                cursor.execute('CALL log_reload(%s)', (table,))
+            conn.commit()
+    finally:
+        cursor.execute('SET foreign_key_checks = 1, unique_checks = 1, ' +
+                       '@skip_rollups = NULL, @skip_change_log = NULL')
+    total_rows = sum(rows for rows, _ in results.values())
+    total_seconds = sum(seconds for _, seconds in results.values())
+    print('{:<16} {:>10} rows {:>8.1f} s {:>10.0f} rows/s'.format(
+        'total', total_rows, total_seconds,
+        total_rows / total_seconds if total_seconds else 0), file=report)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bulk load Closetly CSV ' +
+                                     'files into MySQL')
+    parser.add_argument('data_dir', nargs='?', default='.',
+                        help='directory with the CSV files ' +
+                             '(default: current directory)')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=3306)
+    parser.add_argument('--user', default='root')
+    parser.add_argument('--password', default='')
+    parser.add_argument('--database', default='closetly')
+    parser.add_argument('--truncate', action='store_true',
+                        help='empty each table before loading it')
+    args = parser.parse_args()
+    conn = mysql.connector.connect(host=args.host, port=args.port,
+                                   user=args.user, password=args.password,
+                                   database=args.database,
+                                   allow_local_infile=True)
+    load(conn, args.data_dir, truncate=args.truncate)
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Read-through cache for store inventory queries. Shoppers browse store
+inventories far more often than store owners change them, so results are
+kept in memory per store and dropped whenever that store's inventory is
+written to.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class InventoryCache:
+    """
+    LRU cache with a time-to-live, where every entry belongs to a store.
+
+    Entries are keyed by (store_name, key), where key identifies the query
+    and its parameters. At most max_entries are kept, evicting the least
+    recently used entry first, and entries older than ttl seconds are never
+    returned. The TTL bounds how stale a result can get when the inventory
+    is changed by another process, which cannot invalidate this cache.
+    """
+    def __init__(self, max_entries=256, ttl=60, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        # (store_name, key) -> (expiry time, value), least recently used
+        # entry first
+        self.entries = OrderedDict()
+        # store_name -> set of keys cached for that store
+        self.by_store = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, store_name, key):
+        """
+        Returns the cached value for the given store and key, or None if
+        there is no fresh entry for it.
+        """
+        with self.lock:
+            entry = self.entries.get((store_name, key))
+            if entry is None:
+                self.misses += 1
+                return None
+            expires, value = entry
+            if self.clock() >= expires:
+                self._remove(store_name, key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self.entries.move_to_end((store_name, key))
+            self.hits += 1
+            return value
+
+    def put(self, store_name, key, value):
+        """
+        Caches a value for the given store and key, evicting the least
+        recently used entries if the cache is full.
+        """
+        with self.lock:
+            self.entries[(store_name, key)] = (self.clock() + self.ttl, value)
+            self.entries.move_to_end((store_name, key))
+            self.by_store.setdefault(store_name, set()).add(key)
+            while len(self.entries) > self.max_entries:
+                (old_store, old_key), _ = self.entries.popitem(last=False)
+                self._unindex(old_store, old_key)
+                self.evictions += 1
+
+    def invalidate(self, store_name):
+        """
+        Drops every entry cached for the given store.
+        """
+        with self.lock:
+            for key in self.by_store.pop(store_name, ()):
+                del self.entries[(store_name, key)]
+                self.invalidations += 1
+
+    def clear(self):
+        """
+        Drops every entry.
+        """
+        with self.lock:
+            self.entries.clear()
+            self.by_store.clear()
+
+    def stats(self):
+        """
+        Returns the cache counters as a dictionary.
+        """
+        with self.lock:
+            return {'entries': len(self.entries), 'hits': self.hits,
+                    'misses': self.misses, 'evictions': self.evictions,
+                    'expirations': self.expirations,
+                    'invalidations': self.invalidations}
+
+    def _remove(self, store_name, key):
+        del self.entries[(store_name, key)]
+        self._unindex(store_name, key)
+
+    def _unindex(self, store_name, key):
+        keys = self.by_store.get(store_name)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.by_store[store_name]
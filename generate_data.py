@@ -0,0 +1,270 @@
+"""
+Generates synthetic Closetly data at any scale. Writes CSV files shaped
+like the ones load-data.sql loads (clothes.csv, user.csv,
+personal_closet.csv, ...), plus user_info.csv and permissions.csv so
+that the generated users can log in. Every generated row refers only to
+rows that exist in the other files.
+
+    $ python3 generate_data.py --scale 1000000 --out data/
+    $ python3 bulk_load.py data/
+
+All generated users have the password 'closetly'.
+"""
+import argparse
+import csv
+import hashlib
+import os
+import random
+import sys
+import time
+
+# Password of every generated user
+PASSWORD = 'closetly'
+
+STORES = ['Lululemon', 'Zara', 'Caltech', 'Aritzia', 'Uniqlo', "Levi's",
+          'Nike', 'Adidas', 'Madewell', 'Everlane', 'Patagonia', 'Gap',
+          'Reformation', 'Free People', 'Urban Outfitters', 'H&M',
+          'Abercrombie', 'J.Crew', 'Anthropologie', 'Brandy Melville']
+# Brands that only show up in personal closets
+BRANDS = STORES + ['Chanel', 'YSL', "Doc Marten's", 'Steve Madden',
+                   'WIDE WORLD SPORTSWEAR', 'Champion', 'Vans', 'Converse']
+# clothing type -> (typical price in USD, sizes it comes in)
+TYPES = {
+    'sweatshirt': (60, ['XS', 'S', 'M', 'L', 'XL']),
+    'pants': (80, ['0', '2', '4', '6', '8', '10', '12']),
+    'jeans': (90, ['24', '25', '26', '27', '28', '29', '30', '32']),
+    'jacket': (150, ['XS', 'S', 'M', 'L', 'XL']),
+    'dress': (110, ['XS', 'S', 'M', 'L']),
+    'skirt': (60, ['XS', 'S', 'M', 'L']),
+    'top': (35, ['XS', 'S', 'M', 'L', 'XL']),
+    'bodysuit': (40, ['XS', 'S', 'M', 'L']),
+    'sweater': (90, ['XS', 'S', 'M', 'L', 'XL']),
+    'shorts': (45, ['XS', 'S', 'M', 'L']),
+    'shoes': (120, ['6', '7', '8', '9', '10', '11']),
+    'bag': (200, ['one size']),
+}
+COLORS = ['Black', 'White', 'Blue', 'light blue', 'Red', 'Green', 'Pink',
+          'LIGHT GRAY', 'Charcoal gray', 'Beige', 'Brown', 'Purple',
+          'OYSTER WHITE', 'MULTICOLORED']
+ADJECTIVES = ['oversized', 'cropped', 'ribbed', 'high rise', 'satin',
+              'relaxed fit', 'vintage wash', 'asymmetrical', 'printed',
+              'wide leg', 'fitted', 'linen']
+AESTHETICS = ['casual', 'athleisure', 'formal', 'streetwear', 'vintage',
+              'business casual', 'going out', 'sporty']
+CONDITIONS = ['new', 'good', 'good', 'poor']
+DISCOUNTS = [0, 0, 0, 0, 10, 15, 20, 25, 30, 50]
+
+# Files written, in the order they must be loaded
+FILES = ['user.csv', 'user_info.csv', 'permissions.csv', 'clothes.csv',
+         'personal_closet.csv', 'store_closet.csv', 'collab_closet.csv',
+         'styled_outfits.csv']
+
+
+class Layout:
+    """
+    Sizes and ID ranges of a generated data set with the given number of
+    clothes. The first 60% of clothing IDs are in personal closets (every
+    third of those is also shared in the collaborative closet) and the
+    rest are sold in stores. User IDs start with the personal users,
+    followed by one store owner per store and then the stylists.
+    """
+    def __init__(self, scale):
+        self.scale = scale
+        self.num_users = max(10, scale // 50)
+        self.num_stylists = max(1, self.num_users // 100)
+        self.num_personal = scale * 6 // 10
+        self.num_outfits = max(1, scale // 20)
+
+    def owner(self, clothing_id):
+        """
+        Returns the user_id of the owner of a personal clothing item.
+        """
+        return (clothing_id - 1) % self.num_users + 1
+
+    def is_shared(self, clothing_id):
+        """
+        Returns True if a personal clothing item is in the collaborative
+        closet.
+        """
+        return clothing_id % 3 == 0
+
+    def store(self, clothing_id):
+        """
+        Returns the name of the store selling a store clothing item.
+        """
+        return STORES[clothing_id % len(STORES)]
+
+    def username(self, user_id):
+        """
+        Returns the username of a user. Store owners log in with their
+        store's name, see show_storeowner_options in app.py.
+        """
+        if user_id <= self.num_users:
+            return 'user' + str(user_id)
+        if user_id <= self.num_users + len(STORES):
+            return STORES[user_id - self.num_users - 1]
+        return 'stylist' + str(user_id - self.num_users - len(STORES))
+
+    def role(self, user_id):
+        if user_id <= self.num_users:
+            return 'personal'
+        if user_id <= self.num_users + len(STORES):
+            return 'storeowner'
+        return 'stylist'
+
+    def all_users(self):
+        """
+        Returns the range of every user_id.
+        """
+        return range(1, self.num_users + len(STORES) + self.num_stylists + 1)
+
+
+def hash_password(salt, password):
+    """
+    Hashes a password the same way sp_add_user does.
+    """
+    return hashlib.sha256((salt + password).encode()).hexdigest()
+
+
+def user_rows(layout, rng):
+    yield ['User ID', 'Name', 'Username']
+    for user_id in layout.all_users():
+        username = layout.username(user_id)
+        name = username if layout.role(user_id) == 'storeowner' \
+            else 'User ' + str(user_id)
+        yield [user_id, name, username]
+
+
+def user_info_rows(layout, rng):
+    yield ['username', 'salt', 'password_hash']
+    for user_id in layout.all_users():
+        # same characters make_salt uses, minus the ones that would need
+        # escaping in a CSV file
+        salt = ''.join(rng.choice('abcdefghijklmnopqrstuvwxyz' +
+                                  'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789')
+                       for _ in range(8))
+        yield [layout.username(user_id), salt, hash_password(salt, PASSWORD)]
+
+
+def permission_rows(layout, rng):
+    yield ['username', 'role']
+    for user_id in layout.all_users():
+        yield [layout.username(user_id), layout.role(user_id)]
+
+
+def clothes_rows(layout, rng):
+    yield ['clothing_id', 'clothing_type', 'size', 'gender', 'color',
+           'brand', 'description', 'image_url', 'aesthetic', 'store_name']
+    types = list(TYPES)
+    for clothing_id in range(1, layout.scale + 1):
+        clothing_type = rng.choice(types)
+        color = rng.choice(COLORS)
+        if clothing_id > layout.num_personal:
+            store = layout.store(clothing_id)
+            brand = store
+        else:
+            store = 'NULL'
+            brand = rng.choice(BRANDS)
+        description = rng.choice(ADJECTIVES) + ' ' + color.lower() + ' ' + \
+            clothing_type
+        yield [clothing_id, clothing_type, rng.choice(TYPES[clothing_type][1]),
+               rng.choice('WWWMMU'), color, brand, description, '',
+               rng.choice(AESTHETICS), store]
+
+
+def personal_closet_rows(layout, rng):
+    yield ['user_id', 'clothing_id', 'clean', 'shared', 'num_wears']
+    for clothing_id in range(1, layout.num_personal + 1):
+        # -1 means the number of wears is unknown, see load-data.sql
+        num_wears = -1 if rng.random() < 0.3 else int(rng.expovariate(1 / 15))
+        yield [layout.owner(clothing_id), clothing_id,
+               int(rng.random() < 0.8), int(layout.is_shared(clothing_id)),
+               num_wears]
+
+
+def store_closet_rows(layout, rng):
+    yield ['store_name', 'clothing_id', 'price', 'discount']
+    # every store item's type was drawn in clothes_rows, but prices only
+    # need to look plausible, so they are drawn around the average price
+    average = sum(price for price, _ in TYPES.values()) / len(TYPES)
+    for clothing_id in range(layout.num_personal + 1, layout.scale + 1):
+        discount = rng.choice(DISCOUNTS)
+        original = max(5, rng.gauss(average, average / 2))
+        price = round(original * (100 - discount) / 100, 2)
+        yield [layout.store(clothing_id), clothing_id, price, discount]
+
+
+def collab_closet_rows(layout, rng):
+    yield ['user_id', 'clothing_id', 'curr_condition', 'is_available',
+           'current_borrower']
+    for clothing_id in range(1, layout.num_personal + 1):
+        if not layout.is_shared(clothing_id):
+            continue
+        owner = layout.owner(clothing_id)
+        # -1 means nobody is borrowing it, see load-data.sql
+        borrower = -1
+        if rng.random() < 0.3:
+            borrower = rng.randint(1, layout.num_users - 1)
+            if borrower >= owner:
+                borrower += 1
+        yield [owner, clothing_id, rng.choice(CONDITIONS),
+               int(borrower == -1), borrower]
+
+
+def styled_outfit_rows(layout, rng):
+    yield ['outfit_id', 'clothing_id', 'outfit_desc', 'vibe']
+    for outfit_id in range(1, layout.num_outfits + 1):
+        vibe = rng.choice(AESTHETICS)
+        pieces = rng.sample(range(1, layout.scale + 1), rng.randint(2, 4))
+        description = 'Outfit ' + str(outfit_id) + ': ' + \
+            ' with '.join('item ' + str(piece) for piece in pieces)
+        for clothing_id in pieces:
+            yield [outfit_id, clothing_id, description, vibe]
+
+
+GENERATORS = {
+    'user.csv': user_rows,
+    'user_info.csv': user_info_rows,
+    'permissions.csv': permission_rows,
+    'clothes.csv': clothes_rows,
+    'personal_closet.csv': personal_closet_rows,
+    'store_closet.csv': store_closet_rows,
+    'collab_closet.csv': collab_closet_rows,
+    'styled_outfits.csv': styled_outfit_rows,
+}
+
+
+def generate(out_dir, scale, seed=121):
+    """
+    Writes every CSV file for a data set with the given number of clothes
+    into out_dir, streaming rows so memory use does not grow with scale.
+    Returns the Layout of the data set.
+    """
+    layout = Layout(scale)
+    rng = random.Random(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    for name in FILES:
+        # csv's default line terminator is \r\n, which load-data.sql
+        # expects
+        with open(os.path.join(out_dir, name), 'w', newline='') as f:
+            csv.writer(f).writerows(GENERATORS[name](layout, rng))
+    return layout
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate synthetic ' +
+                                     'Closetly CSV files')
+    parser.add_argument('--scale', type=int, default=10000,
+                        help='number of clothes (default: %(default)s)')
+    parser.add_argument('--out', default='data',
+                        help='directory to write to (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=121)
+    args = parser.parse_args()
+    start = time.perf_counter()
+    generate(args.out, args.scale, args.seed)
+    print('Wrote', args.scale, 'clothes to', args.out, 'in',
+          round(time.perf_counter() - start, 1), 'seconds', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -44,7 +44,19 @@ GRANT SELECT ON closetly.permissions TO 'personal'@'localhost';
 GRANT SELECT ON closetly.user TO 'personal'@'localhost';
 GRANT SELECT ON closetly.clothes TO 'personal'@'localhost';
 
+GRANT SELECT, DELETE ON closetly.borrow_waitlist TO 'personal'@'localhost';
+
 GRANT EXECUTE ON FUNCTION borrow_item TO 'personal'@'localhost';
+-- joining a waitlist and returning an item (setup-waitlist.sql)
+GRANT EXECUTE ON FUNCTION join_waitlist TO 'personal'@'localhost';
+GRANT EXECUTE ON FUNCTION return_item TO 'personal'@'localhost';
+
+-- everyone can read the summary tables from setup-rollups.sql; they are
+-- only written by triggers
+GRANT SELECT ON closetly.store_stats TO 'storeowner'@'localhost', 
+    'stylist'@'localhost', 'personal'@'localhost';
+GRANT SELECT ON closetly.outfit_totals TO 'storeowner'@'localhost', 
+    'stylist'@'localhost', 'personal'@'localhost';
 
 
 FLUSH PRIVILEGES;
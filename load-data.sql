@@ -16,9 +16,13 @@ IGNORE 1 ROWS
 SET num_wears = NULLIF(num_wears, -1);
 
 -- Load all stores' (clothes.store_name != NULL) inventory data into the 
--- store_closet table.
+-- store_closet table. The price before the discount is worked out once
+-- here and stored from then on.
 LOAD DATA LOCAL INFILE 'store_closet.csv' INTO TABLE store_closet
-FIELDS TERMINATED BY ',' ENCLOSED BY '"' LINES TERMINATED BY '\r\n' IGNORE 1 ROWS;
+FIELDS TERMINATED BY ',' ENCLOSED BY '"' LINES TERMINATED BY '\r\n' IGNORE 1 ROWS
+(store_name, clothing_id, price, discount)
+SET original_price = IF(discount < 100, 
+                        ROUND(price * 100 / (100 - discount), 2), price);
 
 -- Load all data into the collab_closet for items that users are willing
 -- to share (personal_closet.shared = 1) from their personal closet. If no one is
@@ -0,0 +1,176 @@
+"""
+Load test for server.py. Simulates many concurrent personal users, each
+sending requests one after the other with a mix of browsing, searching,
+borrowing and styling outfits, and reports requests/sec and latency
+percentiles per endpoint.
+
+The server's database must hold data from generate_data.py at the given
+scale, so that the simulated users can log in and the IDs they ask for
+exist:
+
+    $ python3 generate_data.py --scale 100000 --out data/
+    $ python3 bulk_load.py data/ --truncate
+    $ python3 server.py &
+    $ python3 loadtest.py --scale 100000 --concurrency 200 --duration 30
+"""
+import argparse
+import asyncio
+import base64
+import json
+import random
+import sys
+import time
+
+import aiohttp
+
+import generate_data
+from benchmark import summarize
+
+# Relative frequency of each kind of request
+MIX = {
+    'closet': 20,
+    'collab': 15,
+    'inventory': 25,
+    'store_search': 15,
+    'keyword_search': 15,
+    'borrow': 5,
+    'outfit': 5,
+}
+WRITES = ('borrow', 'outfit')
+
+
+def make_request(kind, layout, rng):
+    """
+    Returns (method, path, JSON body) for a random request of a kind.
+    """
+    store = rng.choice(generate_data.STORES)
+    if kind == 'closet':
+        return 'GET', '/closet', None
+    if kind == 'collab':
+        return 'GET', '/collab?after=' + \
+            str(rng.randint(0, layout.num_personal)), None
+    if kind == 'inventory':
+        return 'GET', '/stores/' + store + '/inventory?after=' + \
+            str(rng.randint(layout.num_personal, layout.scale)), None
+    if kind == 'store_search':
+        clothing_type = rng.choice(list(generate_data.TYPES))
+        return 'GET', '/stores/' + store + '/search?type=' + \
+            clothing_type + '&max_price=' + str(rng.choice([50, 100, 200])), \
+            None
+    if kind == 'keyword_search':
+        return 'GET', '/search?q=' + rng.choice(generate_data.ADJECTIVES) + \
+            '+' + rng.choice(generate_data.AESTHETICS), None
+    if kind == 'borrow':
+        return 'POST', '/borrow', {
+            'clothing_id': 3 * rng.randint(1, layout.num_personal // 3)}
+    if kind == 'outfit':
+        return 'POST', '/outfits', {
+            'clothing_ids': rng.sample(range(1, layout.scale + 1), 3),
+            'description': 'load test outfit', 'vibe': 'casual'}
+    raise ValueError(kind)
+
+
+async def simulate_user(session, url, layout, kinds, weights, deadline,
+                        latencies, errors, seed):
+    """
+    Sends requests as one random personal user until the deadline,
+    recording each request's latency under its kind.
+    """
+    rng = random.Random(seed)
+    username = layout.username(rng.randint(1, layout.num_users))
+    credentials = username + ':' + generate_data.PASSWORD
+    headers = {'Authorization': 'Basic ' +
+               base64.b64encode(credentials.encode()).decode()}
+    while time.perf_counter() < deadline:
+        kind = rng.choices(kinds, weights)[0]
+        method, path, body = make_request(kind, layout, rng)
+        start = time.perf_counter()
+        try:
+            async with session.request(method, url + path, json=body,
+                                       headers=headers) as response:
+                await response.read()
+                ok = response.status < 500
+        except aiohttp.ClientError:
+            ok = False
+        latencies[kind].append(time.perf_counter() - start)
+        if not ok:
+            errors[kind] += 1
+
+
+async def run(url, layout, concurrency, duration, kinds, weights, seed):
+    latencies = {kind: [] for kind in kinds}
+    errors = {kind: 0 for kind in kinds}
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        start = time.perf_counter()
+        deadline = start + duration
+        await asyncio.gather(*[
+            simulate_user(session, url, layout, kinds, weights, deadline,
+                          latencies, errors, seed + i)
+            for i in range(concurrency)])
+        elapsed = time.perf_counter() - start
+    report = {'url': url, 'scale': layout.scale,
+              'concurrency': concurrency, 'seconds': elapsed,
+              'endpoints': {}}
+    everything = []
+    for kind in kinds:
+        if latencies[kind]:
+            report['endpoints'][kind] = dict(
+                summarize(latencies[kind], None),
+                errors=errors[kind],
+                requests_per_sec=len(latencies[kind]) / elapsed)
+            everything.extend(latencies[kind])
+    if everything:
+        report['total'] = dict(summarize(everything, None),
+                               errors=sum(errors.values()),
+                               requests_per_sec=len(everything) / elapsed)
+    return report
+
+
+def print_report(report):
+    print('{:<16} {:>9} {:>8} {:>9} {:>9} {:>9} {:>7}'.format(
+        'endpoint', 'requests', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms',
+        'errors'))
+    rows = list(report['endpoints'].items())
+    if 'total' in report:
+        rows.append(('total', report['total']))
+    for name, stats in rows:
+        print('{:<16} {:>9} {:>8.1f} {:>9.1f} {:>9.1f} {:>9.1f} {:>7}'.format(
+            name, stats['iterations'], stats['requests_per_sec'],
+            stats['p50_ms'], stats['p95_ms'], stats['p99_ms'],
+            stats['errors']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the Closetly ' +
+                                     'HTTP service')
+    parser.add_argument('--url', default='http://127.0.0.1:8080')
+    parser.add_argument('--scale', type=int, default=10000,
+                        help='scale the database was generated at ' +
+                             '(default: %(default)s)')
+    parser.add_argument('--concurrency', type=int, default=100,
+                        help='simulated users (default: %(default)s)')
+    parser.add_argument('--duration', type=float, default=30,
+                        help='seconds to run for (default: %(default)s)')
+    parser.add_argument('--read-only', action='store_true',
+                        help='do not borrow or save outfits')
+    parser.add_argument('--seed', type=int, default=121)
+    parser.add_argument('--output', help='also write the report as JSON')
+    args = parser.parse_args()
+    kinds = [kind for kind in MIX
+             if not (args.read_only and kind in WRITES)]
+    weights = [MIX[kind] for kind in kinds]
+    report = asyncio.run(run(args.url.rstrip('/'),
+                             generate_data.Layout(args.scale),
+                             args.concurrency, args.duration, kinds,
+                             weights, args.seed))
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if 'total' in report and report['total']['errors']:
+        print(report['total']['errors'], 'requests failed', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
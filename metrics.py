@@ -0,0 +1,260 @@
+"""
+Query and command instrumentation. Every statement run through
+statements.py is timed from the moment it is sent until its last row is
+read, and the rows and (approximate) bytes it returned are counted.
+Commands (a menu action, a batch operation, an HTTP request) are timed
+the same way. Latencies go into histograms per statement and per
+command, which can be written out as Prometheus text or JSON:
+
+    $ python3 app.py --metrics metrics.prom --slow-query-ms 50
+    $ kill -USR1 <pid of app.py>      # writes metrics.prom right away
+
+Statements slower than the slow query threshold are logged along with
+their EXPLAIN output, once their rows have been read.
+"""
+import contextlib
+import functools
+import json
+import queue
+import signal
+import sys
+import threading
+import time
+
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+           0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Statements that can be EXPLAINed
+EXPLAINABLE = ('SELECT', 'WITH', 'UPDATE', 'DELETE', 'INSERT', 'REPLACE')
+
+
+def value_bytes(value):
+    """
+    Roughly how many bytes a value takes on the wire.
+    """
+    if value is None:
+        return 0
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    return 8
+
+
+def rows_bytes(rows):
+    return sum(value_bytes(value) for row in rows for value in row)
+
+
+class Histogram:
+    """
+    Latencies in BUCKETS, with their count, sum and maximum, plus the
+    rows and bytes returned.
+    """
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.rows = 0
+        self.bytes = 0
+
+    def observe(self, seconds, rows=0, size=0):
+        i = 0
+        while i < len(BUCKETS) and seconds > BUCKETS[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+        self.rows += rows
+        self.bytes += size
+
+    def quantile(self, q):
+        """
+        Estimates the qth quantile (0 to 1) as the upper bound of the
+        bucket it falls in, in seconds.
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'total_ms': round(1000 * self.sum, 3),
+            'mean_ms': round(1000 * self.sum / self.count, 3)
+                       if self.count else 0,
+            'p50_ms': 1000 * self.quantile(0.5),
+            'p95_ms': 1000 * self.quantile(0.95),
+            'p99_ms': 1000 * self.quantile(0.99),
+            'max_ms': round(1000 * self.max, 3),
+            'rows': self.rows,
+            'bytes': self.bytes,
+            'buckets': {str(bound): count
+                        for bound, count in zip(BUCKETS + ('+Inf',),
+                                                self.counts)},
+        }
+
+
+class Metrics:
+    """
+    Histograms per statement and per command, and the slow query log.
+    Thread-safe.
+    """
+    def __init__(self, slow_query_ms=None, slow_log=None):
+        self.slow_query_ms = slow_query_ms
+        self.slow_log = slow_log
+        self.queries = {}
+        self.commands = {}
+        self.slow_queries = 0
+        self.lock = threading.Lock()
+
+    def is_slow(self, seconds):
+        return (self.slow_query_ms is not None and
+                1000 * seconds >= self.slow_query_ms)
+
+    def record_query(self, name, seconds, rows=0, size=0):
+        with self.lock:
+            histogram = self.queries.get(name)
+            if histogram is None:
+                histogram = self.queries[name] = Histogram()
+            histogram.observe(seconds, rows, size)
+
+    def record_command(self, name, seconds):
+        with self.lock:
+            histogram = self.commands.get(name)
+            if histogram is None:
+                histogram = self.commands[name] = Histogram()
+            histogram.observe(seconds)
+
+    @contextlib.contextmanager
+    def command(self, name):
+        """
+        Times the body of a with statement as the named command.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_command(name, time.perf_counter() - start)
+
+    def timed(self, function):
+        """
+        Decorates a function so that every call is timed as a command
+        named after it.
+        """
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with self.command(function.__name__):
+                return function(*args, **kwargs)
+        return wrapper
+
+    def log_slow(self, name, seconds, params, plan):
+        """
+        Writes a slow statement and its EXPLAIN rows (or why it could not
+        be explained) to the slow log.
+        """
+        with self.lock:
+            self.slow_queries += 1
+        out = self.slow_log or sys.stderr
+        lines = ['slow query {} took {:.1f} ms, params {!r}'.format(
+            name, 1000 * seconds, tuple(params))]
+        lines += ['    ' + line for line in plan]
+        out.write('\n'.join(lines) + '\n')
+        out.flush()
+
+    # ------------------------------------------------------------------
+    # Output
+    # ------------------------------------------------------------------
+    def to_json(self):
+        with self.lock:
+            return {
+                'slow_query_ms': self.slow_query_ms,
+                'slow_queries': self.slow_queries,
+                'queries': {name: h.to_dict()
+                            for name, h in sorted(self.queries.items())},
+                'commands': {name: h.to_dict()
+                             for name, h in sorted(self.commands.items())},
+            }
+
+    def to_prometheus(self):
+        """
+        Returns the metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        with self.lock:
+            for kind, histograms in (('query', self.queries),
+                                     ('command', self.commands)):
+                metric = 'closetly_{}_duration_seconds'.format(kind)
+                lines += ['# HELP {} Latency of each {}.'.format(metric,
+                                                                 kind),
+                          '# TYPE {} histogram'.format(metric)]
+                for name, h in sorted(histograms.items()):
+                    label = '{}="{}"'.format(kind, escape(name))
+                    seen = 0
+                    for bound, count in zip(BUCKETS + ('+Inf',), h.counts):
+                        seen += count
+                        lines.append('{}_bucket{{{},le="{}"}} {}'.format(
+                            metric, label, bound, seen))
+                    lines.append('{}_sum{{{}}} {}'.format(metric, label,
+                                                          h.sum))
+                    lines.append('{}_count{{{}}} {}'.format(metric, label,
+                                                            h.count))
+            for what in ('rows', 'bytes'):
+                metric = 'closetly_query_{}_total'.format(what)
+                lines += ['# HELP {} {} returned by each query.'.format(
+                              metric, what.capitalize()),
+                          '# TYPE {} counter'.format(metric)]
+                for name, h in sorted(self.queries.items()):
+                    lines.append('{}{{query="{}"}} {}'.format(
+                        metric, escape(name), getattr(h, what)))
+            lines += ['# HELP closetly_slow_queries_total Queries slower ' +
+                      'than the slow query threshold.',
+                      '# TYPE closetly_slow_queries_total counter',
+                      'closetly_slow_queries_total ' +
+                      str(self.slow_queries)]
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path):
+        """
+        Writes the metrics to path, as JSON if it ends in .json and as
+        Prometheus text otherwise.
+        """
+        with open(path, 'w') as f:
+            if path.endswith('.json'):
+                json.dump(self.to_json(), f, indent=2)
+            else:
+                f.write(self.to_prometheus())
+
+    def dump_on_signal(self, path, signum=getattr(signal, 'SIGUSR1', None)):
+        """
+        Writes the metrics to path whenever the process gets signum
+        (SIGUSR1 by default, where there is one). The signal handler runs
+        in the main thread, possibly while it holds the lock, so it only
+        wakes a thread that does the writing.
+        """
+        if signum is None:
+            return
+        # SimpleQueue.put can be called from a signal handler
+        requests = queue.SimpleQueue()
+
+        def dumper():
+            while True:
+                self.dump(requests.get())
+
+        threading.Thread(target=dumper, name='metrics-dump',
+                         daemon=True).start()
+        signal.signal(signum, lambda *_: requests.put(path))
+
+
+def escape(label):
+    return label.replace('\\', '\\\\').replace('"', '\\"')
+
+
+# Metrics of everything run through statements.py in this process
+METRICS = Metrics()
@@ -0,0 +1,417 @@
+"""
+Connection pool for the Closetly app. Connections are kept per database
+account (storeowner, stylist, personal, appadmin) so that logging in or
+switching roles reuses an open connection instead of paying for a new
+TCP + authentication handshake every time.
+
+With read replicas, RoutingPool hands out a RoutedConnection per
+checkout: a connection to the primary plus one to a replica, with
+read-only statements sent to the replica (see statements.READS).
+"""
+import itertools
+import struct
+import threading
+import time
+from collections import deque
+
+import mysql.connector
+from mysql.connector import utils
+from mysql.connector.constants import ServerCmd, ServerFlag
+
+# Type of the session state entry holding the transaction's GTID in an OK
+# packet, sent when session_track_gtids = OWN_GTID (see commit_gtid)
+SESSION_TRACK_GTIDS = 3
+
+
+class RolePool:
+    """
+    Idle connections for a single database account, along with the
+    counters used to report how well the pool is working.
+    """
+    def __init__(self, user, password):
+        self.user = user
+        self.password = password
+        # (connection, time it was returned to the pool), most recently
+        # used connection on the right
+        self.idle = deque()
+        # number of connections handed out and not yet returned
+        self.in_use = 0
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.evictions = 0
+        self.health_failures = 0
+
+    def size(self):
+        """
+        Returns the number of open connections, idle or in use.
+        """
+        return len(self.idle) + self.in_use
+
+    def stats(self):
+        """
+        Returns the pool counters as a dictionary.
+        """
+        return {'idle': len(self.idle), 'in_use': self.in_use,
+                'hits': self.hits, 'misses': self.misses,
+                'waits': self.waits, 'evictions': self.evictions,
+                'health_failures': self.health_failures}
+
+
+class ConnectionPool:
+    """
+    Pool of MySQL connections keyed by database account.
+
+    connect is called as connect(user, password) to open a new connection.
+    Each account keeps at most max_size connections open and never evicts
+    below min_size. Idle connections are pinged before being handed out if
+    they have been sitting for longer than health_check_after seconds, and
+    are closed once they have been idle for longer than idle_timeout.
+    """
+    def __init__(self, connect, min_size=1, max_size=5, idle_timeout=300,
+                 health_check_after=30, wait_timeout=10):
+        self.connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.health_check_after = health_check_after
+        self.wait_timeout = wait_timeout
+        self.pools = {}
+        # maps id() of each checked-out connection to its RolePool
+        self.owners = {}
+        self.lock = threading.Condition()
+
+    def _role_pool(self, user, password):
+        pool = self.pools.get(user)
+        if pool is None:
+            pool = RolePool(user, password)
+            self.pools[user] = pool
+        return pool
+
+    def _healthy(self, conn, idle_since):
+        """
+        Returns True if an idle connection can be handed out again. Only
+        connections that have been idle for a while are pinged, so a busy
+        pool does not pay an extra round trip per checkout.
+        """
+        if time.monotonic() - idle_since < self.health_check_after:
+            return True
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except mysql.connector.Error:
+            return False
+
+    def _evict_idle(self, pool):
+        """
+        Closes connections that have been idle for longer than idle_timeout,
+        oldest first, while keeping at least min_size connections open.
+        Must be called with the lock held.
+        """
+        now = time.monotonic()
+        while pool.idle and pool.size() > self.min_size:
+            conn, idle_since = pool.idle[0]
+            if now - idle_since < self.idle_timeout:
+                break
+            pool.idle.popleft()
+            pool.evictions += 1
+            _close_quietly(conn)
+
+    def acquire(self, user, password):
+        """
+        Returns an open connection for the given database account, reusing
+        an idle one if possible. Blocks for up to wait_timeout seconds if
+        the account already has max_size connections checked out, then
+        raises mysql.connector.errors.PoolError.
+        """
+        deadline = time.monotonic() + self.wait_timeout
+        with self.lock:
+            pool = self._role_pool(user, password)
+            self._evict_idle(pool)
+            waited = False
+            while True:
+                while pool.idle:
+                    conn, idle_since = pool.idle.pop()
+                    if self._healthy(conn, idle_since):
+                        pool.hits += 1
+                        pool.in_use += 1
+                        self.owners[id(conn)] = pool
+                        return conn
+                    pool.health_failures += 1
+                    _close_quietly(conn)
+                if pool.size() < self.max_size:
+                    break
+                if not waited:
+                    pool.waits += 1
+                    waited = True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise mysql.connector.errors.PoolError(
+                        'No connection available for ' + user)
+                self.lock.wait(remaining)
+            # reserve the slot before connecting so that other threads
+            # cannot go over max_size while we wait on the handshake
+            pool.misses += 1
+            pool.in_use += 1
+        try:
+            conn = self.connect(user, password)
+        except BaseException:
+            with self.lock:
+                pool.in_use -= 1
+                self.lock.notify()
+            raise
+        with self.lock:
+            self.owners[id(conn)] = pool
+        return conn
+
+    def release(self, conn):
+        """
+        Returns a connection to its pool. Any transaction left open is
+        rolled back, just as closing the connection would have done.
+        Connections that did not come from this pool are closed.
+        """
+        with self.lock:
+            pool = self.owners.pop(id(conn), None)
+        if pool is None:
+            _close_quietly(conn)
+            return
+        reusable = True
+        try:
+            if conn.in_transaction or conn.unread_result:
+                conn.rollback()
+        except mysql.connector.Error:
+            reusable = False
+        with self.lock:
+            pool.in_use -= 1
+            if reusable and conn.is_connected():
+                pool.idle.append((conn, time.monotonic()))
+                self._evict_idle(pool)
+            else:
+                pool.health_failures += 1
+                _close_quietly(conn)
+            self.lock.notify()
+
+    def warm(self, user, password):
+        """
+        Opens connections for the given account until it has min_size of
+        them, so that the first checkout does not have to wait on a
+        handshake.
+        """
+        with self.lock:
+            pool = self._role_pool(user, password)
+            missing = self.min_size - pool.size()
+            pool.in_use += max(missing, 0)
+        opened = []
+        try:
+            for _ in range(missing):
+                opened.append(self.connect(user, password))
+        finally:
+            with self.lock:
+                pool.in_use -= max(missing, 0)
+                now = time.monotonic()
+                for conn in opened:
+                    pool.idle.append((conn, now))
+                self.lock.notify_all()
+
+    def close_all(self):
+        """
+        Closes every idle connection. Connections that are still checked
+        out are closed when they are released.
+        """
+        with self.lock:
+            for pool in self.pools.values():
+                while pool.idle:
+                    conn, _ = pool.idle.pop()
+                    _close_quietly(conn)
+
+    def stats(self):
+        """
+        Returns the counters of every account's pool, keyed by account.
+        """
+        with self.lock:
+            return {user: pool.stats() for user, pool in self.pools.items()}
+
+
+class RoutedConnection:
+    """
+    A connection to the primary and one to a replica, used by
+    statements.execute as one connection: route(read) returns the one a
+    statement should run on. Everything else (commit, cursor, ...) goes to
+    the primary, so code that writes and commits works unchanged.
+
+    Reads go to the replica unless they would not see this session's own
+    writes: while a transaction is open on the primary, and after a
+    commit that wrote, until the replica has applied it. With GTIDs on,
+    the commit's own GTID comes back with it (see commit_gtid), and the
+    replica is checked with WAIT_FOR_EXECUTED_GTID_SET on that GTID alone,
+    waiting up to replica_wait seconds before reading from the primary
+    instead. Without GTIDs, or if the primary connection cannot report
+    them, reads stay on the primary for sticky_seconds after a write.
+    """
+    def __init__(self, primary, replica, replica_wait=0.05,
+                 sticky_seconds=5):
+        self.primary = primary
+        self.replica = replica
+        self.replica_wait = replica_wait
+        self.sticky_seconds = sticky_seconds
+        # a write has run in the current transaction
+        self.wrote = False
+        # GTID (or time.monotonic(), without GTIDs) of the last committed
+        # write the replica may not have applied yet
+        self.last_write = None
+        self.replica_reads = 0
+        self.primary_reads = 0
+
+    def __getattr__(self, attr):
+        return getattr(self.primary, attr)
+
+    def route(self, read):
+        """
+        Returns the connection to run a statement on, read being whether
+        it is in statements.READS.
+        """
+        if not read:
+            self.wrote = True
+            return self.primary
+        if (self.replica is None or self.primary.in_transaction or
+                not self._caught_up()):
+            self.primary_reads += 1
+            return self.primary
+        self.replica_reads += 1
+        return self.replica
+
+    def _caught_up(self):
+        """
+        Returns True if the replica has applied this session's last write.
+        """
+        if self.last_write is None:
+            return True
+        if isinstance(self.last_write, float):
+            caught_up = (time.monotonic() - self.last_write >=
+                         self.sticky_seconds)
+        else:
+            cursor = self.replica.cursor()
+            cursor.execute('SELECT WAIT_FOR_EXECUTED_GTID_SET(%s, %s)',
+                           (self.last_write, self.replica_wait))
+            caught_up = cursor.fetchone()[0] == 0
+            cursor.close()
+        if caught_up:
+            self.last_write = None
+        return caught_up
+
+    def commit(self):
+        if not self.wrote:
+            self.primary.commit()
+            return
+        self.wrote = False
+        self.last_write = commit_gtid(self.primary) or time.monotonic()
+
+    def rollback(self):
+        self.primary.rollback()
+        self.wrote = False
+
+
+class RoutingPool:
+    """
+    Pools for a primary and its read replicas, with the same interface as
+    ConnectionPool. Each acquire returns a RoutedConnection pairing a
+    primary connection with one to the next replica in turn. If that
+    replica cannot be reached, the others are tried, and with none left
+    everything runs on the primary.
+    """
+    def __init__(self, primary, replicas, replica_wait=0.05,
+                 sticky_seconds=5):
+        self.primary = primary
+        self.replicas = replicas
+        self.replica_wait = replica_wait
+        self.sticky_seconds = sticky_seconds
+        self.next_replica = itertools.cycle(range(len(replicas)))
+        self.lock = threading.Lock()
+
+    def acquire(self, user, password):
+        primary = self.primary.acquire(user, password)
+        replica = None
+        with self.lock:
+            first = next(self.next_replica)
+        for i in range(len(self.replicas)):
+            pool = self.replicas[(first + i) % len(self.replicas)]
+            try:
+                replica = pool.acquire(user, password)
+                break
+            except mysql.connector.Error:
+                continue
+        return RoutedConnection(primary, replica, self.replica_wait,
+                                self.sticky_seconds)
+
+    def release(self, conn):
+        if not isinstance(conn, RoutedConnection):
+            self.primary.release(conn)
+            return
+        self.primary.release(conn.primary)
+        if conn.replica is not None:
+            for pool in self.replicas:
+                if id(conn.replica) in pool.owners:
+                    pool.release(conn.replica)
+                    break
+
+    def warm(self, user, password):
+        for pool in [self.primary] + self.replicas:
+            pool.warm(user, password)
+
+    def close_all(self):
+        for pool in [self.primary] + self.replicas:
+            pool.close_all()
+
+    def stats(self):
+        stats = {'primary': self.primary.stats()}
+        for i, pool in enumerate(self.replicas):
+            stats['replica ' + str(i + 1)] = pool.stats()
+        return stats
+
+
+def commit_gtid(conn):
+    """
+    Commits on conn and returns the GTID the server gave the transaction,
+    or None if it got none (it wrote nothing, or GTIDs are off). The GTID
+    is read from the session state in the OK packet of the COMMIT itself,
+    so it costs no round trip: conn must have been opened with the
+    SESSION_TRACK client flag and session_track_gtids = OWN_GTID (see
+    backends.MySQLBackend). mysql.connector does not parse that part of
+    the packet, so this sends the COMMIT itself, which only the pure
+    Python connection can do; other connections just commit and get None.
+    """
+    if not hasattr(conn, '_send_cmd'):
+        conn.commit()
+        return None
+    conn.handle_unread_result()
+    packet = conn._send_cmd(ServerCmd.QUERY, b'COMMIT')
+    # raises on an error packet, and keeps in_transaction up to date
+    conn._handle_ok(packet)
+    return _tracked_gtid(packet)
+
+
+def _tracked_gtid(packet):
+    """
+    Returns the GTID in the session state of an OK packet, or None.
+    """
+    packet, _ = utils.read_lc_int(packet[5:])  # affected rows
+    packet, _ = utils.read_lc_int(packet)  # last insert ID
+    status = struct.unpack('<H', packet[0:2])[0]
+    if not status & ServerFlag.SERVER_SESSION_STATE_CHANGED:
+        return None
+    packet, _ = utils.read_lc_string(packet[4:])  # info message
+    _, state = utils.read_lc_string(packet)
+    while state:
+        kind = state[0]
+        state, data = utils.read_lc_string(state[1:])
+        if kind == SESSION_TRACK_GTIDS:
+            # one byte for the encoding, then the GTIDs as text
+            return utils.read_lc_string(data[1:])[1].decode() or None
+    return None
+
+
+def _close_quietly(conn):
+    try:
+        conn.close()
+    except mysql.connector.Error:
+        pass
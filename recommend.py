@@ -0,0 +1,433 @@
+"""
+Suggests clothes to add to a partly styled outfit. The whole clothes
+catalog is kept in memory as NumPy arrays, and candidates are scored
+against the pieces picked so far by their type, color, aesthetic, brand
+and gender, and by how often they were styled together with those pieces
+in styled_outfits. Only items the user could actually wear are
+suggested: their own personal closet, available items in the
+collaborative closet, and items sold in stores.
+
+Each item's attributes are a one-hot vector per attribute, and an item's
+score is the dot product of its vector with the outfit's (the share of
+pieces with each value). Many items share the exact same attributes, so
+the dot product is worked out once per distinct combination of
+attributes (a "style") rather than once per item, and items are only
+looked at for the best styles until enough candidates are found. This
+keeps a suggestion to a few milliseconds on millions of clothes.
+
+The model is loaded once and then refreshed incrementally with the
+clothes and outfits added since (see CachedModel).
+"""
+import threading
+import time
+
+import numpy as np
+
+import statements
+
+# Attributes items are compared on, in the order of Model.style_codes
+ATTRIBUTES = ['clothing_type', 'color', 'aesthetic', 'brand', 'gender']
+
+# How much a match on each attribute adds to an item's score. The type is
+# not matched but complemented, see TYPE_WEIGHT.
+WEIGHTS = {
+    'clothing_type': 0.0,
+    'color': 1.0,
+    'aesthetic': 2.0,
+    'brand': 0.5,
+    'gender': 1.0,
+}
+# How much an item's type adds for going with the outfit's types, as
+# learned from styled_outfits (tops are styled with jeans far more often
+# than with other tops)
+TYPE_WEIGHT = 2.0
+# How much being styled with the outfit's pieces before adds
+COOCCURRENCE_WEIGHT = 3.0
+# With no pieces picked yet, how much being styled at all adds
+POPULARITY_WEIGHT = 1.0
+
+SOURCES = ('personal', 'collab', 'store')
+
+COLUMNS = ['clothing_id', 'clothing_type', 'color', 'aesthetic', 'brand',
+           'gender', 'source', 'score']
+
+# Rows fetched at a time when loading the model
+FETCH_SIZE = 10000
+
+
+def gather_ranges(starts, ends):
+    """
+    Returns the concatenation of arange(start, end) for every start and
+    end, without a Python loop.
+    """
+    lengths = ends - starts
+    total = int(lengths.sum())
+    if total == 0:
+        return np.zeros(0, dtype=np.int64)
+    offsets = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+    return np.arange(total, dtype=np.int64) + offsets
+
+
+class Model:
+    """
+    The clothes catalog and styled outfits as arrays, indexed by position
+    (clothing IDs are kept in ascending order in ids).
+
+    Clothes and outfits can only be added, and only with IDs past the ones
+    already loaded. Changes to existing rows (an item being borrowed or
+    sold, say) are picked up by building a new model, which CachedModel
+    does every so often.
+    """
+    def __init__(self):
+        # value -> code, and code -> value, per attribute
+        self.vocabularies = [{} for _ in ATTRIBUTES]
+        self.values = [[] for _ in ATTRIBUTES]
+        # attribute codes -> style, and style -> attribute codes
+        self.styles = {}
+        self.style_codes = np.zeros((0, len(ATTRIBUTES)), dtype=np.int32)
+
+        # per item
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.style = np.zeros(0, dtype=np.int32)
+        self.owner = np.zeros(0, dtype=np.int64) # 0 if in no closet
+        self.collab = np.zeros(0, dtype=bool) # can be borrowed
+        self.store = np.zeros(0, dtype=bool) # is for sale
+
+        # per outfit piece, in outfit_id order; item is a position in ids
+        self.piece_outfit = np.zeros(0, dtype=np.int64)
+        self.piece_item = np.zeros(0, dtype=np.int64)
+        # number of outfits each item is in
+        self.popularity = np.zeros(0, dtype=np.int64)
+        # number of times a piece of each type was styled with a piece of
+        # each other type
+        self.type_pairs = np.zeros((0, 0), dtype=np.float64)
+
+        self.last_clothing_id = 0
+        self.last_outfit_id = 0
+        self.index()
+
+    def __len__(self):
+        return len(self.ids)
+
+    # ------------------------------------------------------------------
+    # Loading
+    # ------------------------------------------------------------------
+    def add_clothes(self, rows):
+        """
+        Adds clothes from rows of (clothing_id, clothing_type, color,
+        aesthetic, brand, gender, owner user_id or None, can be borrowed,
+        is for sale), in ascending clothing_id order. rows can be any
+        iterable, and is read once. Returns the number of clothes added.
+        """
+        styles = self.styles
+        new_styles = []
+        ids, style, owner, collab, store = [], [], [], [], []
+        for row in rows:
+            if row[0] <= self.last_clothing_id:
+                continue
+            codes = tuple(self._code(a, value)
+                          for a, value in enumerate(row[1:6]))
+            code = styles.get(codes)
+            if code is None:
+                code = styles[codes] = len(styles)
+                new_styles.append(codes)
+            ids.append(row[0])
+            style.append(code)
+            owner.append(row[6] or 0)
+            collab.append(bool(row[7]))
+            store.append(bool(row[8]))
+        if not ids:
+            return 0
+        if new_styles:
+            self.style_codes = np.concatenate(
+                [self.style_codes, np.array(new_styles, dtype=np.int32)])
+        self.ids = np.concatenate([self.ids, np.array(ids, dtype=np.int64)])
+        self.style = np.concatenate(
+            [self.style, np.array(style, dtype=np.int32)])
+        self.owner = np.concatenate(
+            [self.owner, np.array(owner, dtype=np.int64)])
+        self.collab = np.concatenate([self.collab, np.array(collab)])
+        self.store = np.concatenate([self.store, np.array(store)])
+        self.popularity = np.concatenate(
+            [self.popularity, np.zeros(len(ids), dtype=np.int64)])
+        self.last_clothing_id = int(self.ids[-1])
+        self.indexed = False
+        return len(ids)
+
+    def add_outfits(self, rows):
+        """
+        Adds outfit pieces from rows of (outfit_id, clothing_id), in
+        ascending outfit_id order. rows can be any iterable, and is read
+        once. Pieces that are not in the catalog are skipped. Returns the
+        number of pieces added.
+        """
+        rows = [row for row in rows if row[0] > self.last_outfit_id]
+        if not rows:
+            return 0
+        outfit = np.array([row[0] for row in rows], dtype=np.int64)
+        clothing_id = np.array([row[1] for row in rows], dtype=np.int64)
+        self.last_outfit_id = int(outfit[-1])
+        item = np.searchsorted(self.ids, clothing_id)
+        known = item < len(self.ids)
+        known[known] = self.ids[item[known]] == clothing_id[known]
+        outfit, item = outfit[known], item[known]
+
+        # every ordered pair of pieces of the same outfit
+        starts = np.flatnonzero(np.r_[True, outfit[1:] != outfit[:-1]])
+        lengths = np.diff(np.r_[starts, len(outfit)])
+        left = np.repeat(np.arange(len(outfit)), np.repeat(lengths, lengths))
+        right = gather_ranges(np.repeat(starts, lengths),
+                              np.repeat(starts + lengths, lengths))
+        pairs = left != right
+        types = self.style_codes[self.style[item], 0]
+        np.add.at(self.type_pairs, (types[left[pairs]], types[right[pairs]]),
+                  1)
+
+        np.add.at(self.popularity, item, 1)
+        self.piece_outfit = np.concatenate([self.piece_outfit, outfit])
+        self.piece_item = np.concatenate([self.piece_item, item])
+        self.indexed = False
+        return len(item)
+
+    def load(self, conn):
+        """
+        Adds every clothing item and outfit piece added to the database
+        since the last load (everything, the first time). Returns the
+        number of clothes and of outfit pieces added.
+        """
+        def rows(name, watermark):
+            cursor = statements.execute(conn, name, (watermark,))
+            while True:
+                chunk = cursor.fetchmany(FETCH_SIZE)
+                if not chunk:
+                    return
+                yield from chunk
+
+        clothes = self.add_clothes(rows('recommend_clothes',
+                                        self.last_clothing_id))
+        pieces = self.add_outfits(rows('recommend_outfits',
+                                       self.last_outfit_id))
+        self.index()
+        return clothes, pieces
+
+    def _code(self, attribute, value):
+        if isinstance(value, (bytes, bytearray)):
+            value = value.decode()
+        vocabulary = self.vocabularies[attribute]
+        code = vocabulary.get(value)
+        if code is None:
+            code = vocabulary[value] = len(vocabulary)
+            self.values[attribute].append(value)
+            if attribute == 0:
+                size = len(vocabulary)
+                pairs = np.zeros((size, size))
+                pairs[:size - 1, :size - 1] = self.type_pairs
+                self.type_pairs = pairs
+        return code
+
+    def index(self):
+        """
+        Groups items by style (by_style[style_start[s]:style_start[s + 1]]
+        are the items of style s, in clothing_id order), by owner, and
+        outfit pieces by item. Done once after adding rows, before the
+        next suggestion.
+        """
+        counts = np.bincount(self.style, minlength=len(self.style_codes))
+        self.style_start = np.r_[0, np.cumsum(counts)]
+        self.by_style = np.argsort(self.style, kind='stable')
+        self.by_owner = np.argsort(self.owner, kind='stable')
+        self.owners = self.owner[self.by_owner]
+        self.piece_order = np.argsort(self.piece_item, kind='stable')
+        self.indexed = True
+
+    # ------------------------------------------------------------------
+    # Scoring
+    # ------------------------------------------------------------------
+    def style_scores(self, items):
+        """
+        Returns the score of every style against an outfit made of the
+        given items (positions in ids).
+        """
+        scores = np.zeros(len(self.style_codes))
+        if len(items) == 0:
+            return scores
+        codes = self.style_codes[self.style[items]]
+        for a, name in enumerate(ATTRIBUTES):
+            if WEIGHTS[name]:
+                share = np.bincount(codes[:, a],
+                                    minlength=len(self.values[a])) / len(items)
+                scores += WEIGHTS[name] * share[self.style_codes[:, a]]
+        # how often each type goes with the outfit's types, less the types
+        # the outfit already has
+        types = np.bincount(codes[:, 0], minlength=len(self.values[0])) / \
+            len(items)
+        totals = self.type_pairs.sum(axis=1, keepdims=True)
+        goes_with = types @ np.divide(self.type_pairs, totals,
+                                      out=np.zeros_like(self.type_pairs),
+                                      where=totals > 0)
+        scores += TYPE_WEIGHT * (goes_with - types)[self.style_codes[:, 0]]
+        return scores
+
+    def bonuses(self, items):
+        """
+        Returns (items, bonus) for the items that score more than their
+        style: those styled together with the given items before, or with
+        no items given, those styled at all.
+        """
+        if len(items) == 0:
+            styled = np.flatnonzero(self.popularity)
+            if len(styled) == 0:
+                return styled, np.zeros(0)
+            counts = self.popularity[styled]
+            return styled, POPULARITY_WEIGHT * counts / counts.max()
+        sorted_items = self.piece_item[self.piece_order]
+        pieces = self.piece_order[gather_ranges(
+            np.searchsorted(sorted_items, items),
+            np.searchsorted(sorted_items, items, side='right'))]
+        outfits = np.unique(self.piece_outfit[pieces])
+        together = self.piece_item[gather_ranges(
+            np.searchsorted(self.piece_outfit, outfits),
+            np.searchsorted(self.piece_outfit, outfits, side='right'))]
+        if len(together) == 0:
+            return together, np.zeros(0)
+        together, counts = np.unique(together, return_counts=True)
+        return together, COOCCURRENCE_WEIGHT * counts / counts.max()
+
+    def suggest(self, clothing_ids, user_id=None, k=10, sources=SOURCES):
+        """
+        Returns the k best items to add to an outfit made of the given
+        clothing IDs, best first, as rows in COLUMNS order. Candidates are
+        the user's personal closet, items that can be borrowed from the
+        collaborative closet, and items sold in stores (or those of the
+        given sources). Clothing IDs not in the model are ignored.
+        """
+        if not self.indexed:
+            self.index()
+        clothing_ids = np.asarray(clothing_ids, dtype=np.int64)
+        picked = np.searchsorted(self.ids, clothing_ids)
+        found = picked < len(self.ids)
+        found[found] = self.ids[picked[found]] == clothing_ids[found]
+        picked = np.unique(picked[found])
+        scores = self.style_scores(picked)
+        user_id = user_id or -1
+
+        def others(items):
+            # items someone else has that can be borrowed or bought
+            ok = np.zeros(len(items), dtype=bool)
+            if 'collab' in sources:
+                ok |= self.collab[items]
+            if 'store' in sources:
+                ok |= self.store[items]
+            return ok & (self.owner[items] != user_id)
+
+        # the user's own closet, which may be too small a share of the
+        # catalog to turn up among the best styles
+        mine = np.zeros(0, dtype=np.int64)
+        if 'personal' in sources:
+            mine = self.by_owner[
+                np.searchsorted(self.owners, user_id):
+                np.searchsorted(self.owners, user_id, side='right')]
+
+        # items that score more than their style
+        bonus_items, bonus = self.bonuses(picked)
+        keep = others(bonus_items)
+        candidates = [mine, bonus_items[keep]]
+        extra = [np.zeros(len(mine)), bonus[keep]]
+        mine_bonus = np.isin(bonus_items, mine)
+        # searchsorted with a sorter gives positions in sorted order, which
+        # order maps back to positions in mine
+        order = np.argsort(mine)
+        extra[0][order[np.searchsorted(mine, bonus_items[mine_bonus],
+                                       sorter=order)]] = bonus[mine_bonus]
+
+        # every other item scores the same as its style, so only the items
+        # of the best styles need looking at
+        num_styles = min(len(scores), 64)
+        while ('collab' in sources or 'store' in sources) and num_styles:
+            best = np.argpartition(-scores, num_styles - 1)[:num_styles]
+            best = best[np.argsort(-scores[best], kind='stable')]
+            items = self.by_style[gather_ranges(self.style_start[best],
+                                                self.style_start[best + 1])]
+            items = items[others(items) & ~np.isin(items, bonus_items)]
+            if len(items) >= k + len(picked) or num_styles == len(scores):
+                candidates.append(items[:k + len(picked)])
+                extra.append(np.zeros(len(candidates[-1])))
+                break
+            num_styles = min(len(scores), num_styles * 8)
+
+        candidates = np.concatenate(candidates)
+        candidate_scores = scores[self.style[candidates]] + \
+            np.concatenate(extra)
+        keep = ~np.isin(candidates, picked)
+        candidates, candidate_scores = candidates[keep], candidate_scores[keep]
+        top = np.argsort(-candidate_scores, kind='stable')[:k]
+        return [self.row(item, score, user_id) for item, score
+                in zip(candidates[top], candidate_scores[top])]
+
+    def row(self, item, score, user_id=None):
+        """
+        Returns an item's row in COLUMNS order, with where the given user
+        would get it from.
+        """
+        codes = self.style_codes[self.style[item]]
+        if self.owner[item] == user_id:
+            source = 'personal'
+        elif self.store[item]:
+            source = 'store'
+        elif self.collab[item]:
+            source = 'collab'
+        else:
+            source = None
+        return ([int(self.ids[item])] +
+                [self.values[a][code] for a, code in enumerate(codes)] +
+                [source, round(float(score), 3)])
+
+
+class CachedModel:
+    """
+    A Model shared by the whole process. It is loaded the first time it is
+    asked for, topped up with new clothes and outfits when it is more
+    than refresh_after seconds old, and built again from scratch every
+    rebuild_after seconds, which bounds how long changes to existing rows
+    (items borrowed, sold or removed) take to show up.
+    """
+    def __init__(self, refresh_after=10, rebuild_after=600,
+                 clock=time.monotonic):
+        self.refresh_after = refresh_after
+        self.rebuild_after = rebuild_after
+        self.clock = clock
+        self.model = None
+        self.built_at = self.refreshed_at = None
+        self.lock = threading.Lock()
+        self.builds = 0
+        self.refreshes = 0
+
+    def get(self, conn):
+        """
+        Returns the model, loading or refreshing it on conn if needed.
+        """
+        with self.lock:
+            now = self.clock()
+            if self.model is None or now - self.built_at >= self.rebuild_after:
+                model = Model()
+                model.load(conn)
+                self.model = model
+                self.built_at = self.refreshed_at = now
+                self.builds += 1
+            elif now - self.refreshed_at >= self.refresh_after:
+                self.model.load(conn)
+                self.refreshed_at = now
+                self.refreshes += 1
+            return self.model
+
+    def invalidate(self):
+        """
+        Makes the next get build the model again.
+        """
+        with self.lock:
+            self.model = None
+
+    def stats(self):
+        with self.lock:
+            return {'items': len(self.model) if self.model else 0,
+                    'builds': self.builds, 'refreshes': self.refreshes}
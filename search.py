@@ -0,0 +1,161 @@
+"""
+Faceted search over the clothes being sold in stores (store_closet joined
+with clothes). Any combination of facets can be filtered on at once, and
+every search is answered with two queries: one for the first matches,
+and one that counts the matches for each value of each facet with GROUP
+BY, so that only the counts are sent back however many items match.
+Each facet is counted with every filter but its own, so its counts say
+how many items picking another value of it would find.
+
+Only the predicates that are actually used go into the queries, so MySQL
+can pick the composite index that fits the combination (see the search
+indexes in setup-closetly.sql). The query text for each combination is
+registered with statements.py and so is prepared once per connection.
+"""
+from collections import Counter
+
+import statements
+
+# Facets that are filtered on by exact value (or a list of values) and
+# counted in the results, with the column each one comes from
+FACETS = {
+    'store_name': 's.store_name',
+    'clothing_type': 'c.clothing_type',
+    'size': 'c.size',
+    'gender': 'c.gender',
+    'color': 'c.color',
+    'brand': 'c.brand',
+    'aesthetic': 'c.aesthetic',
+}
+
+# Facets that are filtered on by range, as min_<name> and max_<name>
+RANGES = {
+    'price': 's.price',
+    'discount': 's.discount',
+}
+
+COLUMNS = ['clothing_id', 'store_name', 'price', 'discount', 'clothing_type',
+           'size', 'gender', 'color', 'brand', 'description', 'image_url',
+           'aesthetic']
+
+SELECT = """SELECT s.clothing_id, s.store_name, s.price, s.discount,
+           c.clothing_type, c.size, c.gender, c.color, c.brand,
+           c.description, c.image_url, c.aesthetic"""
+
+FROM = """
+           FROM store_closet AS s
+           JOIN clothes AS c ON c.clothing_id = s.clothing_id"""
+
+
+def where(predicates):
+    """
+    Returns the FROM and WHERE clauses for the given (facet, predicate,
+    parameters) triples, and the parameters they take.
+    """
+    sql = FROM
+    if predicates:
+        sql += '\n           WHERE ' + '\n             AND '.join(
+            predicate for _, predicate, _ in predicates)
+    return sql, [value for _, _, values in predicates for value in values]
+
+
+def plan(filters):
+    """
+    Returns (statement name, count statement name, parameters, count
+    parameters) for a search with the given filters, registering the
+    statements if this combination of filters has not been seen before.
+    filters maps facet names to a value or a list of values, and min_/max_
+    range names to a bound. Filters that are None or empty are left out.
+    See row_params for the parameters the search statement takes.
+    """
+    # (facet, predicate, parameters), with None for the facet of a range
+    predicates = []
+    signature = []
+    for facet, column in FACETS.items():
+        value = filters.get(facet)
+        if value is None or value == '' or value == []:
+            continue
+        if isinstance(value, (list, tuple)):
+            predicates.append((facet, column + ' IN (' +
+                               ', '.join(['%s'] * len(value)) + ')',
+                               list(value)))
+            signature.append(facet + str(len(value)))
+        else:
+            predicates.append((facet, column + ' = %s', [value]))
+            signature.append(facet)
+    order = 's.clothing_id'
+    for name, column in RANGES.items():
+        for bound, op in (('min_', '>='), ('max_', '<=')):
+            value = filters.get(bound + name)
+            if value is None or value == '':
+                continue
+            predicates.append((None, column + ' ' + op + ' %s', [value]))
+            signature.append(bound + name)
+            # range searches list the cheapest or biggest discounts first,
+            # like the old filter_store_by_price/discount did
+            if order == 's.clothing_id':
+                order = column
+    matching, params = where(predicates)
+    sql = (SELECT + matching + '\n           ORDER BY ' + order +
+           ', s.clothing_id LIMIT %s')
+    name = statements.register('search:' + ','.join(signature), sql,
+                               read=True)
+    # the matches per value of every facet, as (facet, value, matches),
+    # each counted without the facet's own filter
+    counts, count_params = [], []
+    for facet, column in FACETS.items():
+        clauses, values = where([p for p in predicates if p[0] != facet])
+        counts.append("""SELECT '{}' AS facet, {} AS value,
+           COUNT(*) AS matches{}
+           GROUP BY {}""".format(facet, column, clauses, column))
+        count_params.extend(values)
+    # a facet that is not filtered on counts each match once, which gives
+    # the total (see tally); if all of them are, it is counted on its own
+    if {p[0] for p in predicates} >= set(FACETS):
+        counts.append('SELECT NULL, NULL, COUNT(*)' + matching)
+        count_params.extend(params)
+    counts_name = statements.register(
+        'search-counts:' + ','.join(signature),
+        '\n           UNION ALL\n'.join(counts), read=True)
+    return name, counts_name, tuple(params), tuple(count_params)
+
+
+def row_params(params, limit):
+    """
+    Returns the parameters of a search statement from plan's parameters.
+    """
+    return params + (limit,)
+
+
+def tally(count_rows):
+    """
+    Turns the rows of a count statement into (counts, total): a Counter
+    of matches per value for every facet, and the number of matches.
+    """
+    counts = {facet: Counter() for facet in FACETS}
+    total = None
+    for facet, value, matches in count_rows:
+        if facet is None:
+            total = int(matches)
+        else:
+            counts[facet][value] = int(matches)
+    if total is None:
+        # every match has one value of each facet, so the counts of a
+        # facet that is not filtered on add up to the total, and those of
+        # a filtered one (which also count items with its other values)
+        # to at least that
+        total = min(sum(values.values()) for values in counts.values())
+    return counts, total
+
+
+def search(conn, filters, limit=50):
+    """
+    Runs a search and returns (rows, counts, total): the first limit
+    matching rows (in COLUMNS order), a Counter of matches per value for
+    every facet, and the total number of matches.
+    """
+    name, counts_name, params, count_params = plan(filters)
+    rows = statements.fetchall(conn, name, row_params(params, limit))
+    counts, total = tally(statements.fetchall(conn, counts_name,
+                                              count_params))
+    return rows, counts, total
@@ -0,0 +1,734 @@
+"""
+HTTP/JSON service for Closetly. Serves the same operations as the
+command-line app to many users at once from a single asyncio process,
+with a pool of async MySQL connections per database account. The SQL
+comes from statements.py and search.py, so the app and the service
+always run the same queries.
+
+    $ python3 server.py --port 8080
+    $ curl -u ektapatel:<password> localhost:8080/closet
+
+Every request is authenticated as a Closetly user, with HTTP basic auth
+or with a session token from POST /sessions (Authorization: Bearer
+<token>, see sessions.py), and runs on the database account for that
+user's role (see DB_ACCOUNTS in statements.py). Endpoints:
+
+    POST /sessions        {"seconds"}
+                          start a session (with basic auth only),
+                          returns its token
+    DELETE /sessions      end the session of the token sent
+    GET  /closet                          personal closet
+    GET  /collab?after=&limit=            collaborative closet, a page
+    GET  /collab/{user_id}                one user's shared clothes
+    POST /borrow          {"clothing_id"}
+    POST /return          {"clothing_id"}
+                          returns it, lending it to the next waiter if any
+    GET  /borrowed                        items the user is borrowing
+    POST /waitlist        {"clothing_id"}
+                          borrows it if it is free, else waits for it
+    GET  /waitlist                        items the user is waiting for
+    DELETE /waitlist/{clothing_id}        stop waiting for an item
+    POST /wears           {"clothing_ids", "times"}
+                          buffered, written in batches (see wears.py)
+    GET  /stores/{store}/inventory?after=&limit=
+    GET  /stores/{store}/search?type=&size=&min_price=&...
+    GET  /search?q=&limit=                keyword search
+    POST /available       {"pieces": [[type, size, color], ...], "limit"}
+                          where matching items are, per piece
+    POST /outfits         {"clothing_ids", "description", "vibe"}
+    GET  /outfits/{outfit_id}
+    GET  /outfits/{outfit_id}/total       total price of its store pieces
+    GET  /stores/{store}/stats            item count, average price/discount
+    POST /stores/{store}/markdown
+                          {"discount", "clothing_type", "brand",
+                           "clothing_ids"}
+    GET  /metrics?format=prometheus|json
+                          query and request latencies (see metrics.py),
+                          no login needed
+"""
+import argparse
+import asyncio
+import base64
+import functools
+import hashlib
+import json
+import time
+
+import aiomysql
+from aiohttp import web
+
+import search
+import sessions
+import statements
+from statements import DB_ACCOUNTS
+import metrics
+from cache import InventoryCache
+from metrics import METRICS
+from wears import FLUSH_ROWS, WearBuffer
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 1000
+
+# Successful basic auth logins are remembered for this many seconds (can
+# be changed with --login-cache-seconds), so that a client sending the
+# same credentials with every request does not cost a password check on
+# the appadmin pool each time. At most LOGIN_CACHE_SIZE are kept.
+LOGIN_CACHE_SECONDS = 30
+LOGIN_CACHE_SIZE = 10000
+
+# Roles allowed to call each handler, matching the app's menus. appadmin
+# can call everything.
+SHOPPERS = ('personal', 'stylist')
+ANYONE = ('personal', 'storeowner', 'stylist')
+
+dumps = functools.partial(json.dumps, default=str)
+
+
+def json_response(data):
+    return web.json_response(data, dumps=dumps)
+
+
+def records(cursor, rows):
+    """
+    Turns rows into dictionaries keyed by the cursor's column names.
+    """
+    names = [column[0] for column in cursor.description]
+    return [dict(zip(names, row)) for row in rows]
+
+
+def int_arg(values, key, default=None):
+    """
+    Returns an integer argument from a query string or JSON body, raising
+    400 Bad Request if it is missing or not a number.
+    """
+    value = values.get(key, default)
+    if value is None:
+        raise web.HTTPBadRequest(text='missing ' + key)
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise web.HTTPBadRequest(text=key + ' must be an integer')
+
+
+def id_list(body, key):
+    """
+    Returns a list of IDs from a JSON body, raising 400 Bad Request if it
+    is missing or not a list of integers.
+    """
+    values = body.get(key)
+    if not isinstance(values, list):
+        raise web.HTTPBadRequest(text=key + ' must be a list of IDs')
+    try:
+        return [int(value) for value in values]
+    except (TypeError, ValueError):
+        raise web.HTTPBadRequest(text=key + ' must be a list of IDs')
+
+
+async def json_body(request):
+    try:
+        body = await request.json()
+    except ValueError:
+        body = None
+    if not isinstance(body, dict):
+        raise web.HTTPBadRequest(text='expected a JSON object')
+    return body
+
+
+async def explain(cursor, name, params):
+    """
+    Returns the EXPLAIN output of the named statement as lines of text,
+    like statements.explain_plan.
+    """
+    sql = statements.STATEMENTS[name]
+    if sql.split(None, 1)[0].upper() not in metrics.EXPLAINABLE:
+        return ['(not explained: not a SELECT, INSERT, UPDATE or DELETE)']
+    try:
+        await cursor.execute('EXPLAIN ' + sql, params)
+        columns = [column[0] for column in cursor.description]
+        return [' | '.join(columns)] + \
+            [' | '.join(str(value) for value in row)
+             for row in await cursor.fetchall()]
+    except aiomysql.Error as err:
+        return ['(not explained: {})'.format(err)]
+
+
+def page_args(request):
+    return (int_arg(request.query, 'after', 0),
+            min(int_arg(request.query, 'limit', PAGE_SIZE), MAX_PAGE_SIZE))
+
+
+class Service:
+    """
+    Connection pools and caches shared by every request.
+    """
+    def __init__(self, host, port, database, min_size, max_size,
+                 wears=None, login_seconds=LOGIN_CACHE_SECONDS):
+        self.host = host
+        self.port = port
+        self.database = database
+        self.min_size = min_size
+        self.max_size = max_size
+        self.pools = {}
+        self.inventory = InventoryCache()
+        self.wears = wears or WearBuffer()
+        self.wear_flusher = None
+        self.login_seconds = login_seconds
+        # SHA-256 of an Authorization header -> ((username, role,
+        # user_id), time.monotonic() it expires at)
+        self.logins = {}
+
+    async def start(self, app):
+        for role, (user, password) in DB_ACCOUNTS.items():
+            self.pools[role] = await aiomysql.create_pool(
+                host=self.host, port=self.port, user=user,
+                password=password, db=self.database,
+                minsize=self.min_size, maxsize=self.max_size,
+                autocommit=False)
+        self.wear_flusher = asyncio.ensure_future(self.flush_wears_often())
+
+    async def stop(self, app):
+        self.wear_flusher.cancel()
+        await self.flush_wears()
+        self.wears.close()
+        for pool in self.pools.values():
+            pool.close()
+            await pool.wait_closed()
+
+    async def fetchall(self, role, name, params=()):
+        async with self.pools[role].acquire() as conn:
+            async with conn.cursor() as cursor:
+                start = time.perf_counter()
+                await cursor.execute(statements.STATEMENTS[name], params)
+                rows = await cursor.fetchall()
+                seconds = time.perf_counter() - start
+                METRICS.record_query(name, seconds, len(rows),
+                                     metrics.rows_bytes(rows))
+                rows = records(cursor, rows)
+                if METRICS.is_slow(seconds):
+                    METRICS.log_slow(name, seconds, params, await explain(
+                        cursor, name, params))
+            await conn.commit()
+        return rows
+
+    async def flush_wears(self):
+        """
+        Writes the buffered wears like wears.flush, on the personal
+        account.
+        """
+        batch = self.wears.take()
+        if not batch:
+            return
+        try:
+            async with self.pools['personal'].acquire() as conn:
+                try:
+                    async with conn.cursor() as cursor:
+                        for i in range(0, len(batch), FLUSH_ROWS):
+                            chunk = json.dumps(batch[i:i + FLUSH_ROWS])
+                            for name in ('record_wears', 'wear_out'):
+                                start = time.perf_counter()
+                                await cursor.execute(
+                                    statements.STATEMENTS[name], (chunk,))
+                                METRICS.record_query(
+                                    name, time.perf_counter() - start)
+                    await conn.commit()
+                except aiomysql.Error:
+                    await conn.rollback()
+                    raise
+        except aiomysql.Error:
+            self.wears.done(batch, ok=False)
+            raise
+        self.wears.done(batch)
+
+    async def flush_wears_often(self):
+        """
+        Flushes the wears whenever a flush is due, so that they are
+        written even when no more come in.
+        """
+        while True:
+            await asyncio.sleep(min(1, self.wears.max_seconds))
+            if self.wears.due():
+                try:
+                    await self.flush_wears()
+                except aiomysql.Error:
+                    # kept in the buffer and tried again later
+                    pass
+
+    async def authenticate(self, request):
+        """
+        Checks the request's basic auth credentials or session token and
+        returns (username, role, user_id), raising 401 Unauthorized if
+        they are missing, wrong or expired. Credentials that were right
+        in the last login_seconds are not checked again.
+        """
+        header = request.headers.get('Authorization', '')
+        scheme, _, encoded = header.partition(' ')
+        if scheme.lower() == 'bearer':
+            return await self.check_token(encoded)
+        # keyed by a hash so that passwords are not kept in memory
+        key = hashlib.sha256(header.encode()).digest()
+        cached = self.logins.get(key)
+        if cached is not None and cached[1] > time.monotonic():
+            return cached[0]
+        try:
+            username, _, password = \
+                base64.b64decode(encoded).decode().partition(':')
+        except ValueError:
+            username = password = ''
+        if scheme.lower() != 'basic' or not username:
+            raise web.HTTPUnauthorized(
+                headers={'WWW-Authenticate': 'Basic realm="closetly"'})
+        async with self.pools['appadmin'].acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(statements.STATEMENTS['login'],
+                                     (password, username, username))
+                _, ok, role, user_id = await cursor.fetchone()
+            await conn.commit()
+        if not ok:
+            raise web.HTTPUnauthorized(
+                headers={'WWW-Authenticate': 'Basic realm="closetly"'})
+        # users without a known role browse as personal users, like in
+        # app.change_connection
+        if role not in DB_ACCOUNTS:
+            role = 'personal'
+        self.remember_login(key, (username, role, user_id))
+        return username, role, user_id
+
+    def remember_login(self, key, identity):
+        """
+        Keeps a successful basic auth login for login_seconds. When the
+        cache is full, expired logins are dropped, and if none have
+        expired it starts over.
+        """
+        if self.login_seconds <= 0:
+            return
+        now = time.monotonic()
+        if len(self.logins) >= LOGIN_CACHE_SIZE:
+            self.logins = {k: v for k, v in self.logins.items()
+                           if v[1] > now}
+            if len(self.logins) >= LOGIN_CACHE_SIZE:
+                self.logins.clear()
+        self.logins[key] = (identity, now + self.login_seconds)
+
+    async def check_token(self, token):
+        """
+        Returns (username, role, user_id) of a session token's session,
+        raising 401 Unauthorized if there is none or it has expired.
+        """
+        async with self.pools['appadmin'].acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(statements.STATEMENTS['check_session'],
+                                     (sessions.token_hash(token),))
+                row = await cursor.fetchone()
+            await conn.commit()
+        if row is None:
+            raise web.HTTPUnauthorized(
+                headers={'WWW-Authenticate': 'Bearer realm="closetly"'})
+        return tuple(row)
+
+    async def start_session(self, username, role, user_id, seconds):
+        """
+        Starts a session like sessions.start and returns its token.
+        """
+        token, hashed = sessions.new_token()
+        async with self.pools['appadmin'].acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(statements.STATEMENTS['prune_sessions'])
+                await cursor.execute(statements.STATEMENTS['start_session'],
+                                     (hashed, username, role, user_id,
+                                      seconds))
+            await conn.commit()
+        return token
+
+
+def route(*roles):
+    """
+    Decorates a handler so that it is only run for authenticated users
+    with one of the given roles, and is called as
+    handler(service, request, username, role, user_id).
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(request):
+            service = request.app['service']
+            username, role, user_id = await service.authenticate(request)
+            if role != 'appadmin' and role not in roles:
+                raise web.HTTPForbidden(text=role + ' users cannot do this')
+            with METRICS.command(handler.__name__):
+                return await handler(service, request, username, role,
+                                     user_id)
+        return wrapper
+    return decorator
+
+
+def check_store(username, role, store_name):
+    # store owners log in with their store's name and can only change
+    # their own store
+    if role != 'appadmin' and username != store_name:
+        raise web.HTTPForbidden(text='not your store')
+
+
+# ----------------------------------------------------------------------
+# Handlers
+# ----------------------------------------------------------------------
+def auth_scheme(request):
+    return request.headers.get('Authorization', '').partition(' ')[0].lower()
+
+
+@route(*ANYONE)
+async def start_session(service, request, username, role, user_id):
+    # a session can only be started with the password, so that a token
+    # cannot be used to keep getting new ones
+    if auth_scheme(request) != 'basic':
+        raise web.HTTPBadRequest(text='log in with a password to start ' +
+                                 'a session')
+    body = await json_body(request) if request.body_exists else {}
+    seconds = int_arg(body, 'seconds', sessions.SESSION_SECONDS)
+    if not 1 <= seconds <= sessions.SESSION_SECONDS:
+        raise web.HTTPBadRequest(text='seconds must be between 1 and ' +
+                                 str(sessions.SESSION_SECONDS))
+    token = await service.start_session(username, role, user_id, seconds)
+    return json_response({'token': token, 'expires_in': seconds})
+
+
+@route(*ANYONE)
+async def end_session(service, request, username, role, user_id):
+    if auth_scheme(request) != 'bearer':
+        raise web.HTTPBadRequest(text='no session token given')
+    token = request.headers['Authorization'].partition(' ')[2]
+    async with service.pools['appadmin'].acquire() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute(statements.STATEMENTS['end_session'],
+                                 (sessions.token_hash(token),))
+        await conn.commit()
+    return json_response({'ended': True})
+
+
+@route('personal')
+async def personal_closet(service, request, username, role, user_id):
+    # so that num_wears includes the wears logged so far
+    await service.flush_wears()
+    rows = await service.fetchall(role, 'show_personal_clothes', (username,))
+    return json_response({'rows': rows})
+
+
+@route(*SHOPPERS)
+async def collab_closet(service, request, username, role, user_id):
+    rows = await service.fetchall(role, 'show_collaborative_clothes',
+                                  page_args(request))
+    return json_response({'rows': rows})
+
+
+@route(*SHOPPERS)
+async def user_collab(service, request, username, role, user_id):
+    rows = await service.fetchall(role, 'show_user_in_collab',
+                                  (int_arg(request.match_info, 'user_id'),))
+    return json_response({'rows': rows})
+
+
+@route(*SHOPPERS)
+async def available(service, request, username, role, user_id):
+    body = await json_body(request)
+    pieces = body.get('pieces')
+    if not isinstance(pieces, list) or not all(
+            isinstance(piece, list) and 1 <= len(piece) <= 3 and piece[0]
+            for piece in pieces):
+        raise web.HTTPBadRequest(text='pieces must be a list of ' +
+                                 '[clothing_type, size, color]')
+    criteria = [(piece + [None, None])[:3] for piece in pieces]
+    rows = await service.fetchall(role, 'find_available',
+                                  (json.dumps(criteria),
+                                   min(int_arg(body, 'limit', 20),
+                                       MAX_PAGE_SIZE)))
+    found = [[] for _ in criteria]
+    for row in rows:
+        found[row.pop('criterion') - 1].append(row)
+    return json_response({'pieces': [
+        {'clothing_type': criterion[0], 'size': criterion[1],
+         'color': criterion[2], 'rows': items}
+        for criterion, items in zip(criteria, found)]})
+
+
+@route('personal')
+async def borrow(service, request, username, role, user_id):
+    body = await json_body(request)
+    rows = await service.fetchall(role, 'borrow_item',
+                                  (user_id, int_arg(body, 'clothing_id')))
+    return json_response({'borrowed': list(rows[0].values())[0] == 1})
+
+
+@route('personal')
+async def return_item(service, request, username, role, user_id):
+    body = await json_body(request)
+    rows = await service.fetchall(role, 'return_item',
+                                  (user_id, int_arg(body, 'clothing_id')))
+    lent_to = list(rows[0].values())[0]
+    if lent_to < 0:
+        raise web.HTTPBadRequest(text='you are not borrowing this item')
+    return json_response({'returned': True, 'lent_to': lent_to or None})
+
+
+@route('personal')
+async def borrowed(service, request, username, role, user_id):
+    rows = await service.fetchall(role, 'show_borrowed', (user_id,))
+    return json_response({'rows': rows})
+
+
+@route('personal')
+async def join_waitlist(service, request, username, role, user_id):
+    body = await json_body(request)
+    rows = await service.fetchall(role, 'join_waitlist',
+                                  (user_id, int_arg(body, 'clothing_id')))
+    place = list(rows[0].values())[0]
+    if place < 0:
+        raise web.HTTPBadRequest(text='you cannot wait for this item')
+    # place is None if the item was free and got borrowed right away
+    return json_response({'borrowed': place == 0, 'place': place or None})
+
+
+@route('personal')
+async def waitlist(service, request, username, role, user_id):
+    rows = await service.fetchall(role, 'show_waitlist', (user_id,))
+    return json_response({'rows': rows})
+
+
+@route('personal')
+async def leave_waitlist(service, request, username, role, user_id):
+    params = (user_id, int_arg(request.match_info, 'clothing_id'))
+    async with service.pools[role].acquire() as conn:
+        async with conn.cursor() as cursor:
+            count = await cursor.execute(
+                statements.STATEMENTS['leave_waitlist'], params)
+        await conn.commit()
+    return json_response({'left': count == 1})
+
+
+@route('personal')
+async def wear(service, request, username, role, user_id):
+    if user_id is None:
+        raise web.HTTPBadRequest(text='your account has no closet')
+    body = await json_body(request)
+    clothing_ids = id_list(body, 'clothing_ids')
+    times = int_arg(body, 'times', 1)
+    if times < 1:
+        raise web.HTTPBadRequest(text='times must be at least 1')
+    due = False
+    for clothing_id in clothing_ids:
+        due = service.wears.record(user_id, clothing_id, times) or due
+    if due:
+        try:
+            await service.flush_wears()
+        except aiomysql.Error:
+            # the wears stay buffered and are written with the next ones
+            pass
+    return json_response({'recorded': len(clothing_ids)})
+
+
+@route(*ANYONE)
+async def store_inventory(service, request, username, role, user_id):
+    store_name = request.match_info['store']
+    params = (store_name,) + page_args(request)
+    key = ('show_store_inventory', params)
+    rows = service.inventory.get(store_name, key)
+    if rows is None:
+        rows = await service.fetchall(role, 'show_store_inventory', params)
+        service.inventory.put(store_name, key, rows)
+    return json_response({'rows': rows})
+
+
+@route(*ANYONE)
+async def store_search(service, request, username, role, user_id):
+    store_name = request.match_info['store']
+    filters = {'store_name': store_name}
+    for key, value in request.query.items():
+        key = {'type': 'clothing_type'}.get(key, key)
+        if key in search.FACETS or (key[:4] in ('min_', 'max_') and
+                                    key[4:] in search.RANGES):
+            filters[key] = value
+    limit = min(int_arg(request.query, 'limit', PAGE_SIZE), MAX_PAGE_SIZE)
+    name, counts_name, params, count_params = search.plan(filters)
+    key = (name, params, limit)
+    result = service.inventory.get(store_name, key)
+    if result is None:
+        rows = await service.fetchall(role, name,
+                                      search.row_params(params, limit))
+        count_rows = await service.fetchall(role, counts_name,
+                                            count_params)
+        counts, total = search.tally(tuple(row.values())
+                                     for row in count_rows)
+        result = {'rows': rows,
+                  'total': total,
+                  'counts': {facet: dict(values)
+                             for facet, values in counts.items()}}
+        service.inventory.put(store_name, key, result)
+    return json_response(result)
+
+
+@route(*SHOPPERS)
+async def keyword_search(service, request, username, role, user_id):
+    keywords = request.query.get('q', '')
+    limit = min(int_arg(request.query, 'limit', PAGE_SIZE), MAX_PAGE_SIZE)
+    rows = await service.fetchall(role, 'keyword_search',
+                                  (keywords, keywords, limit))
+    return json_response({'rows': rows})
+
+
+@route(*SHOPPERS)
+async def create_outfit(service, request, username, role, user_id):
+    body = await json_body(request)
+    clothing_ids = id_list(body, 'clothing_ids')
+    if not clothing_ids:
+        raise web.HTTPBadRequest(text='an outfit needs at least one piece')
+    async with service.pools[role].acquire() as conn:
+        try:
+            async with conn.cursor() as cursor:
+                # same as app.write_outfits: the locked MAX(outfit_id)
+                # keeps concurrent outfits from getting the same ID
+                await cursor.execute(statements.STATEMENTS['next_outfit_id'])
+                (outfit_id,) = await cursor.fetchone()
+                await cursor.executemany(
+                    statements.STATEMENTS['add_outfit_items'],
+                    [(outfit_id, clothing_id, body.get('description', ''),
+                      body.get('vibe', '')) for clothing_id in clothing_ids])
+            await conn.commit()
+        except aiomysql.Error:
+            await conn.rollback()
+            raise web.HTTPBadRequest(text='outfit could not be saved')
+    return json_response({'outfit_id': outfit_id})
+
+
+@route(*SHOPPERS)
+async def show_outfit(service, request, username, role, user_id):
+    outfit_id = int_arg(request.match_info, 'outfit_id')
+    rows = await service.fetchall(role, 'show_outfits',
+                                  (outfit_id, outfit_id))
+    if not rows:
+        raise web.HTTPNotFound()
+    return json_response({'rows': rows})
+
+
+@route(*SHOPPERS)
+async def outfit_total(service, request, username, role, user_id):
+    rows = await service.fetchall(
+        role, 'outfit_total', (int_arg(request.match_info, 'outfit_id'),))
+    if not rows:
+        raise web.HTTPNotFound()
+    return json_response(rows[0])
+
+
+@route(*ANYONE)
+async def store_stats(service, request, username, role, user_id):
+    rows = await service.fetchall(role, 'store_stats',
+                                  (request.match_info['store'],))
+    if not rows:
+        raise web.HTTPNotFound()
+    return json_response(rows[0])
+
+
+@route('storeowner')
+async def markdown(service, request, username, role, user_id):
+    store_name = request.match_info['store']
+    check_store(username, role, store_name)
+    body = await json_body(request)
+    try:
+        discount = float(body['discount'])
+    except (KeyError, TypeError, ValueError):
+        raise web.HTTPBadRequest(text='discount must be a number')
+    if not 0 <= discount <= 100:
+        raise web.HTTPBadRequest(text='discount must be between 0 and 100')
+    if body.get('clothing_ids') is not None:
+        name = 'markdown_items'
+        params = (discount, discount, store_name,
+                  json.dumps(id_list(body, 'clothing_ids')))
+    else:
+        name = 'markdown'
+        clothing_type = body.get('clothing_type')
+        brand = body.get('brand')
+        params = (discount, discount, store_name, clothing_type,
+                  clothing_type, brand, brand)
+    async with service.pools[role].acquire() as conn:
+        async with conn.cursor() as cursor:
+            count = await cursor.execute(statements.STATEMENTS[name], params)
+        await conn.commit()
+    service.inventory.invalidate(store_name)
+    return json_response({'repriced': count})
+
+
+async def show_metrics(request):
+    if request.query.get('format') == 'json':
+        return web.json_response(METRICS.to_json())
+    return web.Response(text=METRICS.to_prometheus(),
+                        content_type='text/plain')
+
+
+def make_app(service):
+    app = web.Application()
+    app['service'] = service
+    app.on_startup.append(service.start)
+    app.on_cleanup.append(service.stop)
+    app.add_routes([
+        web.post('/sessions', start_session),
+        web.delete('/sessions', end_session),
+        web.get('/closet', personal_closet),
+        web.get('/collab', collab_closet),
+        web.get('/collab/{user_id}', user_collab),
+        web.post('/borrow', borrow),
+        web.post('/return', return_item),
+        web.get('/borrowed', borrowed),
+        web.post('/waitlist', join_waitlist),
+        web.get('/waitlist', waitlist),
+        web.delete('/waitlist/{clothing_id}', leave_waitlist),
+        web.post('/wears', wear),
+        web.get('/stores/{store}/inventory', store_inventory),
+        web.get('/stores/{store}/search', store_search),
+        web.get('/search', keyword_search),
+        web.post('/available', available),
+        web.post('/outfits', create_outfit),
+        web.get('/outfits/{outfit_id}', show_outfit),
+        web.get('/outfits/{outfit_id}/total', outfit_total),
+        web.get('/stores/{store}/stats', store_stats),
+        web.post('/stores/{store}/markdown', markdown),
+        web.get('/metrics', show_metrics),
+    ])
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Closetly HTTP/JSON service')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--db-host', default='localhost')
+    parser.add_argument('--db-port', type=int, default=3306)
+    parser.add_argument('--database', default='closetly')
+    parser.add_argument('--pool-min', type=int, default=1,
+                        help='connections kept open per database account')
+    parser.add_argument('--pool-max', type=int, default=20,
+                        help='most connections per database account')
+    parser.add_argument('--slow-query-ms', type=float,
+                        help='log queries slower than this with their ' +
+                             'EXPLAIN output to stderr')
+    parser.add_argument('--wear-flush-events', type=int, default=1000,
+                        help='write buffered wears once this many have ' +
+                             'been logged')
+    parser.add_argument('--wear-flush-seconds', type=float, default=5,
+                        help='or once the oldest is this many seconds old')
+    parser.add_argument('--wear-journal', metavar='FILE',
+                        help='also append wears to FILE until they are ' +
+                             'written, and write any left in it')
+    parser.add_argument('--login-cache-seconds', type=float,
+                        default=LOGIN_CACHE_SECONDS,
+                        help='accept basic auth credentials that were ' +
+                             'right this many seconds ago without ' +
+                             'checking them again; 0 checks every request')
+    args = parser.parse_args()
+    METRICS.slow_query_ms = args.slow_query_ms
+    service = Service(args.db_host, args.db_port, args.database,
+                      args.pool_min, args.pool_max,
+                      WearBuffer(args.wear_flush_events,
+                                 args.wear_flush_seconds,
+                                 args.wear_journal),
+                      args.login_cache_seconds)
+    web.run_app(make_app(service), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
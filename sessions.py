@@ -0,0 +1,75 @@
+"""
+Session tokens for scripted and API clients. Checking a password means
+hashing it with its salt every time (the login statement in
+statements.py); a client that makes many requests can instead log in
+once, get a random token that expires after SESSION_SECONDS, and send
+the token with every later request. Checking a token is a single primary
+key lookup in the sessions table (setup-sessions.sql), which only keeps
+a SHA-256 hash of each token.
+
+A session keeps the role and user ID the user had when it started, so
+changing a user's role takes effect when they next log in with their
+password.
+"""
+import hashlib
+import secrets
+
+import statements
+
+# How long a token can be used for, in seconds
+SESSION_SECONDS = 12 * 60 * 60
+
+# Random bytes per token
+TOKEN_BYTES = 32
+
+
+def token_hash(token):
+    """
+    Returns the hash of a token stored in the sessions table.
+    """
+    return hashlib.sha256(token.encode()).digest()
+
+
+def new_token():
+    """
+    Returns a new random token and its hash.
+    """
+    token = secrets.token_urlsafe(TOKEN_BYTES)
+    return token, token_hash(token)
+
+
+def start(conn, username, role, user_id, seconds=SESSION_SECONDS):
+    """
+    Starts a session for a user who has just logged in with their
+    password and returns its token. Expired sessions are removed at the
+    same time.
+    """
+    token, hashed = new_token()
+    try:
+        statements.execute(conn, 'prune_sessions')
+        statements.execute(conn, 'start_session',
+                           (hashed, username, role, user_id, seconds))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return token
+
+
+def check(conn, token):
+    """
+    Returns (username, role, user_id) of the session a token belongs to,
+    or None if there is no such session or it has expired.
+    """
+    return statements.fetchone(conn, 'check_session', (token_hash(token),))
+
+
+def end(conn, token):
+    """
+    Ends the session a token belongs to, so that it can no longer be used.
+    Returns whether there was one.
+    """
+    ended = statements.execute(conn, 'end_session',
+                               (token_hash(token),)).rowcount == 1
+    conn.commit()
+    return ended
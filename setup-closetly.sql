@@ -81,6 +81,9 @@ CREATE TABLE collab_closet (
     -- Each piece of clothing in the collaborative closet is identified
     -- by its original owner & clothing ID 
     PRIMARY KEY (user_id, clothing_id),
+    -- An item can only be shared once, so there is a single row (and a
+    -- single is_available flag) to borrow it through
+    UNIQUE (clothing_id),
     -- All clothing in the collaborative closet must have been assigned
     -- a clothing_id upon entry and exist in a personal closet, 
     -- so must cascade
@@ -105,6 +108,9 @@ CREATE TABLE store_closet (
     -- cost of piece in USD, e.g. $52.10
     price             NUMERIC(10, 2) NOT NULL,
     discount          DECIMAL(4, 1) NOT NULL, -- percent discount, e.g. 35.2% off
+    -- price before any discount, kept so that markdowns can be applied
+    -- and reverted without working backwards from the discounted price
+    original_price    NUMERIC(10, 2) NOT NULL,
     PRIMARY KEY (store_name, clothing_id),
     -- Only existing clothing items can be part of a store's inventory, so
     -- must cascade
@@ -133,3 +139,25 @@ CREATE TABLE styled_outfits (
 
 CREATE INDEX idx_borrower 
     ON collab_closet (current_borrower);
+
+-- Logging in looks users up by username (see login in statements.py)
+CREATE INDEX idx_user_username
+    ON user (username);
+
+-- Indexes for searching store inventories by any combination of
+-- facets (see search.py). A store's items by price or discount range:
+CREATE INDEX idx_store_price
+    ON store_closet (store_name, price);
+CREATE INDEX idx_store_discount
+    ON store_closet (store_name, discount);
+-- Clothes by type, size and color (most specific searches) or by brand:
+CREATE INDEX idx_clothes_type_size_color
+    ON clothes (clothing_type, size, color);
+CREATE INDEX idx_clothes_brand_type
+    ON clothes (brand, clothing_type);
+
+-- Keyword search over the free-text columns of clothes (see keyword_search
+-- in statements.py). InnoDB keeps FULLTEXT indexes up to date as rows are
+-- inserted and updated, so new items are searchable once committed.
+CREATE FULLTEXT INDEX ft_clothes_text
+    ON clothes (description, brand, aesthetic);
@@ -0,0 +1,214 @@
+-- Change log for the incremental analytics export (see warehouse.py).
+-- Triggers record the key of every row inserted, updated or deleted in
+-- the exported tables, with the time of the change, so that an export
+-- only has to read the rows changed since the last one. Run after
+-- setup-rollups.sql.
+
+-- Clean up old tables, procedures, and triggers
+DROP TRIGGER IF EXISTS clothes_logged_insert;
+DROP TRIGGER IF EXISTS clothes_logged_update;
+DROP TRIGGER IF EXISTS clothes_logged_delete;
+DROP TRIGGER IF EXISTS personal_logged_insert;
+DROP TRIGGER IF EXISTS personal_logged_update;
+DROP TRIGGER IF EXISTS personal_logged_delete;
+DROP TRIGGER IF EXISTS collab_logged_insert;
+DROP TRIGGER IF EXISTS collab_logged_update;
+DROP TRIGGER IF EXISTS collab_logged_delete;
+DROP TRIGGER IF EXISTS store_logged_insert;
+DROP TRIGGER IF EXISTS store_logged_update;
+DROP TRIGGER IF EXISTS store_logged_delete;
+DROP TRIGGER IF EXISTS outfit_logged_insert;
+DROP TRIGGER IF EXISTS outfit_logged_update;
+DROP TRIGGER IF EXISTS outfit_logged_delete;
+DROP TRIGGER IF EXISTS user_logged_delete;
+DROP PROCEDURE IF EXISTS log_change;
+DROP PROCEDURE IF EXISTS log_reload;
+DROP TABLE IF EXISTS export_changes;
+
+-- The last change to each row of the exported tables. A row is
+-- identified by its table and key, with unused key columns left at ''
+-- and 0:
+--   clothes            id1 = clothing_id
+--   personal_closet    id1 = user_id, id2 = clothing_id
+--   collab_closet      id1 = user_id, id2 = clothing_id
+--   store_closet       store_name, id1 = clothing_id
+--   styled_outfits     id1 = outfit_id, id2 = clothing_id
+-- A row with id1 = -1 marks a table as reloaded without logging its rows
+-- (see log_reload), so exports have to read it in full again.
+CREATE TABLE export_changes (
+    table_name      VARCHAR(20),
+    store_name      VARCHAR(100) NOT NULL DEFAULT '',
+    id1             INTEGER NOT NULL,
+    id2             INTEGER NOT NULL DEFAULT 0,
+    changed_at      TIMESTAMP(6) NOT NULL,
+    PRIMARY KEY (table_name, store_name, id1, id2),
+    -- exports read one table's changes in changed_at order
+    INDEX idx_changes_table_time
+        (table_name, changed_at, store_name, id1, id2)
+);
+
+-- Records a change to a row. Setting @skip_change_log = 1 turns logging
+-- off for the session, for bulk loads that call log_reload afterwards.
+DELIMITER !
+CREATE PROCEDURE log_change (tbl VARCHAR(20), store VARCHAR(100),
+    key1 INTEGER, key2 INTEGER)
+BEGIN
+    IF @skip_change_log IS NULL THEN
+        INSERT INTO export_changes (table_name, store_name, id1, id2,
+                                    changed_at)
+            VALUES (tbl, store, key1, key2, NOW(6))
+            ON DUPLICATE KEY UPDATE changed_at = NOW(6);
+    END IF;
+END !
+
+-- Marks a table as changed in bulk (loaded without logging, or
+-- truncated), so the next export reads all of it.
+CREATE PROCEDURE log_reload (tbl VARCHAR(20))
+BEGIN
+    INSERT INTO export_changes (table_name, store_name, id1, id2,
+                                changed_at)
+        VALUES (tbl, '', -1, 0, NOW(6))
+        ON DUPLICATE KEY UPDATE changed_at = NOW(6);
+END !
+DELIMITER ;
+
+-- Triggers on each exported table. Updates log the old key as well as
+-- the new one in case the key changed. Deletes that cascade to other
+-- tables do not fire those tables' triggers, so the rows a delete is
+-- about to cascade to are logged by the delete trigger of the table the
+-- delete starts from.
+DELIMITER !
+CREATE TRIGGER clothes_logged_insert AFTER INSERT ON clothes
+FOR EACH ROW
+    CALL log_change('clothes', '', NEW.clothing_id, 0) !
+
+CREATE TRIGGER clothes_logged_update AFTER UPDATE ON clothes
+FOR EACH ROW
+BEGIN
+    CALL log_change('clothes', '', NEW.clothing_id, 0);
+    IF OLD.clothing_id <> NEW.clothing_id THEN
+        CALL log_change('clothes', '', OLD.clothing_id, 0);
+    END IF;
+END !
+
+CREATE TRIGGER clothes_logged_delete BEFORE DELETE ON clothes
+FOR EACH ROW
+BEGIN
+    IF @skip_change_log IS NULL THEN
+        -- everything that refers to the item goes with it
+        INSERT INTO export_changes (table_name, store_name, id1, id2,
+                                    changed_at)
+            SELECT 'personal_closet', '', user_id, clothing_id, NOW(6)
+                FROM personal_closet WHERE clothing_id = OLD.clothing_id
+            UNION ALL
+            SELECT 'collab_closet', '', user_id, clothing_id, NOW(6)
+                FROM collab_closet WHERE clothing_id = OLD.clothing_id
+            UNION ALL
+            SELECT 'store_closet', store_name, clothing_id, 0, NOW(6)
+                FROM store_closet WHERE clothing_id = OLD.clothing_id
+            UNION ALL
+            SELECT 'styled_outfits', '', outfit_id, clothing_id, NOW(6)
+                FROM styled_outfits WHERE clothing_id = OLD.clothing_id
+            ON DUPLICATE KEY UPDATE changed_at = NOW(6);
+    END IF;
+    CALL log_change('clothes', '', OLD.clothing_id, 0);
+END !
+
+CREATE TRIGGER personal_logged_insert AFTER INSERT ON personal_closet
+FOR EACH ROW
+    CALL log_change('personal_closet', '', NEW.user_id, NEW.clothing_id) !
+
+CREATE TRIGGER personal_logged_update AFTER UPDATE ON personal_closet
+FOR EACH ROW
+BEGIN
+    CALL log_change('personal_closet', '', NEW.user_id, NEW.clothing_id);
+    IF OLD.user_id <> NEW.user_id OR OLD.clothing_id <> NEW.clothing_id THEN
+        CALL log_change('personal_closet', '', OLD.user_id,
+                        OLD.clothing_id);
+    END IF;
+END !
+
+CREATE TRIGGER personal_logged_delete BEFORE DELETE ON personal_closet
+FOR EACH ROW
+BEGIN
+    IF @skip_change_log IS NULL THEN
+        -- the item leaves the collaborative closet with it
+        INSERT INTO export_changes (table_name, store_name, id1, id2,
+                                    changed_at)
+            SELECT 'collab_closet', '', user_id, clothing_id, NOW(6)
+                FROM collab_closet WHERE clothing_id = OLD.clothing_id
+            ON DUPLICATE KEY UPDATE changed_at = NOW(6);
+    END IF;
+    CALL log_change('personal_closet', '', OLD.user_id, OLD.clothing_id);
+END !
+
+CREATE TRIGGER collab_logged_insert AFTER INSERT ON collab_closet
+FOR EACH ROW
+    CALL log_change('collab_closet', '', NEW.user_id, NEW.clothing_id) !
+
+CREATE TRIGGER collab_logged_update AFTER UPDATE ON collab_closet
+FOR EACH ROW
+BEGIN
+    CALL log_change('collab_closet', '', NEW.user_id, NEW.clothing_id);
+    IF OLD.user_id <> NEW.user_id OR OLD.clothing_id <> NEW.clothing_id THEN
+        CALL log_change('collab_closet', '', OLD.user_id, OLD.clothing_id);
+    END IF;
+END !
+
+CREATE TRIGGER collab_logged_delete AFTER DELETE ON collab_closet
+FOR EACH ROW
+    CALL log_change('collab_closet', '', OLD.user_id, OLD.clothing_id) !
+
+CREATE TRIGGER store_logged_insert AFTER INSERT ON store_closet
+FOR EACH ROW
+    CALL log_change('store_closet', NEW.store_name, NEW.clothing_id, 0) !
+
+CREATE TRIGGER store_logged_update AFTER UPDATE ON store_closet
+FOR EACH ROW
+BEGIN
+    CALL log_change('store_closet', NEW.store_name, NEW.clothing_id, 0);
+    IF OLD.store_name <> NEW.store_name OR
+       OLD.clothing_id <> NEW.clothing_id THEN
+        CALL log_change('store_closet', OLD.store_name, OLD.clothing_id, 0);
+    END IF;
+END !
+
+CREATE TRIGGER store_logged_delete AFTER DELETE ON store_closet
+FOR EACH ROW
+    CALL log_change('store_closet', OLD.store_name, OLD.clothing_id, 0) !
+
+CREATE TRIGGER outfit_logged_insert AFTER INSERT ON styled_outfits
+FOR EACH ROW
+    CALL log_change('styled_outfits', '', NEW.outfit_id, NEW.clothing_id) !
+
+CREATE TRIGGER outfit_logged_update AFTER UPDATE ON styled_outfits
+FOR EACH ROW
+BEGIN
+    CALL log_change('styled_outfits', '', NEW.outfit_id, NEW.clothing_id);
+    IF OLD.outfit_id <> NEW.outfit_id OR
+       OLD.clothing_id <> NEW.clothing_id THEN
+        CALL log_change('styled_outfits', '', OLD.outfit_id,
+                        OLD.clothing_id);
+    END IF;
+END !
+
+CREATE TRIGGER outfit_logged_delete AFTER DELETE ON styled_outfits
+FOR EACH ROW
+    CALL log_change('styled_outfits', '', OLD.outfit_id, OLD.clothing_id) !
+
+-- users are not exported, but deleting one cascades to their closets
+CREATE TRIGGER user_logged_delete BEFORE DELETE ON user
+FOR EACH ROW
+BEGIN
+    IF @skip_change_log IS NULL THEN
+        INSERT INTO export_changes (table_name, store_name, id1, id2,
+                                    changed_at)
+            SELECT 'personal_closet', '', user_id, clothing_id, NOW(6)
+                FROM personal_closet WHERE user_id = OLD.user_id
+            UNION ALL
+            SELECT 'collab_closet', '', user_id, clothing_id, NOW(6)
+                FROM collab_closet WHERE user_id = OLD.user_id
+            ON DUPLICATE KEY UPDATE changed_at = NOW(6);
+    END IF;
+END !
+DELIMITER ;
@@ -0,0 +1,179 @@
+-- Summary tables for outfit prices and store statistics, kept up to date
+-- by triggers so that reading them never scans store_closet or
+-- styled_outfits. Run after setup-routines.sql (and after loading data;
+-- the tables are filled from the current data at the end of this file).
+
+-- Clean up old tables, procedures, and triggers
+DROP TRIGGER IF EXISTS store_item_added;
+DROP TRIGGER IF EXISTS store_item_changed;
+DROP TRIGGER IF EXISTS store_item_removed;
+DROP TRIGGER IF EXISTS outfit_piece_added;
+DROP TRIGGER IF EXISTS outfit_piece_changed;
+DROP TRIGGER IF EXISTS outfit_piece_removed;
+DROP PROCEDURE IF EXISTS rollup_store_item;
+DROP PROCEDURE IF EXISTS rollup_piece_price;
+DROP PROCEDURE IF EXISTS rollup_outfit_piece;
+DROP PROCEDURE IF EXISTS refresh_rollups;
+DROP TABLE IF EXISTS outfit_totals;
+DROP TABLE IF EXISTS store_stats;
+
+-- Total price of each styled outfit, summed over the store listings of its
+-- pieces (the same as the outfit total query in queries.sql)
+CREATE TABLE outfit_totals (
+    outfit_id       INTEGER,
+    -- number of pieces in the outfit
+    num_pieces      INTEGER NOT NULL,
+    -- number of store listings of the outfit's pieces
+    num_priced      INTEGER NOT NULL,
+    total_price     NUMERIC(14, 2) NOT NULL,
+    PRIMARY KEY (outfit_id)
+);
+
+-- Sums over each store's inventory, from which averages are worked out
+-- when they are read (see store_stats in statements.py)
+CREATE TABLE store_stats (
+    store_name      VARCHAR(100),
+    num_items       INTEGER NOT NULL,
+    total_price     NUMERIC(14, 2) NOT NULL,
+    total_discount  DECIMAL(14, 1) NOT NULL,
+    PRIMARY KEY (store_name)
+);
+
+-- Adds (sign = 1) or removes (sign = -1) a store_closet row from its
+-- store's statistics.
+DELIMITER !
+CREATE PROCEDURE rollup_store_item (store VARCHAR(100),
+    item_price NUMERIC(10, 2), item_discount DECIMAL(4, 1), sign INTEGER)
+BEGIN
+    INSERT INTO store_stats (store_name, num_items, total_price,
+                             total_discount)
+        VALUES (store, sign, sign * item_price, sign * item_discount)
+        ON DUPLICATE KEY UPDATE
+            num_items = num_items + sign,
+            total_price = total_price + sign * item_price,
+            total_discount = total_discount + sign * item_discount;
+    DELETE FROM store_stats WHERE store_name = store AND num_items = 0;
+END !
+DELIMITER ;
+
+-- Adds (sign = 1) or removes (sign = -1) a store listing of a clothing
+-- item from the totals of every outfit it is part of.
+DELIMITER !
+CREATE PROCEDURE rollup_piece_price (piece_id INTEGER,
+    item_price NUMERIC(10, 2), sign INTEGER)
+BEGIN
+    UPDATE outfit_totals AS t
+        JOIN styled_outfits AS o ON o.outfit_id = t.outfit_id
+        SET t.num_priced = t.num_priced + sign,
+            t.total_price = t.total_price + sign * item_price
+        WHERE o.clothing_id = piece_id;
+END !
+DELIMITER ;
+
+-- Adds (sign = 1) or removes (sign = -1) a piece of an outfit, along with
+-- the prices it is sold for, from the outfit's total.
+DELIMITER !
+CREATE PROCEDURE rollup_outfit_piece (outfit INTEGER, piece_id INTEGER,
+    sign INTEGER)
+BEGIN
+    DECLARE listings INTEGER;
+    DECLARE piece_total NUMERIC(14, 2);
+
+    SELECT COUNT(*), COALESCE(SUM(price), 0) INTO listings, piece_total
+        FROM store_closet WHERE clothing_id = piece_id;
+    INSERT INTO outfit_totals (outfit_id, num_pieces, num_priced,
+                               total_price)
+        VALUES (outfit, sign, sign * listings, sign * piece_total)
+        ON DUPLICATE KEY UPDATE
+            num_pieces = num_pieces + sign,
+            num_priced = num_priced + sign * listings,
+            total_price = total_price + sign * piece_total;
+    DELETE FROM outfit_totals WHERE outfit_id = outfit AND num_pieces = 0;
+END !
+DELIMITER ;
+
+-- Rebuilds both summary tables from scratch. Needed after changes that
+-- do not fire triggers (rows deleted by a foreign key cascade) or that
+-- skip them (bulk loads, see bulk_load.py), and safe to run any time.
+DELIMITER !
+CREATE PROCEDURE refresh_rollups ()
+BEGIN
+    DELETE FROM store_stats;
+    INSERT INTO store_stats (store_name, num_items, total_price,
+                             total_discount)
+        SELECT store_name, COUNT(*), SUM(price), SUM(discount)
+        FROM store_closet
+        GROUP BY store_name;
+    DELETE FROM outfit_totals;
+    INSERT INTO outfit_totals (outfit_id, num_pieces, num_priced,
+                               total_price)
+        SELECT o.outfit_id, COUNT(DISTINCT o.clothing_id),
+               COUNT(s.clothing_id), COALESCE(SUM(s.price), 0)
+        FROM styled_outfits AS o
+        LEFT JOIN store_closet AS s ON s.clothing_id = o.clothing_id
+        GROUP BY o.outfit_id;
+END !
+DELIMITER ;
+
+-- Triggers that apply every change to store_closet and styled_outfits to
+-- the summary tables. Setting @skip_rollups = 1 turns them off for the
+-- session, for loads that call refresh_rollups() afterwards.
+DELIMITER !
+CREATE TRIGGER store_item_added AFTER INSERT
+    ON store_closet FOR EACH ROW
+BEGIN
+    IF @skip_rollups IS NULL THEN
+        CALL rollup_store_item(NEW.store_name, NEW.price, NEW.discount, 1);
+        CALL rollup_piece_price(NEW.clothing_id, NEW.price, 1);
+    END IF;
+END !
+
+CREATE TRIGGER store_item_changed AFTER UPDATE
+    ON store_closet FOR EACH ROW
+BEGIN
+    IF @skip_rollups IS NULL THEN
+        CALL rollup_store_item(OLD.store_name, OLD.price, OLD.discount, -1);
+        CALL rollup_store_item(NEW.store_name, NEW.price, NEW.discount, 1);
+        CALL rollup_piece_price(OLD.clothing_id, OLD.price, -1);
+        CALL rollup_piece_price(NEW.clothing_id, NEW.price, 1);
+    END IF;
+END !
+
+CREATE TRIGGER store_item_removed AFTER DELETE
+    ON store_closet FOR EACH ROW
+BEGIN
+    IF @skip_rollups IS NULL THEN
+        CALL rollup_store_item(OLD.store_name, OLD.price, OLD.discount, -1);
+        CALL rollup_piece_price(OLD.clothing_id, OLD.price, -1);
+    END IF;
+END !
+
+CREATE TRIGGER outfit_piece_added AFTER INSERT
+    ON styled_outfits FOR EACH ROW
+BEGIN
+    IF @skip_rollups IS NULL THEN
+        CALL rollup_outfit_piece(NEW.outfit_id, NEW.clothing_id, 1);
+    END IF;
+END !
+
+CREATE TRIGGER outfit_piece_changed AFTER UPDATE
+    ON styled_outfits FOR EACH ROW
+BEGIN
+    IF @skip_rollups IS NULL AND (OLD.outfit_id <> NEW.outfit_id OR
+                                  OLD.clothing_id <> NEW.clothing_id) THEN
+        CALL rollup_outfit_piece(OLD.outfit_id, OLD.clothing_id, -1);
+        CALL rollup_outfit_piece(NEW.outfit_id, NEW.clothing_id, 1);
+    END IF;
+END !
+
+CREATE TRIGGER outfit_piece_removed AFTER DELETE
+    ON styled_outfits FOR EACH ROW
+BEGIN
+    IF @skip_rollups IS NULL THEN
+        CALL rollup_outfit_piece(OLD.outfit_id, OLD.clothing_id, -1);
+    END IF;
+END !
+DELIMITER ;
+
+-- Fill the summary tables from the data loaded so far
+CALL refresh_rollups();
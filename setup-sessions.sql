@@ -0,0 +1,21 @@
+-- Session tokens (see sessions.py). A user who has logged in with their
+-- password can get a token and send it instead of the password until it
+-- expires, so checking it is a primary key lookup here rather than
+-- another salted SHA-2 hash. Run after setup-permissions.sql.
+
+-- Clean up old tables
+DROP TABLE IF EXISTS sessions;
+
+CREATE TABLE sessions (
+    -- SHA-256 of the token; the token itself is never stored, so this
+    -- table cannot be used to log in
+    token_hash      BINARY(32) PRIMARY KEY,
+    username        VARCHAR(20) NOT NULL,
+    -- the role and user ID the user logged in with, so that checking a
+    -- token reads a single row
+    role            VARCHAR(30),
+    user_id         INTEGER,
+    expires_at      DATETIME NOT NULL,
+    -- for removing expired sessions
+    INDEX idx_sessions_expiry (expires_at)
+);
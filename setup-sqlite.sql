@@ -0,0 +1,187 @@
+-- Schema of the embedded SQLite backend (see backends.py): the tables of
+-- setup-closetly.sql, setup-passwords.sql, setup-permissions.sql,
+-- setup-sessions.sql and setup-waitlist.sql, with their types spelled the
+-- way SQLite understands them. The routines in setup-routines.sql,
+-- setup-passwords.sql and setup-waitlist.sql are Python functions in
+-- backends.py, and the summary tables of
+-- setup-rollups.sql are not needed: store_stats and outfit_total are
+-- computed when asked for.
+-- Run by SQLiteBackend.create, not by hand.
+
+DROP TRIGGER IF EXISTS clothes_text_insert;
+DROP TRIGGER IF EXISTS clothes_text_update;
+DROP TRIGGER IF EXISTS clothes_text_delete;
+DROP TRIGGER IF EXISTS personal_closet_delete;
+DROP TRIGGER IF EXISTS personal_closet_update;
+DROP TABLE IF EXISTS clothes_text;
+DROP TABLE IF EXISTS borrow_waitlist;
+DROP TABLE IF EXISTS styled_outfits;
+DROP TABLE IF EXISTS collab_closet;
+DROP TABLE IF EXISTS store_closet;
+DROP TABLE IF EXISTS personal_closet;
+DROP TABLE IF EXISTS clothes;
+DROP TABLE IF EXISTS user;
+DROP TABLE IF EXISTS user_info;
+DROP TABLE IF EXISTS permissions;
+DROP TABLE IF EXISTS sessions;
+
+-- AUTOINCREMENT numbers rows like AUTO_INCREMENT does, never reusing the
+-- ID of a deleted row. Columns that are looked up by value compare
+-- without regard to case (COLLATE NOCASE), like MySQL's default collation.
+CREATE TABLE user (
+    user_id           INTEGER PRIMARY KEY AUTOINCREMENT,
+    name              VARCHAR(80) NOT NULL,
+    username          VARCHAR(20) COLLATE NOCASE
+);
+
+CREATE TABLE clothes (
+    clothing_id       INTEGER PRIMARY KEY AUTOINCREMENT,
+    clothing_type     VARCHAR(100) NOT NULL COLLATE NOCASE,
+    size              VARCHAR(20) NOT NULL COLLATE NOCASE,
+    gender            CHAR(1) COLLATE NOCASE,
+    color             VARCHAR(50) COLLATE NOCASE,
+    brand             VARCHAR(150) COLLATE NOCASE,
+    description       VARCHAR(250),
+    image_url         VARCHAR(250),
+    aesthetic         VARCHAR(200) COLLATE NOCASE,
+    store_name        VARCHAR(100) COLLATE NOCASE
+);
+
+CREATE TABLE personal_closet (
+    user_id        INTEGER REFERENCES user(user_id)
+                       ON DELETE CASCADE ON UPDATE CASCADE,
+    clothing_id    INTEGER REFERENCES clothes(clothing_id)
+                       ON DELETE CASCADE ON UPDATE CASCADE,
+    is_clean       TINYINT DEFAULT 1,
+    shared         TINYINT DEFAULT 0 NOT NULL,
+    num_wears      INTEGER,
+    PRIMARY KEY (user_id, clothing_id)
+);
+
+CREATE TABLE collab_closet (
+    user_id           INTEGER REFERENCES user(user_id)
+                          ON DELETE CASCADE ON UPDATE CASCADE,
+    -- MySQL lets this refer to personal_closet(clothing_id), which is not
+    -- unique there; SQLite only allows foreign keys to unique columns, so
+    -- the cascade from personal_closet is the trigger below
+    clothing_id       INTEGER REFERENCES clothes(clothing_id)
+                          ON DELETE CASCADE ON UPDATE CASCADE,
+    curr_condition    VARCHAR(50),
+    is_available      TINYINT DEFAULT 1 NOT NULL,
+    current_borrower  INTEGER,
+    PRIMARY KEY (user_id, clothing_id),
+    UNIQUE (clothing_id)
+);
+
+CREATE TABLE store_closet (
+    store_name        VARCHAR(100) COLLATE NOCASE,
+    clothing_id       INTEGER REFERENCES clothes(clothing_id)
+                          ON DELETE CASCADE ON UPDATE CASCADE,
+    price             NUMERIC(10, 2) NOT NULL,
+    discount          DECIMAL(4, 1) NOT NULL,
+    original_price    NUMERIC(10, 2) NOT NULL,
+    PRIMARY KEY (store_name, clothing_id)
+);
+
+CREATE TABLE styled_outfits (
+    outfit_id       INTEGER,
+    clothing_id     INTEGER REFERENCES clothes(clothing_id)
+                        ON DELETE CASCADE ON UPDATE CASCADE,
+    outfit_desc     VARCHAR(250),
+    vibe            VARCHAR(250),
+    PRIMARY KEY (outfit_id, clothing_id)
+);
+
+CREATE TABLE user_info (
+    username        VARCHAR(20) COLLATE NOCASE PRIMARY KEY,
+    salt            CHAR(8) NOT NULL,
+    password_hash   CHAR(64) NOT NULL
+);
+
+CREATE TABLE permissions (
+    username         VARCHAR(80) COLLATE NOCASE PRIMARY KEY,
+    role             VARCHAR(30)
+);
+
+CREATE TABLE sessions (
+    token_hash      BLOB PRIMARY KEY,
+    username        VARCHAR(20) NOT NULL COLLATE NOCASE,
+    role            VARCHAR(30),
+    user_id         INTEGER,
+    -- UTC, as datetime('now') writes it
+    expires_at      TEXT NOT NULL
+);
+
+CREATE TABLE borrow_waitlist (
+    clothing_id     INTEGER REFERENCES clothes(clothing_id)
+                        ON DELETE CASCADE ON UPDATE CASCADE,
+    user_id         INTEGER REFERENCES user(user_id)
+                        ON DELETE CASCADE ON UPDATE CASCADE,
+    -- UTC with milliseconds, so that it sorts as text
+    enqueued_at     TEXT NOT NULL
+                        DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now')),
+    PRIMARY KEY (clothing_id, user_id)
+);
+
+CREATE TRIGGER personal_closet_delete AFTER DELETE ON personal_closet
+BEGIN
+    DELETE FROM collab_closet WHERE clothing_id = OLD.clothing_id;
+END;
+
+CREATE TRIGGER personal_closet_update AFTER UPDATE OF clothing_id
+    ON personal_closet
+BEGIN
+    UPDATE collab_closet SET clothing_id = NEW.clothing_id
+        WHERE clothing_id = OLD.clothing_id;
+END;
+
+-- The indexes of setup-closetly.sql, plus the ones InnoDB creates for
+-- foreign keys by itself
+CREATE INDEX idx_borrower ON collab_closet (current_borrower);
+CREATE INDEX idx_user_username ON user (username);
+CREATE INDEX idx_store_price ON store_closet (store_name, price);
+CREATE INDEX idx_store_discount ON store_closet (store_name, discount);
+CREATE INDEX idx_clothes_type_size_color
+    ON clothes (clothing_type, size, color);
+CREATE INDEX idx_clothes_brand_type ON clothes (brand, clothing_type);
+CREATE INDEX idx_personal_clothing ON personal_closet (clothing_id);
+CREATE INDEX idx_store_clothing ON store_closet (clothing_id);
+CREATE INDEX idx_outfit_clothing ON styled_outfits (clothing_id);
+CREATE INDEX idx_sessions_expiry ON sessions (expires_at);
+-- SQLite does not append the primary key to an index the way InnoDB
+-- does, so the tie-breaking user_id is spelled out
+CREATE INDEX idx_waitlist_queue
+    ON borrow_waitlist (clothing_id, enqueued_at, user_id);
+CREATE INDEX idx_waitlist_user ON borrow_waitlist (user_id);
+
+-- Keyword search (keyword_search in backends.py) uses an FTS5 index over
+-- the same columns as ft_clothes_text, kept up to date by triggers
+CREATE VIRTUAL TABLE clothes_text USING fts5(
+    description, brand, aesthetic,
+    content='clothes', content_rowid='clothing_id');
+
+CREATE TRIGGER clothes_text_insert AFTER INSERT ON clothes
+BEGIN
+    INSERT INTO clothes_text (rowid, description, brand, aesthetic)
+        VALUES (NEW.clothing_id, NEW.description, NEW.brand,
+                NEW.aesthetic);
+END;
+
+CREATE TRIGGER clothes_text_update AFTER UPDATE ON clothes
+BEGIN
+    INSERT INTO clothes_text (clothes_text, rowid, description, brand,
+                              aesthetic)
+        VALUES ('delete', OLD.clothing_id, OLD.description, OLD.brand,
+                OLD.aesthetic);
+    INSERT INTO clothes_text (rowid, description, brand, aesthetic)
+        VALUES (NEW.clothing_id, NEW.description, NEW.brand,
+                NEW.aesthetic);
+END;
+
+CREATE TRIGGER clothes_text_delete AFTER DELETE ON clothes
+BEGIN
+    INSERT INTO clothes_text (clothes_text, rowid, description, brand,
+                              aesthetic)
+        VALUES ('delete', OLD.clothing_id, OLD.description, OLD.brand,
+                OLD.aesthetic);
+END;
@@ -0,0 +1,118 @@
+-- Waitlists for collaborative closet items. A user who cannot borrow an
+-- item because someone else has it joins its waitlist instead of trying
+-- again and again; when the borrower returns it, it goes straight to
+-- whoever has waited longest, in the same transaction as the return.
+-- Run after setup-routines.sql.
+
+-- Clean up old tables and routines
+DROP FUNCTION IF EXISTS join_waitlist;
+DROP FUNCTION IF EXISTS return_item;
+DROP TABLE IF EXISTS borrow_waitlist;
+
+CREATE TABLE borrow_waitlist (
+    clothing_id     INTEGER,
+    user_id         INTEGER,
+    -- microseconds, so that users who join within the same second still
+    -- get their turns in order
+    enqueued_at     DATETIME(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6),
+    -- a user waits for an item at most once
+    PRIMARY KEY (clothing_id, user_id),
+    -- each item's queue in order: the next waiter is the first entry for
+    -- the item (ties are broken by user_id, which InnoDB appends to every
+    -- secondary index as part of the primary key)
+    INDEX idx_waitlist_queue (clothing_id, enqueued_at),
+    -- a user's waits, and the foreign key below
+    INDEX idx_waitlist_user (user_id),
+    FOREIGN KEY (clothing_id) REFERENCES clothes(clothing_id)
+        ON DELETE CASCADE ON UPDATE CASCADE,
+    FOREIGN KEY (user_id) REFERENCES user(user_id)
+        ON DELETE CASCADE ON UPDATE CASCADE
+);
+
+-- Borrows an item if it is available, like borrow_item, or else adds the
+-- user to its waitlist. Returns 0 if the item was borrowed, the user's
+-- place in the queue (1 is next) if they are waiting for it, and -1 if
+-- they cannot borrow it at all: it is not in the collaborative closet, it
+-- is their own, or they already have it. The item's row is locked first,
+-- so a return of the same item either happens before (and the item is
+-- borrowed) or after (and the user is in the queue it hands out from).
+-- The caller must commit.
+DELIMITER !
+CREATE FUNCTION join_waitlist (waiter_id INTEGER, item_id INTEGER)
+RETURNS INTEGER NOT DETERMINISTIC MODIFIES SQL DATA
+BEGIN
+    DECLARE owner_id INTEGER DEFAULT NULL;
+    DECLARE borrower_id INTEGER DEFAULT NULL;
+    DECLARE available TINYINT DEFAULT 0;
+    DECLARE joined_at DATETIME(6);
+    DECLARE place INTEGER;
+    DECLARE CONTINUE HANDLER FOR NOT FOUND SET owner_id = NULL;
+
+    SELECT c.user_id, c.current_borrower, c.is_available
+        INTO owner_id, borrower_id, available
+        FROM collab_closet AS c WHERE c.clothing_id = item_id
+        FOR UPDATE;
+    IF owner_id IS NULL OR owner_id = waiter_id
+       OR borrower_id <=> waiter_id THEN
+        RETURN -1;
+    END IF;
+    IF available = 1 THEN
+        UPDATE collab_closet AS c
+            SET c.is_available = 0, c.current_borrower = waiter_id
+            WHERE c.clothing_id = item_id;
+        RETURN 0;
+    END IF;
+
+    -- joining again keeps the user's place
+    INSERT IGNORE INTO borrow_waitlist (clothing_id, user_id)
+        VALUES (item_id, waiter_id);
+    SELECT w.enqueued_at INTO joined_at FROM borrow_waitlist AS w
+        WHERE w.clothing_id = item_id AND w.user_id = waiter_id;
+    SELECT COUNT(*) INTO place FROM borrow_waitlist AS w
+        WHERE w.clothing_id = item_id
+          AND (w.enqueued_at < joined_at
+               OR (w.enqueued_at = joined_at AND w.user_id <= waiter_id));
+    RETURN place;
+END !
+DELIMITER ;
+
+-- Returns an item to the collaborative closet. If anyone is waiting for
+-- it, it is lent to the first of them, who is taken off the waitlist, and
+-- their user_id is returned; otherwise it becomes available and 0 is
+-- returned. Returns -1 if the user was not borrowing the item. Reading
+-- the head of the queue is a single lookup in idx_waitlist_queue. The
+-- caller must commit.
+DELIMITER !
+CREATE FUNCTION return_item (borrower_id INTEGER, item_id INTEGER)
+RETURNS INTEGER NOT DETERMINISTIC MODIFIES SQL DATA
+BEGIN
+    DECLARE holder_id INTEGER DEFAULT NULL;
+    DECLARE next_id INTEGER DEFAULT NULL;
+    DECLARE CONTINUE HANDLER FOR NOT FOUND BEGIN END;
+
+    SELECT c.current_borrower INTO holder_id
+        FROM collab_closet AS c
+        WHERE c.clothing_id = item_id AND c.is_available = 0
+        FOR UPDATE;
+    IF NOT holder_id <=> borrower_id THEN
+        RETURN -1;
+    END IF;
+
+    SELECT w.user_id INTO next_id FROM borrow_waitlist AS w
+        WHERE w.clothing_id = item_id
+        ORDER BY w.enqueued_at, w.user_id LIMIT 1
+        FOR UPDATE;
+    IF next_id IS NULL THEN
+        UPDATE collab_closet AS c
+            SET c.is_available = 1, c.current_borrower = NULL
+            WHERE c.clothing_id = item_id;
+        RETURN 0;
+    END IF;
+
+    DELETE FROM borrow_waitlist
+        WHERE clothing_id = item_id AND user_id = next_id;
+    UPDATE collab_closet AS c SET c.current_borrower = next_id
+        WHERE c.clothing_id = item_id;
+    RETURN next_id;
+END !
+DELIMITER ;
@@ -0,0 +1,471 @@
+"""
+Registry of every SQL statement the Closetly app issues. Statements are
+run as server-side prepared statements, and each connection keeps one
+prepared cursor per statement, so MySQL only parses and plans a query the
+first time it is used on a connection. Parameters use %s placeholders.
+
+Every statement is timed and counted in metrics.METRICS (see metrics.py).
+
+A connection with a statements attribute (see backends.SQLiteConnection)
+looks statements up there instead, so that another database can run its
+own version of a statement under the same name.
+"""
+import time
+import weakref
+
+import metrics
+
+# Database account (user, password) that runs the statements for each
+# role, keyed by the role stored in permissions. See
+# grant-permissions.sql for what each account is allowed to do.
+DB_ACCOUNTS = {
+    'storeowner': ('storeowner', 'storeownerpw'),
+    'stylist': ('stylist', 'stylistpw'),
+    'personal': ('personal', 'personalpw'),
+    'appadmin': ('appadmin', 'adminpw'),
+}
+
+STATEMENTS = {
+    # ------------------------------------------------------------------
+    # Logging users in
+    # ------------------------------------------------------------------
+    # Everything needed to log in, in one round trip: whether the username
+    # exists, whether the password is right (hashed like authenticate()
+    # in setup-passwords.sql), the user's role and user ID. Parameters:
+    # password, username, username.
+    'login': """SELECT i.username IS NOT NULL,
+           COALESCE(i.password_hash = SHA2(CONCAT(i.salt, %s), 256), 0),
+           p.role,
+           (SELECT MIN(u.user_id) FROM user AS u WHERE u.username = %s)
+           FROM (SELECT %s AS username) AS given
+           LEFT JOIN user_info AS i ON i.username = given.username
+           LEFT JOIN permissions AS p ON p.username = given.username""",
+    # Session tokens (sessions.py), looked up by the SHA-256 of the token.
+    # Parameters of start_session: token hash, username, role, user ID
+    # and seconds until it expires.
+    'start_session': """INSERT INTO sessions (token_hash, username, role,
+           user_id, expires_at)
+           VALUES (%s, %s, %s, %s, NOW() + INTERVAL %s SECOND)""",
+    'check_session': """SELECT username, role, user_id FROM sessions
+           WHERE token_hash = %s AND expires_at > NOW()""",
+    'end_session': 'DELETE FROM sessions WHERE token_hash = %s',
+    'prune_sessions': 'DELETE FROM sessions WHERE expires_at <= NOW()',
+    'add_user': 'CALL sp_add_user(%s, %s)',
+    'add_to_user': 'CALL add_to_user(%s, %s)',
+    'add_permission': 'CALL user_add_permission(%s, %s)',
+
+    # ------------------------------------------------------------------
+    # Browsing closets
+    # ------------------------------------------------------------------
+    # The listing statements are paginated on clothing_id (keyset
+    # pagination): the last two parameters are the last clothing_id shown
+    # and the page size.
+    'show_all_clothes': """SELECT clothing_id, clothing_type, size, gender,
+           color, brand, description, image_url, aesthetic, store_name
+           FROM clothes
+           WHERE clothing_id > %s
+           ORDER BY clothing_id LIMIT %s""",
+    'show_personal_clothes': """SELECT clothing_id, clothing_type, size,
+           gender, color, brand, description, image_url, aesthetic,
+           is_clean, shared, num_wears
+           FROM clothes NATURAL JOIN personal_closet NATURAL JOIN user
+           WHERE username = %s""",
+    # Buffered wears (wears.py), written a batch at a time. Parameter: a
+    # JSON array of [user_id, clothing_id, wears].
+    'record_wears': """UPDATE personal_closet AS p
+           JOIN JSON_TABLE(%s, '$[*]' COLUMNS (
+               user_id INTEGER PATH '$[0]',
+               clothing_id INTEGER PATH '$[1]',
+               wears INTEGER PATH '$[2]')) AS w
+             ON p.user_id = w.user_id AND p.clothing_id = w.clothing_id
+           SET p.num_wears = COALESCE(p.num_wears, 0) + w.wears""",
+    # Shared items in the same batch worn more than 50 times are used
+    'wear_out': """UPDATE collab_closet AS c
+           JOIN JSON_TABLE(%s, '$[*]' COLUMNS (
+               user_id INTEGER PATH '$[0]',
+               clothing_id INTEGER PATH '$[1]')) AS w
+             ON c.user_id = w.user_id AND c.clothing_id = w.clothing_id
+           JOIN personal_closet AS p
+             ON p.user_id = c.user_id AND p.clothing_id = c.clothing_id
+           SET c.curr_condition = 'used'
+           WHERE p.num_wears > 50
+             AND (c.curr_condition = 'new' OR c.curr_condition IS NULL)""",
+    'show_collaborative_clothes': """SELECT user_id, clothing_id,
+           clothing_type, size, gender, color, brand, description,
+           image_url, aesthetic, curr_condition, is_available,
+           current_borrower
+           FROM collab_closet NATURAL JOIN clothes
+           WHERE clothing_id > %s
+           ORDER BY clothing_id LIMIT %s""",
+    'show_user_in_collab': """SELECT clothing_id, clothing_type, size,
+           gender, color, brand, description, image_url, aesthetic,
+           curr_condition, is_available, current_borrower
+           FROM collab_closet NATURAL JOIN clothes
+           WHERE user_id = %s""",
+    'borrow_item': 'SELECT borrow_item(%s, %s)',
+    # Waitlists (setup-waitlist.sql). Parameters: user ID, clothing ID.
+    'join_waitlist': 'SELECT join_waitlist(%s, %s)',
+    'leave_waitlist': """DELETE FROM borrow_waitlist
+           WHERE user_id = %s AND clothing_id = %s""",
+    'return_item': 'SELECT return_item(%s, %s)',
+    'show_borrowed': """SELECT clothing_id, user_id, clothing_type, size,
+           gender, color, brand, description, curr_condition
+           FROM collab_closet NATURAL JOIN clothes
+           WHERE current_borrower = %s
+           ORDER BY clothing_id""",
+    # The items a user is waiting for and their place in each queue
+    'show_waitlist': """SELECT w.clothing_id, c.clothing_type, c.size,
+           c.color, c.brand,
+           (SELECT COUNT(*) FROM borrow_waitlist AS a
+            WHERE a.clothing_id = w.clothing_id
+              AND (a.enqueued_at < w.enqueued_at
+                   OR (a.enqueued_at = w.enqueued_at
+                       AND a.user_id <= w.user_id))) AS place,
+           w.enqueued_at
+           FROM borrow_waitlist AS w
+           JOIN clothes AS c ON c.clothing_id = w.clothing_id
+           WHERE w.user_id = %s
+           ORDER BY w.enqueued_at""",
+    # Items matching any of many (clothing_type, size, color) criteria,
+    # e.g. every piece of a planned outfit, and where each one is: whose
+    # personal closet, the collaborative closet (if it can be borrowed),
+    # or which store. Parameters: a JSON array of [clothing_type, size,
+    # color] arrays (size and color may be null to match any) and the
+    # most items to return per criterion. Each criterion is one range
+    # scan of idx_clothes_type_size_color, which covers the lookup
+    # (clothing_id is in every secondary index), and the closets are
+    # reached through their clothing_id indexes. criterion is the
+    # position of the criterion in the array, from 1.
+    'find_available': """SELECT want.criterion, m.clothing_id, l.location,
+           l.user_id, l.store_name, l.available
+           FROM JSON_TABLE(%s, '$[*]' COLUMNS (
+               criterion FOR ORDINALITY,
+               clothing_type VARCHAR(100) PATH '$[0]',
+               size VARCHAR(20) PATH '$[1]',
+               color VARCHAR(50) PATH '$[2]')) AS want
+           JOIN LATERAL (
+               SELECT c.clothing_id FROM clothes AS c
+               WHERE c.clothing_type = want.clothing_type
+                 AND (want.size IS NULL OR c.size = want.size)
+                 AND (want.color IS NULL OR c.color = want.color)
+               ORDER BY c.clothing_id LIMIT %s) AS m
+           JOIN LATERAL (
+               SELECT 'personal' AS location, p.user_id,
+                      NULL AS store_name, p.is_clean AS available
+               FROM personal_closet AS p
+               WHERE p.clothing_id = m.clothing_id
+               UNION ALL
+               SELECT 'collab', cc.user_id, NULL, cc.is_available
+               FROM collab_closet AS cc
+               WHERE cc.clothing_id = m.clothing_id
+               UNION ALL
+               SELECT 'store', NULL, s.store_name, 1
+               FROM store_closet AS s
+               WHERE s.clothing_id = m.clothing_id) AS l
+           ORDER BY want.criterion, m.clothing_id, l.location""",
+    # Keyword search over the description, brand and aesthetic of every
+    # item that can be bought or borrowed, best matches first, using the
+    # FULLTEXT index ft_clothes_text. Parameters: the keywords (twice) and
+    # the number of results.
+    'keyword_search': """SELECT c.clothing_id, c.clothing_type, c.size,
+           c.color, c.brand, c.description, c.aesthetic, s.store_name,
+           s.price, cc.is_available,
+           MATCH (c.description, c.brand, c.aesthetic) AGAINST (%s)
+               AS relevance
+           FROM clothes AS c
+           LEFT JOIN store_closet AS s ON s.clothing_id = c.clothing_id
+           LEFT JOIN collab_closet AS cc ON cc.clothing_id = c.clothing_id
+           WHERE MATCH (c.description, c.brand, c.aesthetic) AGAINST (%s)
+             AND (s.clothing_id IS NOT NULL OR cc.clothing_id IS NOT NULL)
+           ORDER BY relevance DESC, c.clothing_id LIMIT %s""",
+
+    # ------------------------------------------------------------------
+    # Store inventories
+    # ------------------------------------------------------------------
+    'show_store_inventory': """SELECT clothing_id, price, discount,
+           clothing_type, size, gender, color, brand, description,
+           image_url, aesthetic
+           FROM store_closet NATURAL JOIN clothes
+           WHERE store_name = %s AND clothing_id > %s
+           ORDER BY clothing_id LIMIT %s""",
+    # store searches (search.py) are registered at run time
+    'add_store_item': """INSERT INTO store_closet (store_name, clothing_id,
+           price, discount, original_price) VALUES (%s, %s, %s, %s, %s)""",
+    'remove_store_item': """DELETE FROM store_closet
+           WHERE clothing_id = %s AND store_name = %s""",
+    # Parameters: clothing ID, buyer's user ID, selling store
+    'sell_to_user': 'CALL sell_to_user(%s, %s, %s)',
+    # Markdowns set the discount of many items at once and reprice them
+    # from their stored original price. Parameters: discount, discount,
+    # store_name, then either clothing_type and brand (each given twice,
+    # NULL to match anything) or a JSON array of clothing IDs.
+    'markdown': """UPDATE store_closet AS s
+           JOIN clothes AS c ON c.clothing_id = s.clothing_id
+           SET s.discount = %s,
+               s.price = ROUND(s.original_price * (100 - %s) / 100, 2)
+           WHERE s.store_name = %s
+             AND (%s IS NULL OR c.clothing_type = %s)
+             AND (%s IS NULL OR c.brand = %s)""",
+    'markdown_items': """UPDATE store_closet AS s
+           SET s.discount = %s,
+               s.price = ROUND(s.original_price * (100 - %s) / 100, 2)
+           WHERE s.store_name = %s
+             AND s.clothing_id IN (SELECT id FROM JSON_TABLE(%s, '$[*]'
+                 COLUMNS (id INTEGER PATH '$')) AS ids)""",
+
+    # Read from the summary table kept up to date by the triggers in
+    # setup-rollups.sql, so they cost the same however big the store is
+    'store_stats': """SELECT store_name, num_items,
+           ROUND(total_price / num_items, 2) AS avg_price,
+           ROUND(total_discount / num_items, 1) AS avg_discount
+           FROM store_stats WHERE store_name = %s""",
+
+    # ------------------------------------------------------------------
+    # Outfits
+    # ------------------------------------------------------------------
+    'next_outfit_id': """SELECT COALESCE(MAX(outfit_id), 0) + 1
+           FROM styled_outfits FOR UPDATE""",
+    # run with executemany, see below
+    'add_outfit_items': """INSERT INTO styled_outfits (outfit_id,
+           clothing_id, outfit_desc, vibe) VALUES (%s, %s, %s, %s)""",
+    'show_outfits': """SELECT outfit_id, clothing_id, outfit_desc, vibe
+           FROM styled_outfits
+           WHERE outfit_id BETWEEN %s AND %s
+           ORDER BY outfit_id, clothing_id""",
+    # total price of an outfit's pieces that are sold in stores, from the
+    # summary table in setup-rollups.sql
+    'outfit_total': """SELECT outfit_id, num_pieces, num_priced, total_price
+           FROM outfit_totals WHERE outfit_id = %s""",
+
+    # ------------------------------------------------------------------
+    # Outfit suggestions (recommend.py)
+    # ------------------------------------------------------------------
+    # Everything the model needs about the clothes added after the given
+    # clothing_id: attributes, owner (if in a personal closet), whether it
+    # can be borrowed from the collaborative closet, and whether a store
+    # sells it
+    'recommend_clothes': """SELECT c.clothing_id, c.clothing_type, c.color,
+           c.aesthetic, c.brand, c.gender,
+           (SELECT MIN(p.user_id) FROM personal_closet AS p
+            WHERE p.clothing_id = c.clothing_id),
+           EXISTS (SELECT * FROM collab_closet AS cc
+                   WHERE cc.clothing_id = c.clothing_id
+                     AND cc.is_available = 1),
+           EXISTS (SELECT * FROM store_closet AS s
+                   WHERE s.clothing_id = c.clothing_id)
+           FROM clothes AS c
+           WHERE c.clothing_id > %s
+           ORDER BY c.clothing_id""",
+    # pieces of the outfits added after the given outfit_id
+    'recommend_outfits': """SELECT outfit_id, clothing_id
+           FROM styled_outfits
+           WHERE outfit_id > %s
+           ORDER BY outfit_id, clothing_id""",
+}
+
+# Statements that only read, and so can run on a read replica (see
+# pool.RoutedConnection). Everything else goes to the primary, including
+# borrow_item, join_waitlist, return_item and next_outfit_id, which are
+# SELECTs that write or lock, and check_session, since a token must work
+# as soon as it is issued.
+READS = {
+    'login', 'show_all_clothes', 'show_personal_clothes',
+    'show_collaborative_clothes', 'show_user_in_collab', 'keyword_search',
+    'find_available', 'show_store_inventory', 'store_stats', 'show_outfits',
+    'outfit_total', 'recommend_clothes', 'recommend_outfits',
+    'show_borrowed', 'show_waitlist',
+}
+
+# Prepared cursors for each connection, keyed by statement name. Entries
+# go away with their connection.
+_cursors = weakref.WeakKeyDictionary()
+# The statement still being read on each connection, see TimedCursor
+_pending = weakref.WeakKeyDictionary()
+
+
+class TimedCursor:
+    """
+    Wraps the cursor a statement ran on, counting the rows and bytes read
+    from it. The statement is recorded in metrics.METRICS once its last
+    row has been read (or right away if it returns no rows), and if it
+    was slow, it is logged with its EXPLAIN output. Everything else is
+    passed through to the cursor.
+    """
+    def __init__(self, conn, name, params, cursor, start):
+        # weakly, so that _pending does not keep the connection alive
+        self._conn = weakref.ref(conn)
+        self._name = name
+        self._params = params
+        self._cursor = cursor
+        self._start = start
+        self._rows = 0
+        self._bytes = 0
+        self._done = False
+
+    def __getattr__(self, attr):
+        return getattr(self._cursor, attr)
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def _read(self, rows):
+        self._rows += len(rows)
+        self._bytes += metrics.rows_bytes(rows)
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is None:
+            self.finish()
+        else:
+            self._read([row])
+        return row
+
+    def fetchmany(self, size=1):
+        rows = self._cursor.fetchmany(size)
+        self._read(rows)
+        if not rows:
+            self.finish()
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._read(rows)
+        self.finish()
+        return rows
+
+    def finish(self, explain=True):
+        """
+        Records the statement. explain is False when the connection may
+        still have rows of it to read, so nothing else can run on it.
+        """
+        if self._done:
+            return
+        self._done = True
+        conn = self._conn()
+        if conn is not None and _pending.get(conn) is self:
+            del _pending[conn]
+        seconds = time.perf_counter() - self._start
+        metrics.METRICS.record_query(self._name, seconds, self._rows,
+                                     self._bytes)
+        if metrics.METRICS.is_slow(seconds):
+            plan = explain_plan(conn, self._name, self._params) \
+                if explain and conn is not None else \
+                ['(not explained: rows left unread)']
+            metrics.METRICS.log_slow(self._name, seconds, self._params, plan)
+
+
+def explain_plan(conn, name, params):
+    """
+    Returns the EXPLAIN output of the named statement as lines of text.
+    """
+    sql = registry(conn)[name]
+    if not isinstance(sql, str) or \
+            sql.split(None, 1)[0].upper() not in metrics.EXPLAINABLE:
+        return ['(not explained: not a SELECT, INSERT, UPDATE or DELETE)']
+    cursor = conn.cursor()
+    try:
+        cursor.execute('EXPLAIN ' + sql, params)
+        columns = [column[0] for column in cursor.description]
+        return [' | '.join(columns)] + \
+            [' | '.join(str(value) for value in row)
+             for row in cursor.fetchall()]
+    # the plan is only for the log, so failing to get one must not fail
+    # the statement
+    except Exception as err:
+        return ['(not explained: {})'.format(err)]
+    finally:
+        cursor.close()
+
+
+def registry(conn):
+    """
+    Returns the statements to run on the given connection by name.
+    """
+    return getattr(conn, 'statements', STATEMENTS)
+
+
+def execute(conn, name, params=()):
+    """
+    Runs the named statement on the given connection and returns the
+    prepared cursor it ran on, wrapped in a TimedCursor. The caller must
+    read every row before running another statement on the same
+    connection; fetchall and fetchone below take care of that.
+    """
+    route = getattr(conn, 'route', None)
+    if route is not None:
+        conn = route(name in READS)
+    pending = _pending.get(conn)
+    if pending is not None:
+        pending.finish(explain=False)
+    cursors = _cursors.setdefault(conn, {})
+    cursor = cursors.get(name)
+    if cursor is None:
+        cursor = conn.cursor(prepared=True)
+        cursors[name] = cursor
+    start = time.perf_counter()
+    # The connector only re-prepares when it is handed a different string
+    # object than last time, so always pass the one from the registry.
+    cursor.execute(registry(conn)[name], params)
+    timed = TimedCursor(conn, name, params, cursor, start)
+    if cursor.description is None:
+        timed.finish()
+    else:
+        _pending[conn] = timed
+    return timed
+
+
+def fetchall(conn, name, params=()):
+    """
+    Runs the named statement and returns all of its rows.
+    """
+    return execute(conn, name, params).fetchall()
+
+
+def query(conn, name, params=()):
+    """
+    Runs the named statement and returns (column names, rows).
+    """
+    cursor = execute(conn, name, params)
+    rows = cursor.fetchall()
+    return [column[0] for column in cursor.description], rows
+
+
+def fetchone(conn, name, params=()):
+    """
+    Runs the named statement and returns its first row, or None if it
+    returned no rows.
+    """
+    rows = fetchall(conn, name, params)
+    return rows[0] if rows else None
+
+
+
+def executemany(conn, name, seq_params):
+    """
+    Runs the named INSERT once for every set of parameters and returns the
+    number of rows written. This uses a plain cursor rather than a
+    prepared one, because the connector turns a plain executemany of an
+    INSERT into a single multi-row INSERT: one round trip for the whole
+    batch instead of one per row.
+    """
+    route = getattr(conn, 'route', None)
+    if route is not None:
+        conn = route(False)
+    start = time.perf_counter()
+    cursor = conn.cursor()
+    cursor.executemany(registry(conn)[name], seq_params)
+    metrics.METRICS.record_query(name, time.perf_counter() - start)
+    return cursor.rowcount
+
+
+def register(name, sql, read=False):
+    """
+    Adds a statement that is built at run time (such as a search with a
+    particular combination of filters) to the registry, so that it is
+    prepared once per connection like the others. read says whether it
+    only reads (see READS). Returns name.
+    """
+    STATEMENTS.setdefault(name, sql)
+    if read:
+        READS.add(name)
+    return name
@@ -0,0 +1,48 @@
+"""
+Plain-text tables for query results. Rows are printed as they come, a
+page at a time, with column names taken from the cursor that produced
+them, so printing a result needs neither pandas nor a copy of the rows.
+"""
+import numbers
+import sys
+
+
+def column_names(cursor):
+    """
+    Returns the names of the columns of a cursor's result.
+    """
+    return [column[0] for column in cursor.description]
+
+
+def cell(value):
+    if value is None:
+        return 'None'
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode()
+    return str(value)
+
+
+def print_table(rows, columns, start=0, file=sys.stdout):
+    """
+    Prints rows under a header of column names, numbering them from start
+    like a DataFrame index. Columns are as wide as their widest value in
+    these rows, with numbers right-aligned and text left-aligned.
+    """
+    cells = [[cell(value) for value in row] for row in rows]
+    numeric = [all(isinstance(row[i], numbers.Number) or row[i] is None
+                   for row in rows)
+               for i in range(len(columns))]
+    widths = [max([len(name)] + [len(row[i]) for row in cells])
+              for i, name in enumerate(columns)]
+    index_width = len(str(start + len(rows) - 1)) if rows else 0
+    print(' ' * index_width + '  ' + '  '.join(
+        name.rjust(width) if right else name.ljust(width)
+        for name, width, right in zip(columns, widths, numeric)).rstrip(),
+        file=file)
+    for n, row in enumerate(cells, start):
+        print(str(n).ljust(index_width) + '  ' + '  '.join(
+            value.rjust(width) if right else value.ljust(width)
+            for value, width, right in zip(row, widths, numeric)).rstrip(),
+            file=file)
+    if not rows:
+        print('(no rows)', file=file)
@@ -0,0 +1,512 @@
+"""
+Incremental columnar export of the closets for analytics, so that
+analysts can answer questions like the ones in queries.sql without
+running them against the live tables the app uses.
+
+    $ python3 warehouse.py export --out warehouse/ --password <root pw>
+    $ python3 warehouse.py query store-averages --dir warehouse/
+
+export streams clothes, store_closet, personal_closet, collab_closet and
+styled_outfits out CHUNK_ROWS rows at a time, keyset-paginated so that
+memory use does not grow with the tables, into Parquet (or Arrow IPC)
+files: one directory per table, partitioned by store or by user bucket
+(store_name=Zara/, user_bucket=7/). The first export of a table reads
+all of it; later ones only read the rows changed since, from the change
+log kept by the triggers in setup-export.sql, and add them as new files.
+Deleted rows are written as tombstones (_deleted = true).
+
+Every row carries the time of its change (_changed_at) and the export
+run that wrote it (_run), and readers keep the latest version of each
+row, which is what query does. --full rewrites a table from scratch,
+which also compacts it. Needs pyarrow (pip3 install pyarrow).
+"""
+import argparse
+import datetime
+import json
+import os
+import shutil
+import sys
+
+import mysql.connector
+
+import statements
+from tables import print_table
+
+# Rows read and written at a time
+CHUNK_ROWS = 100000
+# Changes newer than this (in seconds) are left for the next export, so
+# that a transaction still open when an export starts is not missed
+SAFETY_LAG = 60
+# personal_closet and collab_closet are partitioned by user_id modulo this
+USER_BUCKETS = 32
+# Export progress (watermarks) is kept in this file in the output directory
+STATE_FILE = '_export_state.json'
+FORMATS = {'parquet': 'parquet', 'arrow': 'ipc'}
+
+# For each exported table: its columns and Arrow types, its key, how its
+# key is stored in export_changes (store_name, id1, id2, with None for
+# unused ones), and how it is partitioned (a column, or user_bucket)
+TABLES = {
+    'clothes': {
+        'columns': [('clothing_id', 'int32'), ('clothing_type', 'string'),
+                    ('size', 'string'), ('gender', 'string'),
+                    ('color', 'string'), ('brand', 'string'),
+                    ('description', 'string'), ('image_url', 'string'),
+                    ('aesthetic', 'string'), ('store_name', 'string')],
+        'key': ['clothing_id'],
+        'log_key': (None, 'clothing_id', None),
+        'partition': 'store_name',
+    },
+    'store_closet': {
+        'columns': [('store_name', 'string'), ('clothing_id', 'int32'),
+                    ('price', 'decimal(10, 2)'),
+                    ('discount', 'decimal(4, 1)'),
+                    ('original_price', 'decimal(10, 2)')],
+        'key': ['store_name', 'clothing_id'],
+        'log_key': ('store_name', 'clothing_id', None),
+        'partition': 'store_name',
+    },
+    'personal_closet': {
+        'columns': [('user_id', 'int32'), ('clothing_id', 'int32'),
+                    ('is_clean', 'int8'), ('shared', 'int8'),
+                    ('num_wears', 'int32')],
+        'key': ['user_id', 'clothing_id'],
+        'log_key': (None, 'user_id', 'clothing_id'),
+        'partition': 'user_bucket',
+    },
+    'collab_closet': {
+        'columns': [('user_id', 'int32'), ('clothing_id', 'int32'),
+                    ('curr_condition', 'string'), ('is_available', 'int8'),
+                    ('current_borrower', 'int32')],
+        'key': ['user_id', 'clothing_id'],
+        'log_key': (None, 'user_id', 'clothing_id'),
+        'partition': 'user_bucket',
+    },
+    'styled_outfits': {
+        'columns': [('outfit_id', 'int32'), ('clothing_id', 'int32'),
+                    ('outfit_desc', 'string'), ('vibe', 'string')],
+        'key': ['outfit_id', 'clothing_id'],
+        'log_key': (None, 'outfit_id', 'clothing_id'),
+        'partition': None,
+    },
+}
+
+LOG_COLUMNS = ('store_name', 'id1', 'id2')
+
+
+# ----------------------------------------------------------------------
+# Statements
+# ----------------------------------------------------------------------
+def after_key(key, alias):
+    """
+    Returns a predicate for rows whose key comes after the given values
+    (one %s per key column, then again for all but the last), for keyset
+    pagination on a composite key.
+    """
+    terms = []
+    for i, column in enumerate(key):
+        equal = [alias + '.' + previous + ' = %s' for previous in key[:i]]
+        terms.append('(' + ' AND '.join(equal + [alias + '.' + column +
+                                                 ' > %s']) + ')')
+    return '(' + ' OR '.join(terms) + ')'
+
+
+def after_key_params(key_values):
+    params = []
+    for i in range(len(key_values)):
+        params.extend(key_values[:i + 1])
+    return tuple(params)
+
+
+def register_statements(table):
+    """
+    Registers the statements that export a table with statements.py and
+    returns their names: the first and next chunks of a full read, and a
+    chunk of changed rows.
+    """
+    spec = TABLES[table]
+    columns = [name for name, _ in spec['columns']]
+    key = spec['key']
+    select = ', '.join('t.' + column for column in columns)
+    order = ', '.join('t.' + column for column in key)
+    first = statements.register(
+        'warehouse:first:' + table,
+        """SELECT {}, %s, 0 FROM {} AS t
+           ORDER BY {} LIMIT {}""".format(select, table, order, CHUNK_ROWS),
+        read=True)
+    following = statements.register(
+        'warehouse:next:' + table,
+        """SELECT {}, %s, 0 FROM {} AS t
+           WHERE {}
+           ORDER BY {} LIMIT {}""".format(select, table, after_key(key, 't'),
+                                          order, CHUNK_ROWS),
+        read=True)
+
+    # changed rows are joined back to the table for their current values;
+    # rows that are gone are tombstones, with only their key filled in
+    logged = dict(zip(spec['log_key'], LOG_COLUMNS))
+    logged.pop(None, None)
+    on = ' AND '.join('t.{} = ch.{}'.format(column, log_column)
+                      for column, log_column in logged.items())
+    values = ', '.join('ch.' + logged[column] if column in logged
+                       else 't.' + column for column in columns)
+    changes = statements.register(
+        'warehouse:changes:' + table,
+        """SELECT {}, ch.changed_at, t.{} IS NULL,
+                  ch.store_name, ch.id1, ch.id2
+           FROM export_changes AS ch
+           LEFT JOIN {} AS t ON {}
+           WHERE ch.table_name = %s
+             AND (ch.changed_at > %s OR (ch.changed_at = %s AND
+                  (ch.store_name, ch.id1, ch.id2) > (%s, %s, %s)))
+             AND ch.changed_at < %s
+             AND ch.id1 >= 0
+           ORDER BY ch.changed_at, ch.store_name, ch.id1, ch.id2
+           LIMIT {}""".format(values, key[0], table, on, CHUNK_ROWS),
+        read=True)
+    return first, following, changes
+
+
+statements.register('warehouse:now', 'SELECT NOW(6) - INTERVAL %s SECOND',
+                    read=True)
+statements.register('warehouse:reloaded', """SELECT changed_at
+       FROM export_changes
+       WHERE table_name = %s AND store_name = '' AND id1 = -1 AND id2 = 0""",
+                    read=True)
+statements.register('warehouse:prune', """DELETE FROM export_changes
+       WHERE table_name = %s AND changed_at < %s AND id1 >= 0""")
+
+
+# ----------------------------------------------------------------------
+# Writing files
+# ----------------------------------------------------------------------
+def arrow_schema(table):
+    import pyarrow as pa
+
+    def arrow_type(name):
+        if name.startswith('decimal'):
+            precision, scale = name[8:-1].split(',')
+            return pa.decimal128(int(precision), int(scale))
+        return getattr(pa, name)()
+
+    spec = TABLES[table]
+    fields = [pa.field(name, arrow_type(kind))
+              for name, kind in spec['columns']]
+    fields += [pa.field('_changed_at', pa.timestamp('us')),
+               pa.field('_deleted', pa.bool_()),
+               pa.field('_run', pa.int32())]
+    if spec['partition'] == 'user_bucket':
+        fields.append(pa.field('user_bucket', pa.int32()))
+    return pa.schema(fields)
+
+
+def write_chunk(rows, table, path, file_format, run, chunk):
+    """
+    Writes rows of (table columns..., _changed_at, _deleted) to the
+    table's directory, split into partitions.
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    spec = TABLES[table]
+    schema = arrow_schema(table)
+    width = len(spec['columns']) + 2
+    columns = list(zip(*(row[:width] for row in rows)))
+    data = {}
+    for field, values in zip(schema, columns):
+        data[field.name] = [value.decode()
+                            if isinstance(value, (bytes, bytearray))
+                            else value for value in values]
+    data['_deleted'] = [bool(value) for value in data['_deleted']]
+    data['_run'] = [run] * len(rows)
+    partitioning = None
+    if spec['partition'] == 'user_bucket':
+        data['user_bucket'] = [user_id % USER_BUCKETS
+                               for user_id in data['user_id']]
+    if spec['partition']:
+        partitioning = ds.partitioning(
+            pa.schema([schema.field(spec['partition'])]), flavor='hive')
+    ds.write_dataset(
+        pa.Table.from_pydict(data, schema=schema), path,
+        format=FORMATS[file_format], partitioning=partitioning,
+        basename_template='run{:05d}-chunk{:05d}-{{i}}.{}'.format(
+            run, chunk, file_format),
+        existing_data_behavior='overwrite_or_ignore')
+
+
+# ----------------------------------------------------------------------
+# Exporting
+# ----------------------------------------------------------------------
+def stamp(moment):
+    """
+    Returns a change time as text that sorts like the time itself.
+    """
+    return moment.strftime('%Y-%m-%d %H:%M:%S.%f')
+
+
+def load_state(out):
+    try:
+        with open(os.path.join(out, STATE_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'runs': 0, 'tables': {}}
+
+
+def save_state(out, state):
+    path = os.path.join(out, STATE_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def export_table(conn, table, out, state, run, full=False, prune=False,
+                 file_format='parquet', report=sys.stderr):
+    """
+    Exports a table's changes since the last export, or all of it if it
+    was never exported, was reloaded in bulk since (see log_reload in
+    setup-export.sql), or full is set. Returns the number of rows written.
+    """
+    first, following, changes = register_statements(table)
+    spec = TABLES[table]
+    path = os.path.join(out, table)
+    done = state['tables'].get(table)
+    upper = statements.fetchone(conn, 'warehouse:now', (SAFETY_LAG,))[0]
+    reloaded = statements.fetchone(conn, 'warehouse:reloaded', (table,))
+    if done is not None and reloaded is not None:
+        full = full or stamp(reloaded[0]) > done['watermark'][0]
+    full = full or done is None or done.get('format') != file_format
+    rows_written = chunk = 0
+    if full:
+        # rows are stamped with the watermark, so that any change logged
+        # after it (even one the read below already saw) replaces them
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        rows = statements.fetchall(conn, first, (upper,))
+        while rows:
+            write_chunk(rows, table, path, file_format, run, chunk)
+            rows_written += len(rows)
+            chunk += 1
+            if len(rows) < CHUNK_ROWS:
+                break
+            last = rows[-1][:len(spec['key'])]
+            rows = statements.fetchall(
+                conn, following, (upper,) + after_key_params(last))
+        watermark = [stamp(upper), '', -1, -1]
+    else:
+        watermark = done['watermark']
+        while True:
+            rows = statements.fetchall(
+                conn, changes, (table, watermark[0], watermark[0]) +
+                tuple(watermark[1:]) + (upper,))
+            if not rows:
+                break
+            write_chunk(rows, table, path, file_format, run, chunk)
+            rows_written += len(rows)
+            chunk += 1
+            # rows end with changed_at, the tombstone flag and the log key
+            last = rows[-1]
+            watermark = [stamp(last[-5])] + [
+                value.decode() if isinstance(value, (bytes, bytearray))
+                else value for value in last[-3:]]
+            if len(rows) < CHUNK_ROWS:
+                break
+        # everything up to upper has been read now
+        if stamp(upper) > watermark[0]:
+            watermark = [stamp(upper), '', -1, -1]
+    if prune:
+        statements.execute(conn, 'warehouse:prune', (table, watermark[0]))
+    conn.commit()
+    state['tables'][table] = {'watermark': watermark, 'format': file_format,
+                              'exported_at':
+                                  datetime.datetime.now().isoformat()}
+    print('{:<16} {:>10} rows {}'.format(
+        table, rows_written, 'full' if full else 'changed'), file=report)
+    return rows_written
+
+
+def export(conn, out, tables=None, full=False, prune=False,
+           file_format='parquet', report=sys.stderr):
+    """
+    Exports every table (or the given ones) to the out directory. Returns
+    {table: rows written}.
+    """
+    os.makedirs(out, exist_ok=True)
+    state = load_state(out)
+    state['runs'] += 1
+    results = {}
+    for table in tables or TABLES:
+        results[table] = export_table(conn, table, out, state, state['runs'],
+                                      full, prune, file_format, report)
+        save_state(out, state)
+    return results
+
+
+# ----------------------------------------------------------------------
+# Reading the files back
+# ----------------------------------------------------------------------
+def read_table(directory, table, columns=None):
+    """
+    Returns the current rows of an exported table as a pyarrow Table: the
+    latest version of each row, without deleted rows or export columns.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+
+    spec = TABLES[table]
+    state = load_state(directory)
+    file_format = state['tables'].get(table, {}).get('format', 'parquet')
+    names = [name for name, _ in spec['columns']]
+    dataset = ds.dataset(os.path.join(directory, table),
+                         format=FORMATS[file_format], partitioning='hive',
+                         schema=arrow_schema(table))
+    data = dataset.to_table(columns=names + ['_changed_at', '_deleted',
+                                             '_run'])
+    data = data.sort_by([(name, 'ascending') for name in spec['key']] +
+                        [('_changed_at', 'ascending'),
+                         ('_run', 'ascending')])
+    if len(data):
+        # the latest version of a row is the last one before its key changes
+        last = None
+        for name in spec['key']:
+            column = data.column(name).combine_chunks()
+            changed = pc.not_equal(column.slice(0, len(data) - 1),
+                                   column.slice(1))
+            last = changed if last is None else pc.or_(last, changed)
+        last = pa.concat_arrays([last, pa.array([True])])
+        data = data.filter(pc.and_(last, pc.invert(data.column('_deleted'))))
+    return data.select(columns or names)
+
+
+def aggregate(data, keys, aggregations, names):
+    """
+    Groups data by keys and returns the keys followed by the aggregations
+    (as in Table.group_by), named names.
+    """
+    import pyarrow as pa
+    grouped = data.group_by(keys).aggregate(aggregations)
+    columns = keys + ['{}_{}'.format(column, function)
+                      for column, function in aggregations]
+    return pa.table([grouped[column] for column in columns],
+                    names=keys + names)
+
+
+def prices(data):
+    """
+    Returns store_closet data with price and discount as floats.
+    """
+    import pyarrow.compute as pc
+    for name in ('price', 'discount'):
+        if name in data.column_names:
+            data = data.set_column(data.column_names.index(name), name,
+                                   pc.cast(data[name], 'float64'))
+    return data
+
+
+def store_averages(directory):
+    store = prices(read_table(directory, 'store_closet',
+                              ['store_name', 'price', 'discount']))
+    return aggregate(store, ['store_name'],
+                     [('price', 'mean'), ('discount', 'mean')],
+                     ['avg_price', 'avg_discount'])
+
+
+def small_sale_items(directory):
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    clothes = read_table(directory, 'clothes')
+    clothes = clothes.filter(pc.is_in(clothes['size'],
+                                      value_set=pa.array(['S', '4'])))
+    store = read_table(directory, 'store_closet')
+    store = store.filter(pc.greater(store['discount'], 0))
+    return store.join(clothes.drop_columns(['store_name']),
+                      'clothing_id', join_type='inner').select(
+        ['store_name', 'clothing_id', 'clothing_type', 'price', 'discount',
+         'color', 'brand', 'description'])
+
+
+def loaning(directory):
+    import pyarrow.compute as pc
+    collab = read_table(directory, 'collab_closet',
+                        ['user_id', 'current_borrower'])
+    collab = collab.filter(pc.is_valid(collab['current_borrower']))
+    return aggregate(collab, ['user_id'], [('current_borrower', 'count')],
+                     ['num_clothes_loaning'])
+
+
+def outfit_totals(directory):
+    outfits = read_table(directory, 'styled_outfits',
+                         ['outfit_id', 'clothing_id'])
+    store = prices(read_table(directory, 'store_closet',
+                              ['clothing_id', 'price']))
+    return aggregate(outfits.join(store, 'clothing_id', join_type='inner'),
+                     ['outfit_id'], [('price', 'sum')], ['total_price'])
+
+
+def sale_outfits(directory):
+    import pyarrow.compute as pc
+    store = read_table(directory, 'store_closet',
+                       ['clothing_id', 'discount'])
+    on_sale = pc.unique(store.filter(
+        pc.greater(store['discount'], 0))['clothing_id'])
+    outfits = read_table(directory, 'styled_outfits')
+    outfits = outfits.filter(pc.is_in(outfits['clothing_id'],
+                                      value_set=on_sale))
+    return aggregate(outfits, ['outfit_id', 'outfit_desc', 'vibe'], [], [])
+
+
+# Aggregates from queries.sql that can be answered from the files
+QUERIES = {
+    'store-averages': store_averages,
+    'small-sale-items': small_sale_items,
+    'loaning': loaning,
+    'outfit-totals': outfit_totals,
+    'sale-outfits': sale_outfits,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the closets to ' +
+                                     'columnar files and query them')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    out = commands.add_parser('export', help='export the rows changed ' +
+                              'since the last export')
+    out.add_argument('--out', default='warehouse',
+                     help='output directory (default: %(default)s)')
+    out.add_argument('--format', choices=sorted(FORMATS), default='parquet')
+    out.add_argument('--tables', nargs='+', choices=list(TABLES))
+    out.add_argument('--full', action='store_true',
+                     help='rewrite the tables from scratch')
+    out.add_argument('--prune', action='store_true',
+                     help='delete exported changes from the change log; ' +
+                          'only when this is the only export directory')
+    out.add_argument('--host', default='localhost')
+    out.add_argument('--port', type=int, default=3306)
+    out.add_argument('--user', default='root')
+    out.add_argument('--password', default='')
+    out.add_argument('--database', default='closetly')
+
+    query = commands.add_parser('query', help='answer an aggregate from ' +
+                                'queries.sql from the exported files')
+    query.add_argument('name', choices=list(QUERIES))
+    query.add_argument('--dir', default='warehouse',
+                       help='export directory (default: %(default)s)')
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        conn = mysql.connector.connect(host=args.host, port=args.port,
+                                       user=args.user,
+                                       password=args.password,
+                                       database=args.database)
+        export(conn, args.out, args.tables, args.full, args.prune,
+               args.format)
+        conn.close()
+    else:
+        result = QUERIES[args.name](args.dir)
+        print_table([list(row.values()) for row in result.to_pylist()],
+                    result.column_names)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+"""
+Buffered wear logging. Recording that someone wore an item only adds to
+a count in memory (and to a local journal file, if there is one); the
+counts are written to personal_closet.num_wears later, for many items
+per UPDATE, once enough wears have been recorded or the oldest one has
+waited long enough. Wearing the same item many times between flushes
+changes its row once.
+
+The same flush marks the shared items in the batch that have now been
+worn more than 50 times as 'used' in the collaborative closet (if they
+were 'new' or had no condition), with one UPDATE for the whole batch.
+This replaces the condition_update trigger, which did the same one row
+at a time.
+"""
+import json
+import os
+import threading
+import time
+
+import statements
+
+# Items per UPDATE when writing a batch
+FLUSH_ROWS = 1000
+
+
+class WearBuffer:
+    """
+    Wear counts per (user_id, clothing_id) waiting to be written.
+
+    A flush is due once max_events wears have been recorded or the oldest
+    one is max_seconds old. If journal is a path, every wear is appended
+    to it as it is recorded, and wears left in it by a process that
+    stopped before flushing are read back on start. The journal is
+    rotated to journal.flushing while a batch is being written and
+    removed once the batch is committed, so a process that stops in
+    between may count that batch again on start (wears are written at
+    least once).
+    """
+    def __init__(self, max_events=1000, max_seconds=5.0, journal=None,
+                 clock=time.monotonic):
+        self.max_events = max_events
+        self.max_seconds = max_seconds
+        self.journal = journal
+        self.clock = clock
+        # (user_id, clothing_id) -> wears not written yet
+        self.pending = {}
+        self.events = 0
+        self.first_at = None
+        # whether a batch taken by take() has not been done() yet
+        self.flushing = False
+        self.lock = threading.Lock()
+        self.recorded = 0
+        self.written = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.file = None
+        if journal is not None:
+            self._recover()
+            self.file = open(journal, 'a')
+
+    def _recover(self):
+        """
+        Reads back the wears left in the journal (and in a batch that was
+        being written), and rewrites them to the journal coalesced.
+        """
+        for path in (self.journal + '.flushing', self.journal):
+            try:
+                with open(path) as f:
+                    for line in f:
+                        fields = line.split()
+                        # a line cut short by a crash is skipped
+                        if len(fields) == 3:
+                            self._add(*map(int, fields))
+            except FileNotFoundError:
+                pass
+        with open(self.journal + '.tmp', 'w') as f:
+            f.writelines('{} {} {}\n'.format(user_id, clothing_id, wears)
+                         for (user_id, clothing_id), wears
+                         in self.pending.items())
+        os.replace(self.journal + '.tmp', self.journal)
+        if os.path.exists(self.journal + '.flushing'):
+            os.remove(self.journal + '.flushing')
+
+    def _add(self, user_id, clothing_id, wears):
+        key = (user_id, clothing_id)
+        self.pending[key] = self.pending.get(key, 0) + wears
+        self.events += wears
+        if self.first_at is None:
+            self.first_at = self.clock()
+
+    def record(self, user_id, clothing_id, wears=1):
+        """
+        Records that a user wore an item from their closet, wears times.
+        Returns whether a flush is due.
+        """
+        user_id, clothing_id, wears = int(user_id), int(clothing_id), \
+            int(wears)
+        if wears < 1:
+            raise ValueError('wears must be at least 1')
+        with self.lock:
+            if self.file is not None:
+                self.file.write('{} {} {}\n'.format(user_id, clothing_id,
+                                                    wears))
+                self.file.flush()
+            self._add(user_id, clothing_id, wears)
+            self.recorded += wears
+            return self._due()
+
+    def _due(self):
+        return not self.flushing and (
+            self.events >= self.max_events or
+            (self.first_at is not None and
+             self.clock() - self.first_at >= self.max_seconds))
+
+    def due(self):
+        with self.lock:
+            return self._due()
+
+    def take(self):
+        """
+        Empties the buffer and returns what was in it as a list of
+        [user_id, clothing_id, wears], sorted so that concurrent flushes
+        lock rows in the same order. Returns an empty list if there is
+        nothing to write or another batch is still being written. Call
+        done with the batch once it has been written (or has failed).
+        """
+        with self.lock:
+            if self.flushing or not self.pending:
+                return []
+            batch = sorted([user_id, clothing_id, wears]
+                           for (user_id, clothing_id), wears
+                           in self.pending.items())
+            self.pending = {}
+            self.events = 0
+            self.first_at = None
+            self.flushing = True
+            if self.file is not None:
+                self.file.close()
+                os.replace(self.journal, self.journal + '.flushing')
+                self.file = open(self.journal, 'a')
+            return batch
+
+    def done(self, batch, ok=True):
+        """
+        Finishes a batch returned by take. If it could not be written, its
+        wears go back in the buffer to be written with the next one.
+        """
+        with self.lock:
+            self.flushing = False
+            if ok:
+                self.flushes += 1
+                self.written += sum(wears for _, _, wears in batch)
+            else:
+                self.failed_flushes += 1
+                for user_id, clothing_id, wears in batch:
+                    self._add(user_id, clothing_id, wears)
+                    if self.file is not None:
+                        self.file.write('{} {} {}\n'.format(
+                            user_id, clothing_id, wears))
+                if self.file is not None:
+                    self.file.flush()
+            if self.file is not None:
+                os.remove(self.journal + '.flushing')
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    def stats(self):
+        with self.lock:
+            return {'pending_items': len(self.pending),
+                    'pending_wears': self.events,
+                    'recorded': self.recorded, 'written': self.written,
+                    'flushes': self.flushes,
+                    'failed_flushes': self.failed_flushes}
+
+
+def write(conn, batch, rows=FLUSH_ROWS):
+    """
+    Adds a batch of [user_id, clothing_id, wears] to num_wears and marks
+    the shared items among them that are now worn out as used, in one
+    transaction. Wears of items that are not in the user's closet are
+    dropped. Returns the number of personal_closet rows updated.
+    """
+    updated = 0
+    try:
+        for i in range(0, len(batch), rows):
+            chunk = json.dumps(batch[i:i + rows])
+            updated += statements.execute(conn, 'record_wears',
+                                          (chunk,)).rowcount
+            statements.execute(conn, 'wear_out', (chunk,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return updated
+
+
+def flush(conn, buffer):
+    """
+    Writes everything in a WearBuffer on the given connection. Returns the
+    number of personal_closet rows updated.
+    """
+    batch = buffer.take()
+    if not batch:
+        return 0
+    try:
+        updated = write(conn, batch)
+    except Exception:
+        buffer.done(batch, ok=False)
+        raise
+    buffer.done(batch)
+    return updated